@@ -0,0 +1,77 @@
+"""
+Compares Program.evaluate with Program.compile on the Kandinsky tasks.
+
+Enumerates every program of the tasks' request type below an MDL bound, then
+runs each program on every example input of every task, once through the
+recursive interpreter and once through compiled closures (compilation time
+included), and reports programs/second for both.
+
+    python bin/benchmark_evaluation.py --tasks data/kandinsky_dc_tasks/support
+"""
+
+try:
+    import binutil  # required to import from dreamcoder modules
+except ModuleNotFoundError:
+    import bin.binutil  # alt import if called as module
+
+import argparse
+import time
+
+from dreamcoder.domains.relation.parse_relation_tasks import parse_relation_tasks
+from dreamcoder.domains.relation.relation_primitives import get_kandinsky_primitives
+from dreamcoder.grammar import Grammar
+from dreamcoder.program import CompileVisitor
+from dreamcoder.type import Context
+
+
+def run(programs, inputs, makeFunction):
+    outputs = []
+    start = time.time()
+    for p in programs:
+        try:
+            f = makeFunction(p)
+        except Exception:
+            outputs.append(None)
+            continue
+        ys = []
+        for xs in inputs:
+            try:
+                y = f
+                for x in xs:
+                    y = y(x)
+            except Exception:
+                y = None
+            ys.append(y)
+        outputs.append(ys)
+    return time.time() - start, outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", default="data/kandinsky_dc_tasks/support")
+    parser.add_argument("--upperBound", type=float, default=13.0)
+    arguments = parser.parse_args()
+
+    tasks = parse_relation_tasks(path=arguments.tasks)
+    request = tasks[0].request
+    inputs = [xs for t in tasks if t.request == request for xs, _ in t.examples]
+    grammar = Grammar.uniform(get_kandinsky_primitives())
+    programs = [
+        p
+        for _, _, p in grammar.enumeration(
+            Context.EMPTY, [], request, upperBound=arguments.upperBound, maximumDepth=99
+        )
+    ]
+    print(
+        "%d programs of type %s, %d example inputs"
+        % (len(programs), request, len(inputs))
+    )
+
+    interpretedTime, interpreted = run(programs, inputs, lambda p: p.evaluate([]))
+    CompileVisitor.shared = CompileVisitor()
+    compiledTime, compiled = run(programs, inputs, lambda p: p.compile())
+    assert interpreted == compiled, "compiled programs disagree with evaluate"
+
+    print("evaluate: %f programs/second" % (len(programs) / interpretedTime))
+    print("compile:  %f programs/second" % (len(programs) / compiledTime))
+    print("speedup:  %fx" % (interpretedTime / compiledTime))
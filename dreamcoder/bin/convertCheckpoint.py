@@ -0,0 +1,29 @@
+"""
+Converts pickled ECResult checkpoints into checkpoint stores, which
+loadCheckpoint reads one field at a time. The store is written next to the
+pickle, with the suffix .checkpoint instead of .pickle, and loadCheckpoint
+uses it from then on when given the path of the pickle.
+
+Usage: python bin/convertCheckpoint.py experimentOutputs/.../*.pickle
+"""
+
+try:
+    import binutil  # required to import from dreamcoder modules
+except ModuleNotFoundError:
+    import bin.binutil  # alt import if called as module
+
+# Required import for unpickling older checkpoints:
+from dreamcoder.dreamcoder import *
+from dreamcoder.checkpoint import convertCheckpoint
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument("checkpoints", nargs="+", help="pickled checkpoints")
+    arguments = parser.parse_args()
+
+    for path in arguments.checkpoints:
+        store = convertCheckpoint(path)
+        print("Converted", path)
+        print("       to", store.path)
@@ -14,6 +14,7 @@ import pregex as pre
 from dreamcoder.domains.regex.groundtruthRegexes import *
 from dreamcoder.domains.regex.makeRegexTasks import regexHeldOutExamples
 from dreamcoder.domains.regex.regexPrimitives import PRC
+from dreamcoder.checkpoint import loadCheckpoint
 from dreamcoder.program import Abstraction, Application
 from dreamcoder.utilities import *
 
@@ -189,8 +190,7 @@ if __name__ == "__main__":
 
     print("started:", flush=True)
 
-    with open(checkpoint_file, "rb") as file:
-        checkpoint = pickle.load(file)
+    checkpoint = loadCheckpoint(checkpoint_file)
 
     tasks = checkpoint.testSearchTime.keys()  # recognitionTaskMetrics.keys()
     from dreamcoder.likelihoodModel import add_cutoff_values
@@ -6,6 +6,7 @@ except ModuleNotFoundError:
 import dill
 import matplotlib
 
+from dreamcoder.checkpoint import loadCheckpoint
 from dreamcoder.dreamcoder import *
 
 matplotlib.use("Agg")
@@ -22,9 +23,8 @@ from dreamcoder.domains.tower.main import TowerCNN
 
 
 def loadfun(x):
-    with open(x, "rb") as handle:
-        result = dill.load(handle)
-    return result
+    # Only the fields that are used are read from checkpoint stores
+    return loadCheckpoint(x)
 
 
 TITLEFONTSIZE = 14
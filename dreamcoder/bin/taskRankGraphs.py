@@ -17,6 +17,7 @@ import dill
 import matplotlib
 import numpy as np
 
+from dreamcoder.checkpoint import loadCheckpoint
 from dreamcoder.dreamcoder import *
 
 matplotlib.use("Agg")
@@ -43,9 +44,8 @@ from sklearn.metrics.pairwise import cosine_similarity
 
 
 def loadfun(x):
-    with open(x, "rb") as handle:
-        result = dill.load(handle)
-    return result
+    # Only the fields that are used are read from checkpoint stores
+    return loadCheckpoint(x)
 
 
 class Bunch(object):
@@ -234,7 +234,11 @@ def loadResult(path, export=None):
         assert False
 
     domain = parseResultsPath(path)["domain"]
-    iterations = parseResultsPath(path)["iterations"]
+    parameters = parseResultsPath(path)
+    if hasattr(parameters, "iterations"):
+        iterations = parameters["iterations"]
+    else:  # one store holds every iteration
+        iterations = result._checkpoint.resumed
     recognitionTaskMetrics = result.recognitionTaskMetrics
 
     # Create a folder for the domain if it does not exist.
@@ -0,0 +1,429 @@
+import copy
+import io
+import json
+import os
+
+import dill
+
+from dreamcoder.frontier import Frontier
+from dreamcoder.task import Task
+
+
+class _Repeat(object):
+    """Stands for an appended item equal to the one before it"""
+
+    def __reduce__(self):
+        return (_repeat, ())
+
+
+REPEAT = _Repeat()
+
+
+def _repeat():
+    return REPEAT
+
+
+def fingerprint(value):
+    """Something comparable saying what a value holds, or None if a value is
+    only known to be unchanged when it is the very same object"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return ("constant", value)
+    if isinstance(value, Frontier):
+        return (
+            "frontier",
+            value.task.name,
+            tuple(
+                (str(e.program), e.logPrior, e.logLikelihood, e.logPosterior)
+                for e in value.entries
+            ),
+        )
+    return None
+
+
+def snapshot(value, depth):
+    """What save remembers about a value to find out what changed in it: the
+    keys of dictionaries and the items of lists down to the given depth, and
+    below that references to the values"""
+    if depth > 0 and type(value) is dict:
+        return ("dict", {k: snapshot(v, depth - 1) for k, v in value.items()})
+    if depth > 0 and type(value) is list:
+        return ("list", [("value", v) for v in value])
+    return ("value", value)
+
+
+def unchanged(old, value):
+    if old[0] != "value":
+        return False
+    reference = old[1]
+    if value is reference:
+        return True
+    f = fingerprint(value)
+    return f is not None and f == fingerprint(reference)
+
+
+def delta(old, value, depth):
+    """How to turn the value remembered in the snapshot old into value, or
+    None if they are the same:
+        ("set", value)
+        ("append", items) for a list that only grew; items equal to the one
+            before them are REPEAT
+        ("update", {key: delta}, deleted keys) for a dictionary"""
+    if old is None:
+        return ("set", value)
+    kind = old[0]
+    if kind == "dict" and type(value) is dict and depth > 0:
+        before = old[1]
+        changes = {}
+        for k, v in value.items():
+            d = delta(before.get(k), v, depth - 1)
+            if d is not None:
+                changes[k] = d
+        deleted = [k for k in before if k not in value]
+        if not changes and not deleted:
+            return None
+        return ("update", changes, deleted)
+    if kind == "list" and type(value) is list and depth > 0:
+        before = old[1]
+        if len(value) < len(before) or not all(
+            unchanged(o, v) for o, v in zip(before, value)
+        ):
+            return ("set", value)
+        if len(value) == len(before):
+            return None
+        items = []
+        previous = before[-1] if before else None
+        for v in value[len(before) :]:
+            items.append(
+                REPEAT if previous is not None and unchanged(previous, v) else v
+            )
+            previous = ("value", v)
+        return ("append", items)
+    if kind == "value" and unchanged(old, value):
+        return None
+    return ("set", value)
+
+
+def apply(value, d):
+    """Inverse of delta"""
+    kind = d[0]
+    if kind == "set":
+        return d[1]
+    if kind == "append":
+        value = list(value)
+        for v in d[1]:
+            value.append(value[-1] if v is REPEAT else v)
+        return value
+    assert kind == "update"
+    _, changes, deleted = d
+    value = dict(value)
+    for k in deleted:
+        del value[k]
+    for k, c in changes.items():
+        value[k] = apply(value.get(k), c)
+    return value
+
+
+class CheckpointStore(object):
+    """Incremental checkpoints of an ECResult.
+
+    Instead of pickling the whole result after every iteration, save appends
+    to one data file only what changed in each field since the last save: new
+    grammars, learning curve points and search times, the frontiers that
+    changed, new task metrics and a recognition model that was retrained.
+    Records are dill pickles in which tasks are replaced by their names; each
+    task is pickled once, the first time it shows up.
+
+    The index, in a side-car file with the suffix ".index", has one JSON line
+    per record giving its iteration, field, offset and length, followed by a
+    line with only the iteration once every record of that iteration is in
+    the data file. Records of an iteration that was never finished are
+    ignored, so a run killed while saving resumes from the iteration before.
+
+    load gives an ECResult holding the latest frontiers, whose other fields
+    are read from the store when they are first used."""
+
+    # Fields read when resuming, the others are read on demand
+    RESUME = ("allFrontiers", "taskSolutions", "parameters", "numTestingTasks")
+
+    # How deep into each field save looks for changes, e.g. frontiersOverTime
+    # maps each task to a list of frontiers that grows every iteration
+    DEPTH = 2
+
+    def __init__(self, path, create=False):
+        self.path = path
+        self.indexPath = path + ".index"
+        # Committed records, as (iteration, field, offset, length)
+        self.records = []
+        self.iterations = []
+        # Tasks, by name
+        self.tasks = {}
+        self.loadedTasks = set()
+        # What save last wrote or load read of each field
+        self.snapshots = {}
+        # The latest iteration, and the one the result being resumed is from
+        self.iteration = None
+        self.resumed = None
+
+        if create:
+            for p in [path, self.indexPath]:
+                if os.path.exists(p):
+                    os.remove(p)
+            return
+
+        size = os.path.getsize(path)
+        pending = []
+        with open(self.indexPath, "r") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # cut short while being written
+                if "field" not in entry:
+                    self.records.extend(pending)
+                    self.iterations.append(entry["iteration"])
+                    pending = []
+                elif entry["offset"] + entry["length"] <= size:
+                    pending.append(
+                        (
+                            entry["iteration"],
+                            entry["field"],
+                            entry["offset"],
+                            entry["length"],
+                        )
+                    )
+        if self.iterations:
+            self.iteration = self.iterations[-1]
+
+    def fields(self, iteration=None):
+        if iteration is None:
+            iteration = self.iteration
+        if iteration is None:
+            return set()
+        return {
+            f for i, f, _, _ in self.records if i <= iteration and f != "_tasks"
+        }
+
+    def _read(self, offset, length):
+        with open(self.path, "rb") as handle:
+            handle.seek(offset)
+            data = handle.read(length)
+        return _Unpickler(io.BytesIO(data), self.tasks).load()
+
+    def _loadTasks(self, iteration):
+        for i, f, offset, length in self.records:
+            if f == "_tasks" and i <= iteration and offset not in self.loadedTasks:
+                for t in self._read(offset, length):
+                    self.tasks[t.name] = t
+                self.loadedTasks.add(offset)
+
+    def field(self, name, iteration=None):
+        """The value of a field of the result as of the end of an iteration,
+        by default the latest one"""
+        if iteration is None:
+            iteration = self.iteration
+        self._loadTasks(iteration)
+        value = None
+        for i, f, offset, length in self.records:
+            if f == name and i <= iteration:
+                value = apply(value, self._read(offset, length))
+        return value
+
+    def last(self, name, iteration=None):
+        """The last item of a list field, e.g. the latest grammar, reading only
+        the records it needs"""
+        if iteration is None:
+            iteration = self.iteration
+        self._loadTasks(iteration)
+        records = [r for r in self.records if r[1] == name and r[0] <= iteration]
+        for _, _, offset, length in reversed(records):
+            d = self._read(offset, length)
+            if d[0] == "set":
+                return d[1][-1] if d[1] else None
+            items = [v for v in d[1] if v is not REPEAT]
+            if items:
+                return items[-1]
+        return None
+
+    def load(self, iteration=None, fields=RESUME):
+        """An ECResult as of the end of an iteration, by default the latest.
+        Saving it again drops anything saved after that iteration."""
+        from dreamcoder.dreamcoder import ECResult
+
+        if iteration is None:
+            iteration = self.iteration
+        assert iteration in self.iterations, "No iteration %s in %s" % (
+            iteration,
+            self.path,
+        )
+        self.resumed = iteration
+        result = ECResult.__new__(ECResult)
+        for name in fields:
+            if name in self.restorable():
+                setattr(result, name, self.restore(name))
+        result._checkpoint = self
+        return result
+
+    def restorable(self):
+        return self.fields(self.resumed)
+
+    def restore(self, name):
+        """Reads a field of the result being resumed, see load"""
+        value = self.field(name, self.resumed)
+        self.snapshots[name] = snapshot(value, self.DEPTH)
+        return value
+
+    def truncate(self, iteration):
+        assert iteration in self.iterations, "No iteration %s in %s" % (
+            iteration,
+            self.path,
+        )
+        self.records = [r for r in self.records if r[0] <= iteration]
+        self.iterations = [i for i in self.iterations if i <= iteration]
+        self.iteration = iteration
+        # Read again when needed, without the tasks of the dropped records
+        self.tasks = {}
+        self.loadedTasks = set()
+        end = max((offset + length for _, _, offset, length in self.records), default=0)
+        with open(self.path, "r+b") as handle:
+            handle.truncate(end)
+        temporary = self.indexPath + ".tmp"
+        with open(temporary, "w") as handle:
+            for i in self.iterations:
+                for r in self.records:
+                    if r[0] == i:
+                        handle.write(self._indexLine(*r))
+                handle.write(json.dumps({"iteration": i}) + "\n")
+        os.replace(temporary, self.indexPath)
+
+    @staticmethod
+    def _indexLine(iteration, field, offset, length):
+        return (
+            json.dumps(
+                {
+                    "iteration": iteration,
+                    "field": field,
+                    "offset": offset,
+                    "length": length,
+                }
+            )
+            + "\n"
+        )
+
+    def save(self, result, iteration):
+        """Appends what changed in result since the last save, as the state at
+        the end of the iteration"""
+        if self.iteration is not None and iteration <= self.iteration:
+            self.truncate(iteration - 1)
+        if self.iteration is not None:
+            # Tasks already in the store, for pickling by name
+            self._loadTasks(self.iteration)
+
+        payloads = []
+        for name, value in result.__dict__.items():
+            if name.startswith("_"):
+                continue
+            d = delta(self.snapshots.get(name), value, self.DEPTH)
+            if d is None:
+                continue
+            handle = io.BytesIO()
+            newTasks = []
+            try:
+                _Pickler(handle, self.tasks, newTasks).dump(d)
+            except Exception:
+                for t in newTasks:
+                    del self.tasks[t.name]
+                raise
+            if newTasks:
+                payloads.append(("_tasks", _dumpTasks(newTasks)))
+            payloads.append((name, handle.getvalue()))
+            self.snapshots[name] = snapshot(value, self.DEPTH)
+
+        records = []
+        with open(self.path, "ab") as handle:
+            offset = handle.tell()
+            for name, data in payloads:
+                handle.write(data)
+                records.append((iteration, name, offset, len(data)))
+                offset += len(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        with open(self.indexPath, "a") as handle:
+            for r in records:
+                handle.write(self._indexLine(*r))
+            handle.write(json.dumps({"iteration": iteration}) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        self.records.extend(records)
+        self.iterations.append(iteration)
+        self.iteration = iteration
+
+
+def _dumpTasks(tasks):
+    saved = []
+    for t in tasks:
+        if not isinstance(t.examples, list):
+            # e.g. SharedExamples, which only live as long as the run
+            t = copy.copy(t)
+            t.examples = list(t.examples)
+        saved.append(t)
+    return dill.dumps(saved)
+
+
+class _Pickler(dill.Pickler):
+    def __init__(self, handle, tasks, newTasks):
+        super(_Pickler, self).__init__(handle)
+        self.tasks = tasks
+        self.newTasks = newTasks
+
+    def persistent_id(self, o):
+        if not isinstance(o, Task):
+            return None
+        known = self.tasks.get(o.name)
+        if known is None:
+            self.tasks[o.name] = o
+            self.newTasks.append(o)
+        return o.name
+
+
+class _Unpickler(dill.Unpickler):
+    def __init__(self, handle, tasks):
+        super(_Unpickler, self).__init__(handle)
+        self.tasks = tasks
+
+    def persistent_load(self, name):
+        return self.tasks[name]
+
+
+def convertedPath(path):
+    """Where convertCheckpoint puts the store made from a pickled ECResult"""
+    SUFFIX = ".pickle"
+    assert path.endswith(SUFFIX)
+    return path[: -len(SUFFIX)] + ".checkpoint"
+
+
+def loadCheckpoint(path, iteration=None):
+    """The ECResult checkpointed at path, by default as of its latest
+    iteration. Fields of a CheckpointStore are only read, and unpickled, when
+    they are first used, so scripts that look at a few of them never load the
+    rest.
+
+    A pickled ECResult is read from the store convertCheckpoint made of it if
+    there is one, and otherwise unpickled whole."""
+    if path.endswith(".pickle"):
+        if not os.path.exists(convertedPath(path)):
+            assert iteration is None, "Pickled checkpoints hold a single iteration"
+            with open(path, "rb") as handle:
+                return dill.load(handle)
+        path = convertedPath(path)
+    return CheckpointStore(path).load(iteration, fields=())
+
+
+def convertCheckpoint(path):
+    """Turns a pickled ECResult into a CheckpointStore next to it, with the
+    whole result saved as its last iteration, and returns the store"""
+    with open(path, "rb") as handle:
+        result = dill.load(handle)
+    store = CheckpointStore(convertedPath(path), create=True)
+    store.save(result, max(len(getattr(result, "grammars", [])) - 1, 0))
+    return store
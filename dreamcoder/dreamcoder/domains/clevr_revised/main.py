@@ -30,6 +30,7 @@ from dreamcoder.ec import commandlineArguments, ecIterator
 from dreamcoder.grammar import Grammar
 from dreamcoder.program import *
 from dreamcoder.task import Task
+from dreamcoder.taskStore import shareTasks
 from dreamcoder.type import arrow, tint
 from dreamcoder.utilities import eprint, numberOfCPUs
 from sklearn.model_selection import KFold
@@ -89,6 +90,9 @@ def main(args, eval=False):
 
     eprint("Split tasks into %d/%d test/train" % (len(test), len(train)))
 
+    # Workers map the examples instead of receiving a copy each
+    shareTasks(all_train + test)
+
     # set seed for model
     random.seed(seed)
     np.random.seed(seed)
@@ -14,6 +14,7 @@ from dreamcoder.domains.list.makeListTasks import (EASYLISTTASKS,
                                                    sortBootstrap)
 from dreamcoder.dreamcoder import explorationCompression
 from dreamcoder.grammar import Grammar
+from dreamcoder.scene import Scene
 from dreamcoder.task import Task
 from dreamcoder.type import (Context, UnificationFailure, arrow, t0, tbool,
                              tint, tlist)
@@ -178,6 +179,8 @@ try:
 
             tokenized = []
             for xs, y in examples:
+                if isinstance(y, Scene):
+                    y = y.tolist()
                 if isinstance(y, list):
                     y = ["LIST_START"] + y + ["LIST_END"]
                 else:
@@ -188,6 +191,8 @@ try:
 
                 serializedInputs = []
                 for xi, x in enumerate(xs):
+                    if isinstance(x, Scene):
+                        x = x.tolist()
                     if isinstance(x, list):
                         x = ["LIST_START"] + x + ["LIST_END"]
                     else:
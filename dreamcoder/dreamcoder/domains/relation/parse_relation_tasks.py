@@ -9,6 +9,7 @@ from dreamcoder.domains.text.makeTextTasks import delimiters, guessConstantStrin
 from dreamcoder.ec import commandlineArguments, ecIterator
 from dreamcoder.grammar import Grammar
 from dreamcoder.program import *
+from dreamcoder.scene import Scene
 from dreamcoder.task import Task
 from dreamcoder.type import arrow, tint
 from dreamcoder.utilities import numberOfCPUs
@@ -65,7 +66,7 @@ def problem(item, needToTrain=False):
         task = Task(
             item["name"],
             guess_arrow_type(examples),
-            [((preprocess(x),), preprocess(y)) for x, y in examples],
+            [((Scene.compact(preprocess(x)),), preprocess(y)) for x, y in examples],
         )
     else:
         task = Task(
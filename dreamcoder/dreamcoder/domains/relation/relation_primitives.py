@@ -4,6 +4,8 @@ import random
 
 # import binutil
 from functools import reduce
+
+import numpy as np
 from dreamcoder.domains.list.listPrimitives import (
     _car,
     _cdr,
@@ -22,6 +24,7 @@ from dreamcoder.domains.text.makeTextTasks import delimiters, guessConstantStrin
 from dreamcoder.ec import commandlineArguments, ecIterator
 from dreamcoder.grammar import Grammar
 from dreamcoder.program import *
+from dreamcoder.scene import Scene
 from dreamcoder.task import Task
 from dreamcoder.type import arrow, tint, tstr
 from dreamcoder.utilities import numberOfCPUs
@@ -113,15 +116,49 @@ def _min(x):
 
 
 def _count(x):
+    # Scene.count compares every object at once
     return lambda i: x.count(i)
 
 
+def _length(l):
+    return len(l)
+
+
+def _satisfying(pred, l):
+    """Whether each object of l satisfies pred, as a boolean array (a scalar
+    if pred ignores the object), if pred was compiled to a vectorized
+    attribute comparison and l is a large enough Scene; otherwise None"""
+    vectorized = getattr(pred, "vectorized", None)
+    if vectorized is None or not isinstance(l, Scene) or len(l) < Scene.VECTORIZE:
+        return None
+    try:
+        return np.asarray(vectorized(l.array))
+    except IndexError:
+        # Let the short-circuiting python version decide whether the
+        # missing attribute is ever looked at
+        return None
+
+
+def _forallUncurried(pred, l):
+    satisfying = _satisfying(pred, l)
+    if satisfying is not None:
+        return bool(satisfying.all())
+    return all(pred(i) for i in l)
+
+
+def _existsUncurried(pred, l):
+    satisfying = _satisfying(pred, l)
+    if satisfying is not None:
+        return bool(satisfying.any())
+    return any(pred(i) for i in l)
+
+
 def _forall(pred):
-    return lambda l: all(pred(i) for i in l)
+    return lambda l: _forallUncurried(pred, l)
 
 
 def _exists(pred):
-    return lambda l: any(pred(i) for i in l)
+    return lambda l: _existsUncurried(pred, l)
 
 
 def _get_attribute(l):
@@ -204,6 +241,40 @@ def _contains_6_ro_5(samples):
 def _is_above(a,b):
     return a[3]<b[1]
 
+
+# Uncurried forms used by Program.compile when these are fully applied
+Primitive.registerUncurried(_index, 2, lambda n, x: x[n])
+Primitive.registerUncurried(_eq, 2, lambda x, y: x == y)
+Primitive.registerUncurried(_and, 2, lambda x, y: x and y)
+Primitive.registerUncurried(_or, 2, lambda x, y: x or y)
+Primitive.registerUncurried(_gt, 2, lambda x, y: x > y)
+Primitive.registerUncurried(_addition, 2, lambda x, y: x + y)
+Primitive.registerUncurried(_subtraction, 2, lambda x, y: x - y)
+Primitive.registerUncurried(_max, 2, max)
+Primitive.registerUncurried(_min, 2, min)
+Primitive.registerUncurried(_map, 2, lambda f, l: list(map(f, l)))
+Primitive.registerUncurried(_count, 2, lambda x, i: x.count(i))
+Primitive.registerUncurried(_forall, 2, _forallUncurried)
+Primitive.registerUncurried(_exists, 2, _existsUncurried)
+
+# Predicates built from these are evaluated on whole scenes by forall/exists
+Primitive.registerVectorized(_index, "index")
+Primitive.registerVectorized(_eq, np.equal)
+Primitive.registerVectorized(_gt, np.greater)
+Primitive.registerVectorized(_and, np.logical_and)
+Primitive.registerVectorized(_or, np.logical_or)
+Primitive.registerVectorized(_not, np.logical_not)
+Primitive.registerVectorized(_addition, np.add)
+Primitive.registerVectorized(_subtraction, np.subtract)
+Primitive.registerVectorized(_max, np.maximum)
+Primitive.registerVectorized(_min, np.minimum)
+# and these let the enumerator run whole programs on all scenes of a job at
+# once (see SceneBatch)
+Primitive.registerVectorized(_forall, "forall")
+Primitive.registerVectorized(_exists, "exists")
+Primitive.registerVectorized(_length, "length")
+
+
 def get_primitives():
     primitives = [
         # Primitive("slice", arrow(tint, tint, tlist(t0), tlist(t0)), _slice),
@@ -255,7 +326,7 @@ def get_baseline_primitives():
         Primitive("range", arrow(tint, tlist(tint)), _range),
         Primitive("index", arrow(tint, tlist(t0), t0), _index),
         Primitive("fold", arrow(tlist(t0), t1, arrow(t0, t1, t1), t1), _fold),
-        Primitive("length", arrow(tlist(t0), tint), len),
+        Primitive("length", arrow(tlist(t0), tint), _length),
         Primitive("if", arrow(tbool, t0, t0, t0), _if),
         Primitive("+", arrow(tint, tint, tint), _addition),
         Primitive("-", arrow(tint, tint, tint), _subtraction),
@@ -291,7 +362,7 @@ def get_kandinsky_primitives():
         # Primitive("range", arrow(tint, tlist(tint)), _range),
         Primitive("index", arrow(tint, tlist(t0), t0), _index),
         Primitive("fold", arrow(tlist(t0), t1, arrow(t0, t1, t1), t1), _fold),
-        Primitive("length", arrow(tlist(t0), tint), len),
+        Primitive("length", arrow(tlist(t0), tint), _length),
         Primitive("if", arrow(tbool, t0, t0, t0), _if),
         Primitive("+", arrow(tint, tint, tint), _addition),
         Primitive("-", arrow(tint, tint, tint), _subtraction),
@@ -327,7 +398,7 @@ def get_clevr_primitives():
         # Primitive("range", arrow(tint, tlist(tint)), _range),
         Primitive("index", arrow(tint, tlist(t0), t0), _index),
         Primitive("fold", arrow(tlist(t0), t1, arrow(t0, t1, t1), t1), _fold),
-        Primitive("length", arrow(tlist(t0), tint), len),
+        Primitive("length", arrow(tlist(t0), tint), _length),
         Primitive("if", arrow(tbool, t0, t0, t0), _if),
         Primitive("+", arrow(tint, tint, tint), _addition),
         Primitive("-", arrow(tint, tint, tint), _subtraction),
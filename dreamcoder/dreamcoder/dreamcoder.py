@@ -5,6 +5,7 @@ import dill
 import binutil
 from rtpt.rtpt import RTPT
 
+from dreamcoder.checkpoint import CheckpointStore, loadCheckpoint
 from dreamcoder.compression import induceGrammar
 from dreamcoder.utilities import *
 
@@ -12,7 +13,7 @@ try:
     from dreamcoder.recognition import *
 except:
     eprint("Failure loading recognition - only acceptable if using pypy ")
-from dreamcoder.dreaming import backgroundHelmholtzEnumeration
+from dreamcoder.dreaming import DreamCorpus, backgroundHelmholtzEnumeration
 from dreamcoder.enumeration import *
 from dreamcoder.fragmentGrammar import *
 from dreamcoder.primitiveGraph import graphPrimitives
@@ -65,6 +66,24 @@ class ECResult:
         attrs = ["{}={}".format(k, v) for k, v in self.__dict__.items()]
         return "ECResult({})".format(", ".join(attrs))
 
+    def __getattr__(self, name):
+        # Fields of a result loaded from a CheckpointStore are read on first use
+        checkpoint = self.__dict__.get("_checkpoint")
+        if checkpoint is None or name not in checkpoint.restorable():
+            raise AttributeError(name)
+        value = checkpoint.restore(name)
+        setattr(self, name, value)
+        return value
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        checkpoint = state.pop("_checkpoint", None)
+        if checkpoint is not None:
+            for name in checkpoint.restorable():
+                if name not in state:
+                    state[name] = getattr(self, name)
+        return state
+
     def getTestingTasks(self):
         testing = []
         training = self.taskSolutions.keys()
@@ -90,6 +109,7 @@ class ECResult:
         "ensembleSize": "ES",
         "recognitionTimeout": "RT",
         "recognitionSteps": "RS",
+        "recognitionBatchSize": "RB",
         "iterations": "it",
         "maximumFrontier": "MF",
         "pseudoCounts": "pc",
@@ -172,6 +192,7 @@ def ecIterator(
     useRecognitionModel=True,
     recognitionTimeout=None,
     recognitionSteps=None,
+    recognitionBatchSize=1,
     helmholtzRatio=0.0,
     featureExtractor=None,
     activation="relu",
@@ -184,6 +205,7 @@ def ecIterator(
     structurePenalty=0.001,
     arity=0,
     evaluationTimeout=1.0,  # seconds
+    evaluationFuel=None,
     taskBatchSize=None,
     taskReranker="default",
     CPUs=1,
@@ -265,6 +287,7 @@ def ecIterator(
             "addFullTaskMetrics",
             "featureExtractor",
             "evaluationTimeout",
+            "evaluationFuel",
             "testingTasks",
             "compressor",
             "custom_wake_generative",
@@ -275,6 +298,7 @@ def ecIterator(
         for k in {
             "helmholtzRatio",
             "recognitionTimeout",
+            "recognitionBatchSize",
             "biasOptimal",
             "mask",
             "contextual",
@@ -296,6 +320,8 @@ def ecIterator(
         del parameters["mask"]
     if not auxiliaryLoss and "auxiliaryLoss" in parameters:
         del parameters["auxiliaryLoss"]
+    if recognitionBatchSize == 1 and "recognitionBatchSize" in parameters:
+        del parameters["recognitionBatchSize"]
     if not useDSL:
         for k in {"structurePenalty", "pseudoCounts", "aic"}:
             del parameters[k]
@@ -311,6 +337,15 @@ def ecIterator(
         ]
         return "{}_{}{}.pickle".format(outputPrefix, "_".join(kvs), extra)
 
+    def checkpointStorePath():
+        # One store holds every iteration
+        kvs = [
+            "{}={}".format(ECResult.abbreviate(k), parameters[k])
+            for k in sorted(parameters.keys())
+            if k != "iterations"
+        ]
+        return "{}_{}.checkpoint".format(outputPrefix, "_".join(kvs))
+
     if message:
         message = " (" + message + ")"
     eprint(
@@ -320,6 +355,7 @@ def ecIterator(
     for k, v in parameters.items():
         eprint("\t", k, " = ", v)
     eprint("\t", "evaluationTimeout", " = ", evaluationTimeout)
+    eprint("\t", "evaluationFuel", " = ", evaluationFuel)
     eprint("\t", "cuda", " = ", cuda)
     eprint()
 
@@ -330,17 +366,27 @@ def ecIterator(
         eprint(f"Currently using this much memory: {getThisMemoryUsage()}")
 
     # Restore checkpoint
+    checkpoints = None
     if resume is not None:
         try:
             resume = int(resume)
-            path = checkpointPath(resume)
+            path = checkpointStorePath()
+            if not os.path.exists(path):
+                path = checkpointPath(resume)
         except ValueError:
             path = resume
-        with open(path, "rb") as handle:
-            result = dill.load(handle)
-        resume = len(result.grammars) - 1
+        if path.endswith(".pickle"):
+            with open(path, "rb") as handle:
+                result = dill.load(handle)
+            resume = len(result.grammars) - 1
+            grammar = result.grammars[-1] if result.grammars else grammar
+        else:
+            # Only the frontiers and the latest grammar are read now
+            checkpoints = CheckpointStore(path)
+            result = checkpoints.load(resume if isinstance(resume, int) else None)
+            resume = checkpoints.resumed
+            grammar = checkpoints.last("grammars") or grammar
         eprint("Loaded checkpoint from", path)
-        grammar = result.grammars[-1] if result.grammars else grammar
         print(grammar)
     else:  # Start from scratch
         # for graphing of testing tasks
@@ -395,6 +441,7 @@ def ecIterator(
             maximumFrontier=maximumFrontier,
             CPUs=CPUs,
             evaluationTimeout=evaluationTimeout,
+            evaluationFuel=evaluationFuel,
             solver=solver,
             **kw,
         )
@@ -450,8 +497,10 @@ def ecIterator(
             "frontier",
         )
         SUFFIX = ".pickle"
-        assert path.endswith(SUFFIX)
-        path = path[: -len(SUFFIX)] + "_FTM=True" + SUFFIX
+        if path.endswith(SUFFIX):
+            path = path[: -len(SUFFIX)] + "_FTM=True" + SUFFIX
+        else:
+            path = checkpointPath(resume, "_FTM=True")
         with open(path, "wb") as handle:
             dill.dump(result, handle)
         if useRecognitionModel:
@@ -459,6 +508,15 @@ def ecIterator(
 
         sys.exit(0)
 
+    if outputPrefix is not None and checkpoints is None:
+        path = checkpointStorePath()
+        # Resuming from a pickle keeps the iterations already in the store
+        checkpoints = CheckpointStore(
+            path, create=resume is None or not os.path.exists(path)
+        )
+
+    # Dreams are kept across iterations and rescored under each new grammar
+    dreamCorpus = DreamCorpus(tasks, evaluationTimeout=evaluationTimeout)
     for j in range(resume or 0, iterations):
         if storeTaskMetrics and rewriteTaskMetrics:
             eprint("Resetting task metrics for next iteration.")
@@ -478,6 +536,7 @@ def ecIterator(
                 solver=solver,
                 enumerationTimeout=testingTimeout,
                 evaluationTimeout=evaluationTimeout,
+                evaluationFuel=evaluationFuel,
             )
         # If we have to also enumerate Helmholtz frontiers,
         # do this extra sneaky in the background
@@ -495,6 +554,7 @@ def ecIterator(
                     enumerationTimeout,
                     evaluationTimeout=evaluationTimeout,
                     special=featureExtractor.special,
+                    corpus=dreamCorpus,
                 )
             else:
                 print("Reusing dreams from previous iteration.")
@@ -522,6 +582,7 @@ def ecIterator(
                 enumerationTimeout=enumerationTimeout,
                 CPUs=CPUs,
                 evaluationTimeout=evaluationTimeout,
+                evaluationFuel=evaluationFuel,
             )
             result.trainSearchTime = {
                 t: tm for t, tm in times.items() if tm is not None
@@ -541,8 +602,8 @@ def ecIterator(
         for f in topDownFrontiers:
             if f.task not in result.allFrontiers:
                 continue  # backward compatibility with old checkpoints
-            result.allFrontiers[f.task] = (
-                result.allFrontiers[f.task].combine(f).topK(maximumFrontier)
+            result.allFrontiers[f.task] = Frontier.combineMany(
+                [result.allFrontiers[f.task], f], maximumFrontier
             )
 
         eprint("Frontiers discovered top down: " + str(len(tasksHitTopDown)))
@@ -587,7 +648,9 @@ def ecIterator(
                 cuda=cuda,
                 CPUs=CPUs,
                 solver=solver,
+                evaluationFuel=evaluationFuel,
                 recognitionSteps=recognitionSteps,
+                recognitionBatchSize=recognitionBatchSize,
                 maximumFrontier=maximumFrontier,
             )
 
@@ -629,16 +692,8 @@ def ecIterator(
             result.grammars.append(grammar)
 
         if outputPrefix is not None:
-            path = checkpointPath(j + 1)
-            with open(path, "wb") as handle:
-                try:
-                    dill.dump(result, handle)
-                except TypeError as e:
-                    eprint(result)
-                    assert False
-            eprint("Exported checkpoint to", path)
-            if useRecognitionModel:
-                ECResult.clearRecognitionModel(path)
+            checkpoints.save(result, j + 1)
+            eprint("Exported checkpoint of iteration %d to" % (j + 1), checkpoints.path)
 
             graphPrimitives(result, "%s_primitives_%d_" % (outputPrefix, j))
 
@@ -676,6 +731,7 @@ def evaluateOnTestingTasks(
     maximumFrontier=None,
     enumerationTimeout=None,
     evaluationTimeout=None,
+    evaluationFuel=None,
 ):
     # result.recognitionModel = None  # TODO: remove
     if result.recognitionModel is not None:
@@ -687,6 +743,7 @@ def evaluateOnTestingTasks(
             maximumFrontier=maximumFrontier,
             enumerationTimeout=enumerationTimeout,
             evaluationTimeout=evaluationTimeout,
+            evaluationFuel=evaluationFuel,
             testing=True,
         )
         updateTaskSummaryMetrics(
@@ -713,6 +770,7 @@ def evaluateOnTestingTasks(
             enumerationTimeout=enumerationTimeout,
             CPUs=CPUs,
             evaluationTimeout=evaluationTimeout,
+            evaluationFuel=evaluationFuel,
             testing=True,
         )
     updateTaskSummaryMetrics(
@@ -742,6 +800,7 @@ def default_wake_generative(
     CPUs=None,
     solver=None,
     evaluationTimeout=None,
+    evaluationFuel=None,
 ):
     topDownFrontiers, times = multicoreEnumeration(
         grammar,
@@ -751,6 +810,7 @@ def default_wake_generative(
         CPUs=CPUs,
         solver=solver,
         evaluationTimeout=evaluationTimeout,
+        evaluationFuel=evaluationFuel,
     )
     eprint("Generative model enumeration results:")
     eprint(Frontier.describe(topDownFrontiers))
@@ -775,6 +835,7 @@ def sleep_recognition(
     biasOptimal=True,
     previousRecognitionModel=None,
     recognitionSteps=None,
+    recognitionBatchSize=1,
     timeout=None,
     enumerationTimeout=None,
     evaluationTimeout=None,
@@ -785,6 +846,7 @@ def sleep_recognition(
     cuda=None,
     CPUs=None,
     solver=None,
+    evaluationFuel=None,
 ):
     eprint(
         "Using an ensemble size of %d. Note that we will only store and test on the best recognition model."
@@ -795,6 +857,12 @@ def sleep_recognition(
         featureExtractor(tasks, testingTasks=testingTasks, cuda=cuda)
         for i in range(ensembleSize)
     ]
+    # The examples of the tasks never change, so feature extractors that can
+    # prepare them ahead of time do so once for training, enumeration and
+    # the task metrics below
+    for extractor in featureExtractorObjects:
+        if hasattr(extractor, "cacheTasks"):
+            extractor.cacheTasks(list(tasks) + list(testingTasks))
     recognizers = [
         RecognitionModel(
             featureExtractorObjects[i],
@@ -810,23 +878,39 @@ def sleep_recognition(
         for i in range(ensembleSize)
     ]
     eprint(f"Currently using this much memory: {getThisMemoryUsage()}")
-    trainedRecognizers = parallelMap(
-        min(CPUs, len(recognizers)),
-        lambda recognizer: recognizer.train(
-            allFrontiers,
-            biasOptimal=biasOptimal,
-            helmholtzFrontiers=helmholtzFrontiers,
-            CPUs=CPUs,
-            evaluationTimeout=evaluationTimeout,
-            timeout=timeout,
-            steps=recognitionSteps,
-            helmholtzRatio=helmholtzRatio,
-            auxLoss=auxiliaryLoss,
-            vectorized=True,
-        ),
-        recognizers,
-        seedRandom=True,
-    )
+    # Random dreams are sampled in the background on the CPUs that training
+    # leaves free
+    allFrontiers = list(allFrontiers)
+    requests = [f.task.request for f in allFrontiers]
+    spareCPUs = CPUs - min(CPUs, len(recognizers))
+    producer = None
+    if helmholtzRatio > 0 and not helmholtzFrontiers and requests and spareCPUs > 0:
+        producer = HelmholtzProducer(recognizers, requests, CPUs=spareCPUs)
+    try:
+        trainedRecognizers = parallelMap(
+            min(CPUs, len(recognizers)),
+            lambda recognizer: recognizer.train(
+                allFrontiers,
+                biasOptimal=biasOptimal,
+                helmholtzFrontiers=helmholtzFrontiers,
+                CPUs=CPUs,
+                evaluationTimeout=evaluationTimeout,
+                timeout=timeout,
+                steps=recognitionSteps,
+                helmholtzRatio=helmholtzRatio,
+                auxLoss=auxiliaryLoss,
+                vectorized=True,
+                batchSize=recognitionBatchSize,
+                helmholtzStream=None
+                if producer is None
+                else producer.stream(recognizer.id),
+            ),
+            recognizers,
+            seedRandom=True,
+        )
+    finally:
+        if producer is not None:
+            producer.stop()
     eprint(f"Currently using this much memory: {getThisMemoryUsage()}")
     # Enumerate frontiers for each of the recognizers.
     eprint(
@@ -847,6 +931,7 @@ def sleep_recognition(
             maximumFrontier=maximumFrontier,
             enumerationTimeout=enumerationTimeout,
             evaluationTimeout=evaluationTimeout,
+            evaluationFuel=evaluationFuel,
             solver=solver,
         )
         ensembleFrontiers.append(bottomupFrontiers)
@@ -902,6 +987,10 @@ def sleep_recognition(
             result.recognitionModel.taskGrammarStartProductions(tasks),
             "startProductions",
         )
+    # Keep the prepared examples out of checkpoints
+    for recognizer in trainedRecognizers:
+        if hasattr(recognizer.featureExtractor, "clearCache"):
+            recognizer.featureExtractor.clearCache()
 
     result.hitsAtEachWake.append(len(totalTasksHitBottomUp))
     eprint(f"Currently using this much memory: {getThisMemoryUsage()}")
@@ -921,10 +1010,9 @@ def sleep_recognition(
         for b in bottomupFrontiers:
             if b.task not in result.allFrontiers:
                 continue  # backwards compatibility with old checkpoints
-            result.allFrontiers[b.task] = (
-                result.allFrontiers[b.task]
-                .combine(grammar.rescoreFrontier(b))
-                .topK(maximumFrontier)
+            result.allFrontiers[b.task] = Frontier.combineMany(
+                [result.allFrontiers[b.task], grammar.rescoreFrontier(b)],
+                maximumFrontier,
             )
 
     eprint("Frontiers discovered bottom up: " + str(len(totalTasksHitBottomUp)))
@@ -1020,6 +1108,7 @@ def commandlineArguments(
     compressor="ocaml",
     useRecognitionModel=True,
     recognitionTimeout=None,
+    recognitionBatchSize=1,
     activation="relu",
     helmholtzRatio=1.0,
     featureExtractor=None,
@@ -1090,6 +1179,13 @@ def commandlineArguments(
         help="Number of gradient steps to train the recognition model. Can be specified instead of train time.",
         type=int,
     )
+    parser.add_argument(
+        "--recognitionBatchSize",
+        default=recognitionBatchSize,
+        help="Number of frontiers, real and Helmholtz, averaged over by each gradient step of the recognition model. default: %d"
+        % recognitionBatchSize,
+        type=int,
+    )
     parser.add_argument(
         "-k",
         "--topK",
@@ -1212,12 +1308,20 @@ def commandlineArguments(
     )
     parser.add_argument(
         "--solver",
-        choices=["ocaml", "pypy", "bottom", "python"],
+        choices=["ocaml", "pypy", "bottom", "python", "incremental", "observational"],
         default=solver,
         help="""Solver for enumeration.
                         Default: %s"""
         % solver,
     )
+    parser.add_argument(
+        "--evaluationFuel",
+        default=None,
+        type=int,
+        help="""With the python solvers, run each example for at most this many
+        lambda applications instead of arming a timer per program; the
+        evaluation timeout is then only a backstop. Default: None (timer only)""",
+    )
     parser.add_argument(
         "-r",
         "--Helmholtz",
@@ -1366,8 +1470,7 @@ def commandlineArguments(
 
     if v["primitive-graph"] is not None:
         for n, pg in enumerate(v["primitive-graph"]):
-            with open(pg, "rb") as handle:
-                result = dill.load(handle)
+            result = loadCheckpoint(pg)
             graphPrimitives(
                 result, f"figures/deepProgramLearning/{sys.argv[0]}{n}", view=True
             )
@@ -1388,8 +1491,7 @@ def commandlineArguments(
         v["recognitionTimeout"] = v["enumerationTimeout"]
 
     if v["countParameters"]:
-        with open(v["countParameters"], "rb") as handle:
-            result = dill.load(handle)
+        result = loadCheckpoint(v["countParameters"])
         eprint(
             "The recognition model has",
             sum(
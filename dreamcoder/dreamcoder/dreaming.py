@@ -6,12 +6,21 @@ from dreamcoder.domains.arithmetic.arithmeticPrimitives import (addition, k0,
                                                                 k1,
                                                                 multiplication,
                                                                 subtraction)
+from dreamcoder.enumeration import ObservationalEquivalence
 from dreamcoder.frontier import Frontier, FrontierEntry
 from dreamcoder.grammar import Grammar
 from dreamcoder.program import Program
 from dreamcoder.task import Task
 from dreamcoder.type import arrow, tint
-from dreamcoder.utilities import eprint, get_root_dir, mean, timing, tuplify
+from dreamcoder.utilities import (
+    NEGATIVEINFINITY,
+    eprint,
+    get_root_dir,
+    mean,
+    runWithTimeout,
+    timing,
+    tuplify,
+)
 
 
 def helmholtzEnumeration(
@@ -42,16 +51,160 @@ def helmholtzEnumeration(
     return response
 
 
+def helmholtzInputs(tasks):
+    """Distinct task inputs of each request, as a map from the inputs sent to
+    the Helmholtz enumerator to the inputs themselves"""
+    inputs = {}
+    for t in tasks:
+        distinct = inputs.setdefault(t.request, {})
+        for xs, _ in t.examples:
+            distinct.setdefault(tuplify(xs), xs)
+    return inputs
+
+
+class DreamCorpus(object):
+    """Helmholtz frontiers kept across iterations, one per behaviour.
+
+    The behaviour of a dream is the tuple of its outputs on the task inputs of
+    its request that the Helmholtz enumerator is given, see helmholtzInputs.
+    Only one program of each new frontier is run to find it, and a program
+    that is still in the corpus is never run again. Frontiers with the same
+    behaviour, within one Helmholtz enumeration or across iterations, are
+    merged into one. When the grammar changes the programs keep their
+    meaning, so their priors are just recomputed under the new grammar, and
+    programs it can no longer express are dropped. Beyond maximumSize
+    behaviours, those whose best program is least likely are dropped too.
+
+    This only saves work on the python side: the OCaml Helmholtz enumerator
+    still runs every program it samples, each iteration, to group them by
+    behaviour, before the corpus sees them."""
+
+    def __init__(self, tasks, evaluationTimeout=None, maximumSize=10000):
+        self.evaluationTimeout = evaluationTimeout
+        self.maximumSize = maximumSize
+        self.inputs = {
+            request: list(distinct.values())
+            for request, distinct in helmholtzInputs(tasks).items()
+        }
+        # (request, behaviour) -> frontier
+        self.frontiers = {}
+        # (program, request) -> behaviour, for the programs in the frontiers
+        self.behaviours = {}
+        # How many frontiers have been made, for naming their tasks
+        self.named = 0
+
+    def __len__(self):
+        return len(self.frontiers)
+
+    def behaviour(self, program, request):
+        key = (str(program), request)
+        if key not in self.behaviours:
+            outputs = []
+            for xs in self.inputs.get(request, []):
+                try:
+                    y = runWithTimeout(
+                        lambda: program.runWithArguments(xs), self.evaluationTimeout
+                    )
+                    outputs.append(ObservationalEquivalence.hashable(y))
+                except Exception:
+                    outputs.append(None)
+            self.behaviours[key] = tuple(outputs)
+        return self.behaviours[key]
+
+    def rescore(self, g):
+        """Recomputes the prior of every program under the grammar g"""
+        productions = set(g.primitives)
+        for key, frontier in list(self.frontiers.items()):
+            entries = []
+            for e in frontier:
+                if any(
+                    (p.isPrimitive or p.isInvented) and p not in productions
+                    for _, p in e.program.walk()
+                ):
+                    continue
+                try:
+                    l = g.logLikelihood(frontier.task.request, e.program)
+                except Exception:
+                    continue
+                if l > NEGATIVEINFINITY:
+                    entries.append(
+                        FrontierEntry(program=e.program, logPrior=l, logLikelihood=0.0)
+                    )
+            if entries:
+                frontier.entries = entries
+            else:
+                del self.frontiers[key]
+        self.behaviours = {
+            (str(e.program), request): b
+            for (request, b), frontier in self.frontiers.items()
+            for e in frontier
+        }
+
+    def add(self, frontiers):
+        """Adds the frontiers of a Helmholtz enumeration, whose priors must
+        come from the grammar the corpus was last rescored with"""
+        for f in frontiers:
+            request = f.task.request
+            known = [
+                self.behaviours[str(e.program), request]
+                for e in f
+                if (str(e.program), request) in self.behaviours
+            ]
+            b = known[0] if known else self.behaviour(f.entries[0].program, request)
+            for e in f:
+                self.behaviours[str(e.program), request] = b
+            if (request, b) not in self.frontiers:
+                self.frontiers[request, b] = Frontier(
+                    [], task=Task("dream_%d" % self.named, request, [])
+                )
+                self.named += 1
+            frontier = self.frontiers[request, b]
+            programs = {str(e.program) for e in frontier}
+            # Dreams kept across iterations share their subprograms
+            frontier.entries.extend(
+                e.intern() for e in f if str(e.program) not in programs
+            )
+        self.evict()
+
+    def evict(self):
+        """Drops the behaviours whose best program is least likely, down to
+        maximumSize"""
+        if self.maximumSize is None or len(self.frontiers) <= self.maximumSize:
+            return
+        ranked = sorted(
+            self.frontiers.items(),
+            key=lambda kv: max(e.logPrior for e in kv[1]),
+            reverse=True,
+        )
+        for (request, _), frontier in ranked[self.maximumSize :]:
+            for e in frontier:
+                self.behaviours.pop((str(e.program), request), None)
+        self.frontiers = dict(ranked[: self.maximumSize])
+
+    def update(self, g, frontiers):
+        """Rescores the corpus under g, adds frontiers enumerated from g, and
+        returns every frontier of the corpus"""
+        n = len(self)
+        self.rescore(g)
+        kept = len(self)
+        self.add(frontiers)
+        eprint(
+            "Dream corpus: kept %d/%d old behaviours, %d new from %d Helmholtz frontiers"
+            % (kept, n, len(self) - kept, len(frontiers))
+        )
+        return list(self.frontiers.values())
+
+
 def backgroundHelmholtzEnumeration(
-    tasks, g, timeout, _=None, special=None, evaluationTimeout=None
+    tasks, g, timeout, _=None, special=None, evaluationTimeout=None, corpus=None
 ):
+    """Enumerates Helmholtz frontiers from g in the background. Returns a
+    function that waits for them; if a DreamCorpus is given they are added to
+    it, and the function returns the whole corpus."""
     from pathos.multiprocessing import Pool
 
-    requests = list({t.request for t in tasks})
-    inputs = {
-        r: list({tuplify(xs) for t in tasks if t.request == r for xs, y in t.examples})
-        for r in requests
-    }
+    inputs = {r: list(distinct) for r, distinct in helmholtzInputs(tasks).items()}
+    requests = list(inputs)
     workers = Pool(len(requests))
     promises = [
         workers.apply_async(
@@ -83,6 +236,8 @@ def backgroundHelmholtzEnumeration(
                         )
                     )
         eprint("Total number of Helmholtz frontiers:", len(frontiers))
+        if corpus is not None:
+            frontiers = corpus.update(g, frontiers)
         return frontiers
 
     return get
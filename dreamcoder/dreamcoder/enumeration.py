@@ -1,10 +1,17 @@
+import gc
 import os
+import signal
 import subprocess
 import traceback
 
+import numpy as np
+
 from dreamcoder.grammar import *
 from dreamcoder.likelihoodModel import AllOrNothingLikelihoodModel
-from dreamcoder.utilities import get_root_dir
+from dreamcoder.scene import SceneBatch
+from dreamcoder.task import WATCHDOG, EvaluationTimeout, Task
+from dreamcoder.taskStore import picklingByReference
+from dreamcoder.utilities import get_root_dir, runWithTimeout, tuplify
 
 
 def multicoreEnumeration(
@@ -18,14 +25,18 @@ def multicoreEnumeration(
     verbose=True,
     evaluationTimeout=None,
     testing=False,
+    evaluationFuel=None,
 ):
     """g: Either a Grammar, or a map from task to grammar.
+    evaluationFuel: if given, the python solvers meter each example to this
+    many lambda applications and only use evaluationTimeout as a backstop.
     Returns (list-of-frontiers, map-from-task-to-search-time)"""
 
     # We don't use actual threads but instead use the multiprocessing
     # library. This is because we need to be able to kill workers.
     # from multiprocess import Process, Queue
 
+    import time
     from multiprocessing import Queue
 
     # everything that gets sent between processes will be dilled
@@ -36,15 +47,19 @@ def multicoreEnumeration(
         "bottom": solveForTask_bottom,
         "pypy": solveForTask_pypy,
         "python": solveForTask_python,
+        "incremental": solveForTask_incremental,
+        "observational": solveForTask_observational,
     }
     assert (
         solver in solvers
-    ), "You must specify a valid solver. options are ocaml, pypy, or python."
+    ), "You must specify a valid solver. options are ocaml, pypy, python, incremental, or observational."
 
     likelihoodModel = None
-    if solver == "pypy" or solver == "python":
+    if solver in {"pypy", "python", "incremental", "observational"}:
         # Use an all or nothing likelihood model.
-        likelihoodModel = AllOrNothingLikelihoodModel(timeout=evaluationTimeout)
+        likelihoodModel = AllOrNothingLikelihoodModel(
+            timeout=evaluationTimeout, fuel=evaluationFuel
+        )
 
     if not isinstance(g, dict):
         g = {t: g for t in tasks}
@@ -71,22 +86,42 @@ def multicoreEnumeration(
             k = (task2grammar[t], t.request)
         jobs[k] = jobs.get(k, []) + [t]
 
+    # The python solver splits each band into sub-ranges that idle workers
+    # steal, which keeps every CPU busy even when there is only one job
+    stealing = (
+        solver_str == "python"
+        and CPUs > 1
+        and all(isinstance(_g, Grammar) for _g in task2grammar.values())
+    )
+
     disableParallelism = len(jobs) == 1
     parallelCallback = (
         launchParallelProcess
         if not disableParallelism
         else lambda f, *a, **k: f(*a, **k)
     )
-    if disableParallelism:
+    if disableParallelism and not stealing:
         eprint("Disabling parallelism on the Python side because we only have one job.")
         eprint("If you are using ocaml or bottom, there could still be parallelism.")
 
+    # The python solvers run on persistent workers which keep each job's
+    # grammar and tasks resident between budget increments
+    pool = None
+    if (stealing or not disableParallelism) and solver_str in POOLEDSOLVERS:
+        pool = EnumerationWorkerPool.shared(CPUs)
+        job2resident = {k: pool.newJob() for k in jobs}
+        name2task = {t.name: t for t in tasks}
+
     # Map from task to the shortest time to find a program solving it
     bestSearchTime = {t: None for t in task2grammar}
 
     lowerBounds = {k: 0.0 for k in jobs}
 
-    frontiers = {t: Frontier([], task=t) for t in task2grammar}
+    # Results from several workers are merged into these as they come in
+    frontiers = {
+        t: FrontierUnion(t, maximumFrontier if stealing else None)
+        for t in task2grammar
+    }
 
     # For each job we keep track of how long we have been working on it
     stopwatches = {t: Stopwatch() for t in jobs}
@@ -104,6 +139,17 @@ def multicoreEnumeration(
         else:
             return 1.5
 
+    def launchUpperBound(lb, bi):
+        nonlocal solver_str
+        # The incremental and observational solvers keep state across bands
+        # (suspended partial programs, behaviour signatures) in memory, so
+        # they are launched once over all remaining bands rather than once
+        # per band
+        if solver_str in {"incremental", "observational"}:
+            return lb + INCREMENTALENUMERATIONHORIZON
+        else:
+            return lb + bi
+
     def maximumFrontiers(j):
         tasks = jobs[j]
         return {t: maximumFrontier - numberOfHits(frontiers[t]) for t in tasks}
@@ -135,7 +181,7 @@ def multicoreEnumeration(
                 del jobs[k]
 
     # Workers put their messages in here
-    q = Queue()
+    q = Queue() if pool is None else pool.results
 
     # How many CPUs are we using?
     activeCPUs = 0
@@ -146,18 +192,111 @@ def multicoreEnumeration(
     id2job = {}
     nextID = 0
 
+    # When stealing, sub-ranges waiting for a worker, and how many sub-ranges
+    # of each job are either waiting or running
+    pending = []
+    outstanding = {j: 0 for j in jobs}
+
+    # CPU seconds spent in workers, for reporting utilization
+    id2start = {}
+    busyTime = 0.0
+    startTime = time.time()
+
+    def launch(j, CPUs, lowerBound, upperBound, bi, **extra):
+        nonlocal nextID, activeCPUs
+        g = j[0]
+        arguments = dict(
+            elapsedTime=stopwatches[j].elapsed,
+            CPUs=CPUs,
+            lowerBound=lowerBound,
+            upperBound=upperBound,
+            budgetIncrement=bi,
+            timeout=enumerationTimeout - stopwatches[j].elapsed,
+            evaluationTimeout=evaluationTimeout,
+            testing=testing,
+            likelihoodModel=likelihoodModel,
+            **extra,
+        )
+        id2CPUs[nextID] = CPUs
+        id2job[nextID] = j
+        id2start[nextID] = time.time()
+        activeCPUs += CPUs
+        if pool is None:
+            parallelCallback(
+                wrapInThread(solver),
+                q=q,
+                g=g,
+                ID=nextID,
+                tasks=jobs[j],
+                maximumFrontiers=maximumFrontiers(j),
+                **arguments,
+            )
+        else:
+            pool.launch(
+                solver,
+                nextID,
+                job2resident[j],
+                g,
+                jobs[j],
+                maximumFrontiers(j),
+                **arguments,
+            )
+        nextID += 1
+
+    def abandon(j):
+        """Stops all work on a job that is solved or out of time"""
+        waiting = [item for item in pending if item[0] == j]
+        for item in waiting:
+            pending.remove(item)
+        outstanding[j] -= len(waiting)
+        for ID, k in id2job.items():
+            if k == j:
+                pool.cancel(ID)
+        if outstanding[j] == 0 and stopwatches[j].running:
+            stopwatches[j].stop()
+
     while True:
         refreshJobs()
+        if stealing:
+            for j in outstanding:
+                if j not in jobs and outstanding[j] > 0:
+                    abandon(j)
         # Don't launch a job that we are already working on
         # We run the stopwatch whenever the job is being worked on
         # freeJobs are things that we are not working on but could be
+        # When stealing, the next band of a job is only queued once every
+        # sub-range of the current one has finished, so that a job solved by
+        # a costlier band is never abandoned while a cheaper one is running
         freeJobs = [
             j
             for j in jobs
             if not stopwatches[j].running
             and stopwatches[j].elapsed < enumerationTimeout - 0.5
         ]
-        if freeJobs and activeCPUs < CPUs:
+        if freeJobs and activeCPUs < CPUs and stealing:
+            for j in freeJobs:
+                bi = budgetIncrement(lowerBounds[j])
+                ub = launchUpperBound(lowerBounds[j], bi)
+                n = SUBRANGESPERCPU * CPUs
+                eprint(
+                    "(frontend) Queueing %s (%d tasks) as %d sub-ranges. %f <= MDL < %f. Timeout %f."
+                    % (
+                        j[1],
+                        len(jobs[j]),
+                        n,
+                        lowerBounds[j],
+                        ub,
+                        enumerationTimeout - stopwatches[j].elapsed,
+                    )
+                )
+                stopwatches[j].start()
+                pending.extend((j, lowerBounds[j], ub, (k, n)) for k in range(n))
+                outstanding[j] += n
+                lowerBounds[j] = ub
+            # Sub-ranges of the jobs that we have made the least progress on
+            # go to the idle workers first
+            pending.sort(key=lambda item: item[1])
+        elif freeJobs and activeCPUs < CPUs:
             # Allocate a CPU to each of the jobs that we have made the least
             # progress on
             freeJobs.sort(key=lambda j: lowerBounds[j])
@@ -169,6 +308,7 @@ def multicoreEnumeration(
                     continue
                 g, request = j[:2]
                 bi = budgetIncrement(lowerBounds[j])
+                ub = launchUpperBound(lowerBounds[j], bi)
                 thisTimeout = enumerationTimeout - stopwatches[j].elapsed
                 eprint(
                     "(frontend) Launching %s (%d tasks) w/ %d CPUs. %f <= MDL < %f. Timeout %f."
@@ -177,34 +317,25 @@ def multicoreEnumeration(
                         len(jobs[j]),
                         allocation[j],
                         lowerBounds[j],
-                        lowerBounds[j] + bi,
+                        ub,
                         thisTimeout,
                     )
                 )
                 stopwatches[j].start()
-                parallelCallback(
-                    wrapInThread(solver),
-                    q=q,
-                    g=g,
-                    ID=nextID,
-                    elapsedTime=stopwatches[j].elapsed,
-                    CPUs=allocation[j],
-                    tasks=jobs[j],
-                    lowerBound=lowerBounds[j],
-                    upperBound=lowerBounds[j] + bi,
-                    budgetIncrement=bi,
-                    timeout=thisTimeout,
-                    evaluationTimeout=evaluationTimeout,
-                    maximumFrontiers=maximumFrontiers(j),
-                    testing=testing,
-                    likelihoodModel=likelihoodModel,
-                )
-                id2CPUs[nextID] = allocation[j]
-                id2job[nextID] = j
-                nextID += 1
-
-                activeCPUs += allocation[j]
-                lowerBounds[j] += bi
+                launch(j, allocation[j], lowerBounds[j], ub, bi)
+                lowerBounds[j] = ub
+
+        # Idle workers steal the next waiting sub-range
+        while pending and activeCPUs < CPUs:
+            j, lowerBound, upperBound, subrange = pending.pop(0)
+            launch(
+                j,
+                1,
+                lowerBound,
+                upperBound,
+                upperBound - lowerBound,
+                subrange=subrange,
+            )
 
         # If nothing is running, and we just tried to launch jobs,
         # then that means we are finished
@@ -217,16 +348,34 @@ def multicoreEnumeration(
         if message.result == "failure":
             eprint("PANIC! Exception in child worker:", message.exception)
             eprint(message.stacktrace)
+            if pool is not None:
+                # Other workers are still busy with this call
+                EnumerationWorkerPool.shutdown()
             assert False
         elif message.result == "success":
             # Mark the CPUs is no longer being used and pause the stopwatch
             activeCPUs -= id2CPUs[message.ID]
-            stopwatches[id2job[message.ID]].stop()
+            busyTime += (time.time() - id2start[message.ID]) * id2CPUs[message.ID]
+            j = id2job.pop(message.ID)
+            if stealing:
+                outstanding[j] -= 1
+            if outstanding[j] == 0:
+                stopwatches[j].stop()
 
             newFrontiers, searchTimes, pc = message.value
+            if pool is not None:
+                # Pooled workers send back the new entries keyed by task name
+                pool.finished(message.ID)
+                newFrontiers = {
+                    name2task[n]: Frontier(entries, task=name2task[n])
+                    for n, entries in newFrontiers.items()
+                }
+                searchTimes = {name2task[n]: dt for n, dt in searchTimes.items()}
             for t, f in newFrontiers.items():
                 oldBest = None if len(frontiers[t]) == 0 else frontiers[t].bestPosterior
-                frontiers[t] = frontiers[t].combine(f)
+                # Several sub-ranges of a band can each fill the frontier, so
+                # when stealing only the best maximumFrontier are kept
+                frontiers[t].add(f)
                 newBest = None if len(frontiers[t]) == 0 else frontiers[t].bestPosterior
 
                 taskToNumberOfPrograms[t] += pc
@@ -250,12 +399,22 @@ def multicoreEnumeration(
             eprint("Unknown message result:", message.result)
             assert False
 
+    if pool is not None:
+        pool.forget(job2resident.values())
+
+    wallTime = time.time() - startTime
+    if wallTime > 0:
+        eprint(
+            "(frontend) CPU utilization %.1f%% (%f CPU seconds in workers over %f seconds with %d CPUs)"
+            % (100.0 * busyTime / (CPUs * wallTime), busyTime, wallTime, CPUs)
+        )
+
     eprint(
         "We enumerated this many programs, for each task:\n\t",
         list(taskToNumberOfPrograms.values()),
     )
 
-    return [frontiers[t] for t in tasks], bestSearchTime
+    return [frontiers[t].frontier() for t in tasks], bestSearchTime
 
 
 def wrapInThread(f):
@@ -288,6 +447,195 @@ def wrapInThread(f):
     return _f
 
 
+class EnumerationWorkerPool(object):
+    """Long-lived worker processes for the python solvers.
+
+    Forking a process per launch means copying the grammar and the tasks into
+    a fresh interpreter for every budget increment. Instead each worker keeps
+    the grammar and tasks of a job resident once it has seen them, takes work
+    items (job, lowerBound, upperBound) that only name the tasks still being
+    worked on, and sends back the new frontier entries keyed by task name.
+    One pool is shared by every call to multicoreEnumeration, so it survives
+    across budget increments and across wake phases. Running work items can be
+    cancelled through a flag shared with their worker."""
+
+    SHARED = None
+
+    def __init__(self, size):
+        from multiprocessing import Queue
+
+        self.results = Queue()
+        self.inboxes = []
+        self.processes = []
+        # ID of the work item each worker should abandon
+        self.cancelled = []
+        # Which jobs each worker holds in memory, and which workers are free
+        self.resident = []
+        self.idle = set()
+        self.id2worker = {}
+        self.nextJob = 0
+        self.grow(size)
+
+    @staticmethod
+    def shared(size):
+        """The pool shared across calls, grown to at least size workers"""
+        pool = EnumerationWorkerPool.SHARED
+        if pool is None or not pool.alive():
+            pool = EnumerationWorkerPool.SHARED = EnumerationWorkerPool(size)
+        pool.grow(size)
+        return pool
+
+    @staticmethod
+    def shutdown():
+        pool = EnumerationWorkerPool.SHARED
+        EnumerationWorkerPool.SHARED = None
+        if pool is not None:
+            for p in pool.processes:
+                p.terminate()
+            for p in pool.processes:
+                p.join()
+
+    def __len__(self):
+        return len(self.processes)
+
+    def alive(self):
+        return all(p.is_alive() for p in self.processes)
+
+    def grow(self, size):
+        from multiprocessing import Process, Queue, Value
+
+        while len(self) < size:
+            inbox = Queue()
+            cancelled = Value("l", -1, lock=False)
+            # Daemonic so that a finished or crashed frontend never waits on
+            # workers blocked on their inbox
+            p = Process(
+                target=_enumerationWorker,
+                args=(inbox, self.results, cancelled),
+                daemon=True,
+            )
+            p.start()
+            self.idle.add(len(self.processes))
+            self.inboxes.append(inbox)
+            self.cancelled.append(cancelled)
+            self.processes.append(p)
+            self.resident.append(set())
+
+    def newJob(self):
+        self.nextJob += 1
+        return self.nextJob
+
+    def launch(self, solver, ID, job, g, tasks, maximumFrontiers, **arguments):
+        """Runs solver on an idle worker, preferring one that already holds the
+        grammar and tasks of job. The result arrives on self.results."""
+        import dill
+
+        assert self.idle, "no idle enumeration worker"
+        worker = min(self.idle, key=lambda w: (job not in self.resident[w], w))
+        self.idle.remove(worker)
+        self.id2worker[ID] = worker
+        self.cancelled[worker].value = -1
+
+        payload = None
+        if job not in self.resident[worker]:
+            payload = (g, tasks)
+            self.resident[worker].add(job)
+        item = (
+            solver,
+            ID,
+            job,
+            payload,
+            [t.name for t in tasks],
+            {t.name: n for t, n in maximumFrontiers.items()},
+            arguments,
+        )
+        with picklingByReference():
+            self.inboxes[worker].put(dill.dumps(item))
+
+    def finished(self, ID):
+        self.idle.add(self.id2worker.pop(ID))
+
+    def cancel(self, ID):
+        """Asks the worker running ID to stop and report what it found so far"""
+        if ID in self.id2worker:
+            self.cancelled[self.id2worker[ID]].value = ID
+
+    def forget(self, jobs):
+        """Drops the grammars and tasks of jobs that are over"""
+        import dill
+
+        for worker, resident in enumerate(self.resident):
+            stale = resident & set(jobs)
+            if stale:
+                resident -= stale
+                self.inboxes[worker].put(dill.dumps(("forget", stale)))
+
+
+def _enumerationWorker(inbox, outbox, cancelled):
+    import dill
+
+    # Map from job to (grammar, map from task name to task)
+    resident = {}
+    while True:
+        item = dill.loads(inbox.get())
+        if item[0] == "forget":
+            for job in item[1]:
+                resident.pop(job, None)
+            continue
+
+        solver, ID, job, payload, names, maximumFrontiers, arguments = item
+        if payload is not None:
+            g, tasks = payload
+            resident[job] = (g, {t.name: t for t in tasks})
+        g, name2task = resident[job]
+        tasks = [name2task[n] for n in names]
+        maximumFrontiers = {name2task[n]: m for n, m in maximumFrontiers.items()}
+
+        try:
+            frontiers, searchTimes, pc = solver(
+                g=g,
+                tasks=tasks,
+                maximumFrontiers=maximumFrontiers,
+                stop=lambda: cancelled.value == ID,
+                **arguments,
+            )
+            value = (
+                {t.name: f.entries for t, f in frontiers.items()},
+                {t.name: dt for t, dt in searchTimes.items()},
+                pc,
+            )
+            outbox.put(dill.dumps({"result": "success", "ID": ID, "value": value}))
+        except Exception as e:
+            outbox.put(
+                dill.dumps(
+                    {
+                        "result": "failure",
+                        "exception": e,
+                        "stacktrace": traceback.format_exc(),
+                        "ID": ID,
+                    }
+                )
+            )
+
+
+def taskMessage(t, maximumFrontier):
+    """The JSON description of a task for the OCaml solver. Inputs such as
+    Scenes are sent as the nested lists they stand for."""
+    m = {
+        "examples": [
+            {"inputs": list(tuplify(xs)), "output": y} for xs, y in t.examples
+        ],
+        "name": t.name,
+        "request": t.request.json(),
+        "maximumFrontier": maximumFrontier,
+    }
+    if hasattr(t, "specialTask"):
+        special, extra = t.specialTask
+        m["specialTask"] = special
+        m["extras"] = extra
+    return m
+
+
 def solveForTask_ocaml(
     _=None,
     elapsedTime=0.0,
@@ -306,22 +654,9 @@ def solveForTask_ocaml(
 
     import json
 
-    def taskMessage(t):
-        m = {
-            "examples": [{"inputs": list(xs), "output": y} for xs, y in t.examples],
-            "name": t.name,
-            "request": t.request.json(),
-            "maximumFrontier": maximumFrontiers[t],
-        }
-        if hasattr(t, "specialTask"):
-            special, extra = t.specialTask
-            m["specialTask"] = special
-            m["extras"] = extra
-        return m
-
     message = {
         "DSL": g.json(),
-        "tasks": [taskMessage(t) for t in tasks],
+        "tasks": [taskMessage(t, maximumFrontiers[t]) for t in tasks],
         "programTimeout": evaluationTimeout,
         "nc": CPUs,
         "timeout": timeout,
@@ -446,6 +781,8 @@ def solveForTask_python(
     evaluationTimeout=None,
     maximumFrontiers=None,
     testing=False,
+    subrange=None,
+    stop=None,
 ):
     return enumerateForTasks(
         g,
@@ -459,6 +796,74 @@ def solveForTask_python(
         budgetIncrement=budgetIncrement,
         lowerBound=lowerBound,
         upperBound=upperBound,
+        subrange=subrange,
+        stop=stop,
+    )
+
+
+def solveForTask_incremental(
+    _=None,
+    elapsedTime=0.0,
+    g=None,
+    tasks=None,
+    lowerBound=None,
+    upperBound=None,
+    budgetIncrement=None,
+    timeout=None,
+    CPUs=1,
+    likelihoodModel=None,
+    evaluationTimeout=None,
+    maximumFrontiers=None,
+    testing=False,
+    stop=None,
+):
+    return enumerateForTasks(
+        g,
+        tasks,
+        likelihoodModel,
+        timeout=timeout,
+        testing=testing,
+        elapsedTime=elapsedTime,
+        evaluationTimeout=evaluationTimeout,
+        maximumFrontiers=maximumFrontiers,
+        budgetIncrement=budgetIncrement,
+        lowerBound=lowerBound,
+        upperBound=upperBound,
+        stop=stop,
+        incremental=True,
+    )
+
+
+def solveForTask_observational(
+    _=None,
+    elapsedTime=0.0,
+    g=None,
+    tasks=None,
+    lowerBound=None,
+    upperBound=None,
+    budgetIncrement=None,
+    timeout=None,
+    CPUs=1,
+    likelihoodModel=None,
+    evaluationTimeout=None,
+    maximumFrontiers=None,
+    testing=False,
+    stop=None,
+):
+    return enumerateForTasks(
+        g,
+        tasks,
+        likelihoodModel,
+        timeout=timeout,
+        testing=testing,
+        elapsedTime=elapsedTime,
+        evaluationTimeout=evaluationTimeout,
+        maximumFrontiers=maximumFrontiers,
+        budgetIncrement=budgetIncrement,
+        lowerBound=lowerBound,
+        upperBound=upperBound,
+        stop=stop,
+        observationalEquivalence=True,
     )
 
 
@@ -533,7 +938,7 @@ def solveForTask_bottom(
     eprint("Enumerated", number_of_programs, "programs")
 
     frontiers = {
-        t: Frontier.combineMany([fs[t] for fs, _ in results]).topK(maximumFrontiers[t])
+        t: Frontier.combineMany([fs[t] for fs, _ in results], maximumFrontiers[t])
         for t in tasks
     }
 
@@ -624,6 +1029,547 @@ class EnumerationTimeout(Exception):
     pass
 
 
+# How many nats past its lower bound a single launch of the incremental solver covers
+INCREMENTALENUMERATIONHORIZON = 99.0
+
+# Solvers that run inside the python process, and so on EnumerationWorkerPool
+POOLEDSOLVERS = {"python", "incremental", "observational"}
+
+
+# Each band of the python solver is split into this many sub-ranges per CPU,
+# so that workers which finish early can steal the remaining ones
+SUBRANGESPERCPU = 2
+
+
+def enumerateSubrange(g, request, lowerBound, upperBound, subrange, maximumDepth=99):
+    """Enumerates the programs with lowerBound <= MDL < upperBound that fall in
+    sub-range k of n, where subrange = (k, n). The search tree is cut below the
+    head of the body and its first argument, and the resulting branches are
+    dealt out round robin; every sub-range walks the same (deterministic)
+    candidates and first arguments, so the n sub-ranges partition the band."""
+    k, n = subrange
+    environment = []
+    while request.isArrow():
+        environment = [request.arguments[0]] + environment
+        request = request.arguments[1]
+
+    def wrap(body):
+        for _ in environment:
+            body = Abstraction(body)
+        return body
+
+    branch = -1
+    for l, t, p, context in g.buildCandidates(
+        request, Context.EMPTY, environment, normalize=True
+    ):
+        if not (-l < upperBound):
+            continue
+        xs = t.functionArguments()
+        if xs == []:
+            branch += 1
+            if branch % n == k and lowerBound <= -l:
+                yield l, context, wrap(p)
+            continue
+
+        for argL, newContext, arg in g.enumeration(
+            context,
+            environment,
+            xs[0].apply(context),
+            upperBound=upperBound + l,
+            maximumDepth=maximumDepth - 1,
+        ):
+            if violatesSymmetry(p, arg, 0):
+                continue
+            branch += 1
+            if branch % n != k:
+                continue
+            for resultL, resultK, result in g.enumerateApplication(
+                newContext,
+                environment,
+                Application(p, arg),
+                xs[1:],
+                upperBound=upperBound + l + argL,
+                lowerBound=lowerBound + l + argL,
+                maximumDepth=maximumDepth - 1,
+                originalFunction=p,
+                argumentIndex=1,
+            ):
+                yield resultL + argL + l, resultK, wrap(result)
+
+
+class IncrementalEnumerator(object):
+    """
+    Enumerates the programs of a grammar in successive cost bands without ever
+    rebuilding a partial program.
+
+    Grammar.enumeration restarts from the root for every band and re-derives
+    every partial program below the old lower bound just to discard it. Here a
+    partial program is expanded exactly once: its candidates are built and
+    sorted by cost, the ones that fit in the current band are explored, and the
+    rest are suspended together with the partial program's context and resumed
+    by whichever later band they fit in.
+
+    A partial program is a tuple (cost, context, goals, trace) where
+    cost: description length of the partial program so far, in nats
+    goals: linked list ((request, environment, parent, argumentIndex, depth), rest)
+        of holes that still need to be filled, leftmost hole first
+    trace: linked list (token, previous) of the choices made so far, in reverse
+        preorder. A token is either LAMBDA or a (production, number of arguments) pair.
+    """
+
+    LAMBDA = None
+
+    def __init__(self, g, request, maximumDepth=99):
+        self.g = g
+        self.request = request
+        self.contextual = isinstance(g, ContextualGrammar)
+        # Partial programs that have not been expanded yet
+        self.pending = [
+            (0.0, Context.EMPTY, ((request, [], None, None, maximumDepth), None), None)
+        ]
+        # Expansions that still have candidates which did not fit in a band:
+        # [cost of the cheapest remaining candidate, expansion, index of that candidate]
+        self.suspended = []
+        # Upper bound of the most recent band; everything cheaper has been enumerated
+        self.enumeratedBound = 0.0
+        # How many partial programs we have expanded so far
+        self.expansions = 0
+
+    @property
+    def exhausted(self):
+        return not self.pending and not self.suspended
+
+    def grammarFor(self, parent, argumentIndex):
+        if not self.contextual:
+            return self.g
+        if parent is None:
+            return self.g.noParent
+        if parent.isIndex:
+            return self.g.variableParent
+        return self.g.library[parent][argumentIndex]
+
+    @staticmethod
+    def program(trace):
+        tokens = []
+        while trace is not None:
+            token, trace = trace
+            tokens.append(token)
+        tokens.reverse()
+
+        def build(i):
+            token = tokens[i]
+            if token is IncrementalEnumerator.LAMBDA:
+                body, i = build(i + 1)
+                return Abstraction(body), i
+            f, numberOfArguments = token
+            i += 1
+            for _ in range(numberOfArguments):
+                x, i = build(i)
+                f = Application(f, x)
+            return f, i
+
+        p, _ = build(0)
+        return p
+
+    def expand(self, partial):
+        """Builds the candidates for the leftmost hole of a partial program.
+        Returns an expansion (cost, goals, trace, environment, depth, candidates)
+        with candidates sorted by cost, or None if the hole cannot be filled."""
+        cost, context, goals, trace = partial
+        (request, environment, parent, argumentIndex, depth), goals = goals
+        # Out of depth: Grammar.enumeration stops at depth 1 and needs one
+        # more level for the arguments of whatever fills this hole
+        if depth <= 2:
+            return None
+        self.expansions += 1
+
+        isAbstraction = request.isArrow()
+        while request.isArrow():
+            environment = [request.arguments[0]] + environment
+            request = request.arguments[1]
+            trace = (self.LAMBDA, trace)
+
+        try:
+            candidates = self.grammarFor(parent, argumentIndex).buildCandidates(
+                request, context, environment, normalize=True
+            )
+        except NoCandidates:
+            return None
+        candidates = sorted(
+            (
+                (-l, t, p, newContext)
+                for l, t, p, newContext in candidates
+                if isAbstraction
+                or parent is None
+                or not violatesSymmetry(parent, p, argumentIndex)
+            ),
+            key=lambda c: c[0],
+        )
+        if not candidates:
+            return None
+        return cost, goals, trace, environment, depth, candidates
+
+    def resume(self, expansion, i, upperBound, stack):
+        """Pushes the children of an expansion, starting from its i-th candidate,
+        that are cheaper than upperBound; suspends the remaining candidates"""
+        cost, goals, trace, environment, depth, candidates = expansion
+        while i < len(candidates):
+            mdl, t, p, newContext = candidates[i]
+            if cost + mdl >= upperBound:
+                self.suspended.append((cost + mdl, expansion, i))
+                return
+            xs = t.functionArguments()
+            newGoals = goals
+            for j in reversed(range(len(xs))):
+                newGoals = ((xs[j], environment, p, j, depth - 1), newGoals)
+            stack.append((cost + mdl, newContext, newGoals, ((p, len(xs)), trace)))
+            i += 1
+
+    def enumeration(self, lowerBound, upperBound):
+        """Enumerates all programs whose MDL satisfies: lowerBound <= MDL < upperBound.
+        Successive calls must use increasing upper bounds; a call resumes from the
+        expansions suspended by the previous one.
+        Yields (log prior, context, program), like Grammar.enumeration"""
+        assert (
+            upperBound >= self.enumeratedBound
+        ), "IncrementalEnumerator: bands must be enumerated in increasing order"
+        self.enumeratedBound = upperBound
+
+        stack = self.pending
+        self.pending = []
+        suspended = self.suspended
+        self.suspended = []
+        for minimumCost, expansion, i in suspended:
+            if minimumCost < upperBound:
+                self.resume(expansion, i, upperBound, stack)
+            else:
+                self.suspended.append((minimumCost, expansion, i))
+
+        # The suspended expansions are acyclic and long lived, so the cyclic
+        # garbage collector only ever rescans them for nothing. Keep it off
+        # while expanding and let it run while the caller scores programs.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            while stack:
+                partial = stack.pop()
+                if partial[0] >= upperBound:
+                    self.pending.append(partial)
+                    continue
+                if partial[2] is None:
+                    if lowerBound <= partial[0]:
+                        if collecting:
+                            gc.enable()
+                        yield -partial[0], partial[1], self.program(partial[3])
+                        gc.disable()
+                    continue
+                expansion = self.expand(partial)
+                if expansion is not None:
+                    self.resume(expansion, 0, upperBound, stack)
+        finally:
+            if collecting:
+                gc.enable()
+
+
+class ObservationalEquivalence(object):
+    """Observational-equivalence pruning for the python enumerator.
+
+    An argument whose free variables are all bound by the outermost lambdas of
+    the request can be run directly on the task inputs. Its outputs on every
+    example of every task form a signature, and an argument is redundant when a
+    different argument of no greater cost with the same signature has already
+    been enumerated in the same position (function, argument index, type).
+    Replacing it by that cheaper argument gives a program that is at least as
+    probable and behaves identically on the examples, so it has been or will be
+    enumerated anyway. Whole programs are pruned the same way. Functions have
+    no signature, so arguments and programs of arrow type are never evaluated.
+    Neither are subterms under a lambda the program itself introduces, e.g.
+    the body of the function passed to map: their environment has variables
+    the task inputs give no values for, so they are never pruned.
+
+    Signatures that take longer than timeout to compute are given up on, and
+    the programs keep being enumerated. Both caches are emptied once they
+    fill up, which only costs pruning that would have happened."""
+
+    # Programs whose signatures are remembered
+    SIGNATURECACHESIZE = 100000
+    # Behaviours whose cheapest program is remembered
+    REPRESENTATIVECACHESIZE = 100000
+
+    def __init__(self, tasks, request, timeout=None):
+        self.depth = len(request.functionArguments())
+        self.returnsArrow = request.returns().isArrow()
+        self.timeout = timeout
+        # Environments of CompileVisitor closures: innermost variable last
+        self.environments = [tuple(xs) for task in tasks for xs, _ in task.examples]
+        # Map from program to its signature, or None if it cannot be computed
+        self.signatures = {}
+        # Map from (position, signature) to the cheapest (cost, program)
+        self.representatives = {}
+        self.unique = 0
+        self.pruned = 0
+
+    @staticmethod
+    def hashable(value):
+        if isinstance(value, (list, tuple)):
+            return tuple(ObservationalEquivalence.hashable(v) for v in value)
+        if isinstance(value, dict):
+            return tuple(
+                sorted(
+                    (k, ObservationalEquivalence.hashable(v)) for k, v in value.items()
+                )
+            )
+        if isinstance(value, (set, frozenset)):
+            return frozenset(ObservationalEquivalence.hashable(v) for v in value)
+        if hasattr(value, "tolist"):
+            return (
+                type(value).__name__,
+                ObservationalEquivalence.hashable(value.tolist()),
+            )
+        if callable(value):
+            raise TypeError("functions have no observable signature")
+        hash(value)
+        # Keep True and 1 apart
+        return (type(value).__name__, value)
+
+    def signature(self, program):
+        if program in self.signatures:
+            return self.signatures[program]
+        if len(self.signatures) >= self.SIGNATURECACHESIZE:
+            self.signatures = {}
+        try:
+            f = CompileVisitor.shared.compile(program)
+            s = runWithTimeout(
+                lambda: tuple(self.hashable(f(e)) for e in self.environments),
+                self.timeout,
+            )
+        except Exception:
+            s = None
+        self.signatures[program] = s
+        return s
+
+    def redundant(self, position, environment, cost, program):
+        """Returns True if program should be skipped at this position"""
+        if len(environment) != self.depth:
+            return False
+        if self.returnsArrow if position is None else position[2].isArrow():
+            return False
+        s = self.signature(program)
+        if s is None:
+            return False
+        k = (position, s)
+        representative = self.representatives.get(k)
+        if representative is None:
+            if len(self.representatives) >= self.REPRESENTATIVECACHESIZE:
+                self.representatives = {}
+            self.unique += 1
+        elif representative[1] == program:
+            return False
+        elif representative[0] <= cost:
+            self.pruned += 1
+            return True
+        self.representatives[k] = (cost, program)
+        return False
+
+
+class BatchedTaskScorer(object):
+    """Scores a program against every task of a job at once.
+
+    Tasks that share a request type often share inputs too, so the example
+    inputs of all tasks are deduplicated up front and the program is run at
+    most once per distinct input; each task then only compares the cached
+    outputs with its expected outputs. When every distinct input is a single
+    Scene, programs that SceneBatch can lower are run on all of them at once
+    with a few array operations instead, and if the expected outputs are
+    numbers every task is checked by one more. This reproduces Task.check under an
+    AllOrNothingLikelihoodModel. Other tasks (subclasses overriding how they
+    are checked, cached tasks) and other likelihood models fall back to
+    likelihoodModel.score."""
+
+    # Python usually rejects a program after one or two examples of a task,
+    # so running it on every input only pays off for jobs with this many tasks
+    SCENEBATCH = 24
+
+    def __init__(self, tasks, likelihoodModel):
+        self.tasks = tasks
+        self.likelihoodModel = likelihoodModel
+        self.timeout = getattr(likelihoodModel, "timeout", None)
+        self.fuel = getattr(likelihoodModel, "fuel", None)
+        # Whether the timer of the current evaluation may raise
+        self.evaluating = False
+
+        inputIndex = {}
+        # For each task, a list of (distinct input index, expected output),
+        # or None if the task has to go through likelihoodModel.score
+        self.examples = []
+        self.inputs = []
+        for task in tasks:
+            if not self.batchable(task, likelihoodModel):
+                self.examples.append(None)
+                continue
+            examples = []
+            for xs, y in task.examples:
+                try:
+                    k = ObservationalEquivalence.hashable(xs)
+                except TypeError:
+                    k = ("unhashable", len(self.inputs))
+                if k not in inputIndex:
+                    inputIndex[k] = len(self.inputs)
+                    self.inputs.append(xs)
+                examples.append((inputIndex[k], y))
+            self.examples.append(examples)
+        self.scenes = None
+        if sum(examples is not None for examples in self.examples) >= self.SCENEBATCH:
+            self.scenes = SceneBatch.of(self.inputs)
+        # Distinct input index and expected output of every example of every
+        # batchable task, back to back, for checking batched outputs
+        self.batched = None
+        if self.scenes is not None and all(
+            isinstance(y, (bool, int))
+            for examples in self.examples
+            if examples is not None
+            for _, y in examples
+        ):
+            self.batched = [
+                n for n, examples in enumerate(self.examples) if examples is not None
+            ]
+            flat = [e for n in self.batched for e in self.examples[n]]
+            self.exampleInputs = np.array([i for i, _ in flat], dtype=np.int64)
+            self.expected = np.array([int(y) for _, y in flat], dtype=np.int64)
+            self.exampleCounts = np.array(
+                [len(self.examples[n]) for n in self.batched], dtype=np.int64
+            )
+
+    @staticmethod
+    def batchable(task, likelihoodModel):
+        return (
+            isinstance(likelihoodModel, AllOrNothingLikelihoodModel)
+            and not task.cache
+            and type(task).logLikelihood is Task.logLikelihood
+            and type(task).check is Task.check
+            and type(task).predict is Task.predict
+        )
+
+    def clock(self):
+        """Starts the timeout of the next evaluation: every distinct input,
+        and a batched run over all of them, gets one of its own"""
+        if self.fuel is not None:
+            WATCHDOG.restart()
+        elif self.timeout is not None:
+            self.evaluating = True
+            signal.setitimer(signal.ITIMER_VIRTUAL, self.timeout)
+
+    def predict(self, f, program, i, outputs):
+        if i in outputs:
+            return outputs[i]
+        if self.fuel is not None:
+            Program.refuel(self.fuel)
+        self.clock()
+        try:
+            y = f
+            for a in self.inputs[i]:
+                y = y(a)
+        except EvaluationTimeout:
+            eprint("Timed out while evaluating", program)
+            y = None
+        except Exception:
+            y = None
+        finally:
+            self.evaluating = False
+        outputs[i] = y
+        return y
+
+    def score(self, program):
+        """Returns a list of (success, logLikelihood), one for each task. The
+        handler and timer are set up once for the program, but the timeout
+        applies to each distinct input separately, so a program that is slow
+        on every input still gets as long on each as Task.check gives it"""
+        scores = [None] * len(self.tasks)
+        if self.fuel is not None:
+            WATCHDOG.start(self.timeout)
+        elif self.timeout is not None:
+
+            def timeoutCallBack(_1, _2):
+                # The timer of an evaluation that finished in time may still
+                # go off before the next one rearms it
+                if self.evaluating:
+                    raise EvaluationTimeout()
+
+            handler = signal.signal(signal.SIGVTALRM, timeoutCallBack)
+        try:
+            self._score(program, scores)
+        except EvaluationTimeout:
+            eprint("Timed out while evaluating", program)
+        finally:
+            self.evaluating = False
+            if self.fuel is not None:
+                WATCHDOG.stop()
+            elif self.timeout is not None:
+                signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+                # Handlers not installed from Python are reported as None
+                signal.signal(
+                    signal.SIGVTALRM, signal.SIG_DFL if handler is None else handler
+                )
+
+        for n, (task, examples) in enumerate(zip(self.tasks, self.examples)):
+            if examples is None:
+                # The likelihood model times its own evaluations
+                scores[n] = self.likelihoodModel.score(program, task)
+                if self.fuel is not None:
+                    WATCHDOG.reclaim()
+            elif scores[n] is None:
+                scores[n] = (False, NEGATIVEINFINITY)
+        return scores
+
+    def _score(self, program, scores):
+        """Fills in the scores of the tasks whose examples are checked here"""
+        try:
+            f = program.compile(metered=self.fuel is not None)
+        except IndexError:
+            # free variable
+            f = None
+        except Exception as e:
+            eprint("Exception during evaluation:", e)
+            f = None
+
+        # Map from distinct input index to the program's output on it
+        outputs = {}
+        # Map from task index to whether the batched outputs were all correct
+        successes = {}
+        if f is not None and self.scenes is not None:
+            self.clock()
+            try:
+                batch = self.scenes.evaluate(program)
+            except EvaluationTimeout:
+                eprint("Timed out while evaluating", program)
+                # As if it had timed out on every input
+                batch, f = None, None
+            finally:
+                self.evaluating = False
+            if batch is not None and self.batched is not None:
+                correct = batch[self.exampleInputs] == self.expected
+                successes = dict(
+                    zip(
+                        self.batched,
+                        SceneBatch.reduceat(
+                            np.logical_and, correct, self.exampleCounts, True
+                        ).tolist(),
+                    )
+                )
+            elif batch is not None:
+                outputs = dict(enumerate(batch.tolist()))
+        for n, examples in enumerate(self.examples):
+            if examples is None:
+                continue
+            if n in successes:
+                success = successes[n]
+            else:
+                success = f is not None and all(
+                    self.predict(f, program, i, outputs) == y for i, y in examples
+                )
+            scores[n] = (success, 0.0 if success else NEGATIVEINFINITY)
+
+
 def enumerateForTasks(
     g,
     tasks,
@@ -639,7 +1585,17 @@ def enumerateForTasks(
     upperBound=100.0,
     budgetIncrement=1.0,
     maximumFrontiers=None,
+    incremental=False,
+    observationalEquivalence=False,
+    subrange=None,
+    stop=None,
 ):
+    """incremental: resume each band from the partial programs suspended by the
+    previous one instead of re-enumerating from the root (see IncrementalEnumerator)
+    observationalEquivalence: skip arguments and programs that behave on the task
+    inputs like cheaper ones (see ObservationalEquivalence)
+    subrange: (k, n) to only enumerate sub-range k of n (see enumerateSubrange)
+    stop: called after every program; enumeration ends once it returns True"""
     assert timeout is not None, "enumerateForTasks: You must provide a timeout."
 
     from time import time
@@ -654,11 +1610,24 @@ def enumerateForTasks(
     # we will never maintain maximumFrontier best solutions
     hits = [PQ() for _ in tasks]
 
+    if incremental:
+        enumerator = IncrementalEnumerator(g, request, maximumDepth=99)
+    scorer = BatchedTaskScorer(tasks, likelihoodModel)
+    observational = None
+    if observationalEquivalence:
+        observational = ObservationalEquivalence(
+            tasks, request, timeout=evaluationTimeout
+        )
+        topEnvironment = list(reversed(request.functionArguments()))
+
+    # One periodic timer backs up fuel for every program of this job
+    armed = scorer.fuel is not None and WATCHDOG.arm(scorer.timeout)
+
     starting = time()
     previousBudget = lowerBound
     budget = lowerBound + budgetIncrement
+    totalNumberOfPrograms = 0
     try:
-        totalNumberOfPrograms = 0
         while (
             time() < starting + timeout
             and any(len(h) < mf for h, mf in zip(hits, maximumFrontiers))
@@ -666,31 +1635,42 @@ def enumerateForTasks(
         ):
             numberOfPrograms = 0
 
-            for prior, _, p in g.enumeration(
-                Context.EMPTY,
-                [],
-                request,
-                maximumDepth=99,
-                upperBound=budget,
-                lowerBound=previousBudget,
-            ):
+            if incremental:
+                programs = enumerator.enumeration(previousBudget, budget)
+            elif subrange is not None:
+                programs = enumerateSubrange(
+                    g, request, previousBudget, budget, subrange
+                )
+            else:
+                programs = g.enumeration(
+                    Context.EMPTY,
+                    [],
+                    request,
+                    maximumDepth=99,
+                    upperBound=budget,
+                    lowerBound=previousBudget,
+                    observational=observational,
+                )
+            for prior, _, p in programs:
                 descriptionLength = -prior
                 # Shouldn't see it on this iteration
                 assert descriptionLength <= budget
                 # Should already have seen it
                 assert descriptionLength > previousBudget
 
+                if observational is not None:
+                    body = p
+                    while body.isAbstraction:
+                        body = body.body
+                    if observational.redundant(
+                        None, topEnvironment, descriptionLength, body
+                    ):
+                        continue
+
                 numberOfPrograms += 1
                 totalNumberOfPrograms += 1
 
-                for n in range(len(tasks)):
-                    task = tasks[n]
-
-                    # Warning:changed to max's new likelihood model situation
-                    # likelihood = task.logLikelihood(p, evaluationTimeout)
-                    # if invalid(likelihood):
-                    # continue
-                    success, likelihood = likelihoodModel.score(p, task)
+                for n, (success, likelihood) in enumerate(scorer.score(p)):
                     if not success:
                         continue
 
@@ -710,14 +1690,31 @@ def enumerateForTasks(
 
                 if timeout is not None and time() - starting > timeout:
                     raise EnumerationTimeout
+                if stop is not None and stop():
+                    raise EnumerationTimeout
 
             previousBudget = budget
             budget += budgetIncrement
 
             if budget > upperBound:
                 break
+            if incremental and enumerator.exhausted:
+                break
     except EnumerationTimeout:
         pass
+    finally:
+        if armed:
+            WATCHDOG.disarm()
+    if incremental:
+        eprint(
+            "(incremental enumeration) Built %d partial programs; %d still suspended at MDL %f"
+            % (enumerator.expansions, len(enumerator.suspended), previousBudget)
+        )
+    if observational is not None:
+        eprint(
+            "(observational equivalence) %d unique behaviours; pruned %d redundant candidates"
+            % (observational.unique, observational.pruned)
+        )
     frontiers = {
         tasks[n]: Frontier([e for _, e in hits[n]], task=tasks[n])
         for n in range(len(tasks))
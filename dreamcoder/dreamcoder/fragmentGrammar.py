@@ -442,6 +442,7 @@ class FragmentGrammar(object):
                     concretePrimitive.tp,
                     concretePrimitive,
                 )
+                bestGrammar.clearCache()
                 frontiers = parallelMap(
                     CPUs,
                     lambda frontier: bestGrammar.rescoreFrontier(
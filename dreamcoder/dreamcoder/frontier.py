@@ -1,3 +1,5 @@
+import heapq
+
 from dreamcoder.program import *
 from dreamcoder.task import Task
 from dreamcoder.utilities import *
@@ -19,6 +21,17 @@ class FrontierEntry(object):
             self=self
         )
 
+    def intern(self):
+        """This entry with its program interned, see Program.intern"""
+        if self.program.interned:
+            return self
+        return FrontierEntry(
+            program=self.program.intern(),
+            logPrior=self.logPrior,
+            logLikelihood=self.logLikelihood,
+            logPosterior=self.logPosterior,
+        )
+
     def strip_primitive_values(self):
         return FrontierEntry(
             program=strip_primitive_values(self.program),
@@ -144,10 +157,10 @@ class Frontier(object):
             return Frontier([], self.task)
         if k < 0:
             return self
-        newEntries = sorted(
-            self.entries, key=lambda e: (-e.logPosterior, str(e.program))
+        newEntries = heapq.nsmallest(
+            k, self.entries, key=lambda e: (-e.logPosterior, str(e.program))
         )
-        return Frontier(newEntries[:k], self.task)
+        return Frontier(newEntries, self.task)
 
     def sample(self):
         """Samples an entry from a frontier"""
@@ -220,59 +233,92 @@ class Frontier(object):
     def combine(self, other, tolerance=0.01):
         """Takes the union of the programs in each of the frontiers"""
         assert self.task == other.task
+        union = FrontierUnion(self.task, tolerance=tolerance)
+        return union.add(self).add(other).frontier()
 
-        foundDifference = False
+    @staticmethod
+    def combineMany(fs, maximumFrontier=None):
+        """The union of the programs in each of the frontiers, only keeping
+        the best maximumFrontier of them if given"""
+        union = FrontierUnion(fs[0].task, maximumFrontier)
+        for f in fs:
+            union.add(f)
+        return union.frontier()
+
+
+class _Ranked(object):
+    """An entry in the heap of a FrontierUnion, whose top is the worst entry
+    in the order of Frontier.topK"""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.key = (-entry.logPosterior, str(entry.program))
+
+    def __lt__(self, o):
+        return self.key > o.key
+
+
+class FrontierUnion(object):
+    """The union of frontiers for one task, merged one frontier at a time.
+
+    Entries are indexed by program, so merging in a frontier takes time in
+    proportion to its size rather than to the size of the union. Given a
+    maximumFrontier only the best that many entries are kept, in a heap, so
+    merging N entries costs O(N log maximumFrontier); like topK after every
+    combine, an entry that is pushed out is forgotten."""
+
+    def __init__(self, task, maximumFrontier=None, tolerance=0.01):
+        self.task = task
+        self.tolerance = tolerance
+        if maximumFrontier is not None and maximumFrontier < 0:
+            maximumFrontier = None
+        self.maximumFrontier = maximumFrontier
+        # Map from program to entry
+        self.entries = {}
+        # Only used with a maximumFrontier
+        self.heap = []
+
+    def __len__(self):
+        return len(self.entries)
 
-        x = {e.program: e for e in self}
-        y = {e.program: e for e in other}
-        programs = set(x.keys()) | set(y.keys())
-        union = []
-        for p in programs:
-            if p in x:
-                e1 = x[p]
-                if p in y:
-                    e2 = y[p]
-                    if abs(e1.logPrior - e2.logPrior) > tolerance:
-                        eprint(
-                            "WARNING: Log priors differed during frontier combining: %f vs %f"
-                            % (e1.logPrior, e2.logPrior)
-                        )
-                        eprint("WARNING: \tThe program is", p)
-                        eprint()
-                    if abs(e1.logLikelihood - e2.logLikelihood) > tolerance:
-                        foundDifference = True
-                        eprint(
-                            "WARNING: Log likelihoods deferred for %s: %f & %f"
-                            % (p, e1.logLikelihood, e2.logLikelihood)
-                        )
-                        if hasattr(self.task, "BIC"):
-                            eprint(
-                                "\t%d examples, BIC=%f, parameterPenalty=%f, n parameters=%d, correct likelihood=%f"
-                                % (
-                                    len(self.task.examples),
-                                    self.task.BIC,
-                                    self.task.BIC * math.log(len(self.task.examples)),
-                                    substringOccurrences("REAL", str(p)),
-                                    substringOccurrences("REAL", str(p))
-                                    * self.task.BIC
-                                    * math.log(len(self.task.examples)),
-                                )
-                            )
-                            e1.logLikelihood = (
-                                -substringOccurrences("REAL", str(p))
-                                * self.task.BIC
-                                * math.log(len(self.task.examples))
-                            )
-                            e2.logLikelihood = e1.logLikelihood
-
-                        e1 = FrontierEntry(
-                            program=e1.program,
-                            logLikelihood=(e1.logLikelihood + e2.logLikelihood) / 2,
-                            logPrior=e1.logPrior,
-                        )
-            else:
-                e1 = y[p]
-            union.append(e1)
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    @property
+    def empty(self):
+        return not self.entries
+
+    @property
+    def bestPosterior(self):
+        return min(
+            self.entries.values(), key=lambda e: (-e.logPosterior, str(e.program))
+        )
+
+    def frontier(self):
+        """A Frontier of the entries, best first if there is a maximumFrontier
+        and otherwise in the order they were added"""
+        if self.maximumFrontier is None:
+            return Frontier(list(self.entries.values()), self.task)
+        return Frontier([r.entry for r in sorted(self.heap, reverse=True)], self.task)
+
+    def add(self, frontier):
+        assert self.task == frontier.task
+        foundDifference = False
+        for e in frontier:
+            known = self.entries.get(e.program)
+            if known is None:
+                self.insert(e)
+                continue
+            merged = self.merge(known, e)
+            if merged is known:
+                continue
+            foundDifference = True
+            self.entries[e.program] = merged
+            if self.maximumFrontier is not None:
+                self.heap = [
+                    _Ranked(merged) if r.entry is known else r for r in self.heap
+                ]
+                heapq.heapify(self.heap)
 
         if foundDifference:
             eprint(
@@ -280,12 +326,62 @@ class Frontier(object):
                 % (self.task.name),
                 "\tThis is acceptable only if the likelihood model is stochastic. Took the geometric mean of the likelihoods.",
             )
+        return self
 
-        return Frontier(union, self.task)
+    def insert(self, e):
+        # Frontiers of one task tend to share most of their subprograms
+        e = e.intern()
+        if self.maximumFrontier is None:
+            self.entries[e.program] = e
+            return
+        r = _Ranked(e)
+        if len(self.heap) < self.maximumFrontier:
+            heapq.heappush(self.heap, r)
+        elif self.heap and self.heap[0] < r:
+            worst = heapq.heapreplace(self.heap, r)
+            del self.entries[worst.entry.program]
+        else:
+            return
+        self.entries[e.program] = e
 
-    @staticmethod
-    def combineMany(fs):
-        f = fs[0]
-        for fp in fs[1:]:
-            f = f.combine(fp)
-        return f
+    def merge(self, e1, e2):
+        """The entry for a program that is in two of the frontiers"""
+        p = e1.program
+        if abs(e1.logPrior - e2.logPrior) > self.tolerance:
+            eprint(
+                "WARNING: Log priors differed during frontier combining: %f vs %f"
+                % (e1.logPrior, e2.logPrior)
+            )
+            eprint("WARNING: \tThe program is", p)
+            eprint()
+        if abs(e1.logLikelihood - e2.logLikelihood) > self.tolerance:
+            eprint(
+                "WARNING: Log likelihoods deferred for %s: %f & %f"
+                % (p, e1.logLikelihood, e2.logLikelihood)
+            )
+            if hasattr(self.task, "BIC"):
+                eprint(
+                    "\t%d examples, BIC=%f, parameterPenalty=%f, n parameters=%d, correct likelihood=%f"
+                    % (
+                        len(self.task.examples),
+                        self.task.BIC,
+                        self.task.BIC * math.log(len(self.task.examples)),
+                        substringOccurrences("REAL", str(p)),
+                        substringOccurrences("REAL", str(p))
+                        * self.task.BIC
+                        * math.log(len(self.task.examples)),
+                    )
+                )
+                e1.logLikelihood = (
+                    -substringOccurrences("REAL", str(p))
+                    * self.task.BIC
+                    * math.log(len(self.task.examples))
+                )
+                e2.logLikelihood = e1.logLikelihood
+
+            e1 = FrontierEntry(
+                program=e1.program,
+                logLikelihood=(e1.logLikelihood + e2.logLikelihood) / 2,
+                logPrior=e1.logPrior,
+            )
+        return e1
@@ -32,6 +32,21 @@ class Grammar(object):
         self.expression2likelihood = dict((p, l) for l, _, p in productions)
         self.expression2likelihood[Index(0)] = self.logVariable
 
+        self.clearCandidateCache()
+
+    # Distinct requests and environments remembered by buildCandidates
+    CANDIDATECACHESIZE = 100000
+
+    def clearCandidateCache(self):
+        """Forgets the candidates buildCandidates remembers. Code that changes
+        the productions in place has to call this afterwards"""
+        self.candidateCache = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("candidateCache", None)
+        return state
+
     def randomWeights(self, r):
         """returns a new grammar with random weights drawn from r. calls `r` w/ old weight"""
         return Grammar(
@@ -176,10 +191,156 @@ class Grammar(object):
     ):
         """Primitives that are candidates for being used given a requested type
         If returnTable is false (default): returns [((log)likelihood, tp, primitive, context)]
-        if returntable is true: returns {primitive: ((log)likelihood, tp, context)}"""
+        if returntable is true: returns {primitive: ((log)likelihood, tp, context)}
+
+        Candidates only depend on the request and environment types once the
+        context is applied to them, up to renaming type variables, so they are
+        computed once for each of these canonical types, in a context holding
+        only their variables, and remembered with what each candidate adds to
+        that context: the variables it instantiates and their bindings. These
+        are renamed back into the given context for every call."""
         if returnProbabilities:
             assert normalize
 
+        # The variable candidates are pruned for requests of the continuation
+        # type itself, not for type variables bound to it
+        continuation = self.continuationType == request
+        if not isinstance(self.logVariable, (int, float)) or any(
+            v >= context.nextVariable for v in context.bindings
+        ):
+            # Log probabilities being trained are not remembered, nor are
+            # candidates in contexts that bound variables they did not hand out,
+            # as fresh variables might already be bound
+            candidates = self._buildCandidates(
+                request,
+                context,
+                environment,
+                normalize,
+                returnProbabilities,
+                mustBeLeaf,
+                continuation,
+            )
+        else:
+            candidates = self._cachedCandidates(
+                request,
+                context,
+                environment,
+                normalize,
+                returnProbabilities,
+                mustBeLeaf,
+                continuation,
+            )
+
+        if returnTable:
+            return {p: (l, t, k) for l, t, p, k in candidates}
+        else:
+            return candidates
+
+    def _cachedCandidates(
+        self,
+        request,
+        context,
+        environment,
+        normalize,
+        returnProbabilities,
+        mustBeLeaf,
+        continuation,
+    ):
+        bindings = {}
+        canonicalRequest = request.apply(context).canonical(bindings)
+        canonicalEnvironment = tuple(
+            t.apply(context).canonical(bindings) for t in environment
+        )
+        # Variables the context has not handed out yet are the ones candidates
+        # instantiate, so they keep their offset from the next variable
+        nextVariable = context.nextVariable
+        if any(v >= nextVariable for v in bindings):
+            variables = sorted(bindings, key=lambda v: bindings[v].v)
+            used = [v for v in variables if v < nextVariable]
+            renaming = {
+                bindings[v].v: TypeVariable(
+                    used.index(v) if v < nextVariable else len(used) + v - nextVariable
+                )
+                for v in variables
+            }
+            canonicalRequest = canonicalRequest.canonical(renaming)
+            canonicalEnvironment = tuple(
+                t.canonical(renaming) for t in canonicalEnvironment
+            )
+            bindings = {v: renaming[bindings[v].v] for v in variables}
+            n = len(used)
+        else:
+            n = len(bindings)
+        key = (
+            canonicalRequest,
+            canonicalEnvironment,
+            n,
+            normalize,
+            returnProbabilities,
+            mustBeLeaf,
+            continuation,
+        )
+        cached = self.candidateCache.get(key)
+        if cached is None:
+            if len(self.candidateCache) >= self.CANDIDATECACHESIZE:
+                self.candidateCache = {}
+            try:
+                candidates = self._buildCandidates(
+                    canonicalRequest,
+                    Context(n, []),
+                    canonicalEnvironment,
+                    normalize,
+                    returnProbabilities,
+                    mustBeLeaf,
+                    continuation,
+                )
+                cached = [
+                    (l, t, p, k.nextVariable - n, list(k.bindings.items()))
+                    for l, t, p, k in candidates
+                ]
+            except NoCandidates:
+                cached = NoCandidates
+            self.candidateCache[key] = cached
+        if cached is NoCandidates:
+            raise NoCandidates()
+
+        # From the canonical type variables back to those of the context, and
+        # from the variables candidates instantiate to fresh ones
+        renaming = {new.v: TypeVariable(old) for old, new in bindings.items()}
+        for j in range(max(fresh for _, _, _, fresh, _ in cached)):
+            if n + j not in renaming:
+                renaming[n + j] = TypeVariable(nextVariable + j)
+        if all(v == new.v for v, new in renaming.items()):
+            renaming = None
+        candidates = []
+        for l, t, p, fresh, substitution in cached:
+            if not substitution:
+                k = context
+                if fresh:
+                    k = Context(nextVariable + fresh, bindings=context.bindings)
+            else:
+                extended = context.bindings.copy()
+                for v, b in substitution:
+                    if renaming is None:
+                        extended[v] = b
+                    else:
+                        extended[renaming[v].v] = b.canonical(renaming)
+                k = Context(nextVariable + fresh, bindings=extended)
+            if renaming is not None:
+                t = t.canonical(renaming)
+            candidates.append((l, t, p, k))
+        return candidates
+
+    def _buildCandidates(
+        self,
+        request,
+        context,
+        environment,
+        normalize,
+        returnProbabilities,
+        mustBeLeaf,
+        continuation,
+    ):
         candidates = []
         variableCandidates = []
         for l, t, p in self.productions:
@@ -202,7 +363,7 @@ class Grammar(object):
             except UnificationFailure:
                 continue
 
-        if self.continuationType == request:
+        if continuation:
             terminalIndices = [v.i for t, v, k in variableCandidates if not t.isArrow()]
             if terminalIndices:
                 smallestIndex = Index(min(terminalIndices))
@@ -218,8 +379,6 @@ class Grammar(object):
         ]
         if candidates == []:
             raise NoCandidates()
-        # eprint("candidates inside buildCandidates before norm:")
-        # eprint(candidates)
 
         if normalize:
             z = lse([l for l, t, p, k in candidates])
@@ -227,14 +386,7 @@ class Grammar(object):
                 candidates = [(exp(l - z), t, p, k) for l, t, p, k in candidates]
             else:
                 candidates = [(l - z, t, p, k) for l, t, p, k in candidates]
-
-        # eprint("candidates inside buildCandidates after norm:")
-        # eprint(candidates)
-
-        if returnTable:
-            return {p: (l, t, k) for l, t, p, k in candidates}
-        else:
-            return candidates
+        return candidates
 
     def sample(self, request, maximumDepth=6, maxAttempts=None):
         attempts = 0
@@ -574,9 +726,18 @@ class Grammar(object):
         )
 
     def enumeration(
-        self, context, environment, request, upperBound, maximumDepth=20, lowerBound=0.0
+        self,
+        context,
+        environment,
+        request,
+        upperBound,
+        maximumDepth=20,
+        lowerBound=0.0,
+        observational=None,
     ):
-        """Enumerates all programs whose MDL satisfies: lowerBound <= MDL < upperBound"""
+        """Enumerates all programs whose MDL satisfies: lowerBound <= MDL < upperBound
+        observational: optional ObservationalEquivalence used to drop arguments
+        that behave like a cheaper argument already enumerated"""
         if upperBound < 0 or maximumDepth == 1:
             return
 
@@ -589,6 +750,7 @@ class Grammar(object):
                 upperBound=upperBound,
                 lowerBound=lowerBound,
                 maximumDepth=maximumDepth,
+                observational=observational,
             ):
                 yield l, newContext, Abstraction(b)
 
@@ -611,6 +773,7 @@ class Grammar(object):
                     upperBound=upperBound + l,
                     lowerBound=lowerBound + l,
                     maximumDepth=maximumDepth - 1,
+                    observational=observational,
                 ):
                     yield aL + l, aK, application
 
@@ -629,6 +792,7 @@ class Grammar(object):
         maximumDepth=20,
         originalFunction=None,
         argumentIndex=0,
+        observational=None,
     ):
         if upperBound < 0.0 or maximumDepth == 1:
             return
@@ -650,9 +814,17 @@ class Grammar(object):
                 upperBound=upperBound,
                 lowerBound=0.0,
                 maximumDepth=maximumDepth,
+                observational=observational,
             ):
                 if violatesSymmetry(originalFunction, arg, argumentIndex):
                     continue
+                if observational is not None and observational.redundant(
+                    (originalFunction, argumentIndex, argRequest.apply(newContext)),
+                    environment,
+                    -argL,
+                    arg,
+                ):
+                    continue
 
                 newFunction = Application(function, arg)
                 for resultL, resultK, result in self.enumerateApplication(
@@ -665,6 +837,7 @@ class Grammar(object):
                     maximumDepth=maximumDepth,
                     originalFunction=originalFunction,
                     argumentIndex=argumentIndex + 1,
+                    observational=observational,
                 ):
                     yield resultL + argL, resultK, result
 
@@ -1497,6 +1670,7 @@ class ContextualGrammar:
         parentIndex=None,
         maximumDepth=20,
         lowerBound=0.0,
+        observational=None,
     ):
         """Enumerates all programs whose MDL satisfies: lowerBound <= MDL < upperBound"""
         if upperBound < 0 or maximumDepth == 1:
@@ -1513,6 +1687,7 @@ class ContextualGrammar:
                 upperBound=upperBound,
                 lowerBound=lowerBound,
                 maximumDepth=maximumDepth,
+                observational=observational,
             ):
                 yield l, newContext, Abstraction(b)
         else:
@@ -1542,6 +1717,7 @@ class ContextualGrammar:
                     upperBound=upperBound + l,
                     lowerBound=lowerBound + l,
                     maximumDepth=maximumDepth - 1,
+                    observational=observational,
                 ):
                     yield aL + l, aK, application
 
@@ -1561,6 +1737,7 @@ class ContextualGrammar:
         parent=None,
         originalFunction=None,
         argumentIndex=0,
+        observational=None,
     ):
         assert parent is not None
         if upperBound < 0.0 or maximumDepth == 1:
@@ -1585,9 +1762,17 @@ class ContextualGrammar:
                 upperBound=upperBound,
                 lowerBound=0.0,
                 maximumDepth=maximumDepth,
+                observational=observational,
             ):
                 if violatesSymmetry(originalFunction, arg, argumentIndex):
                     continue
+                if observational is not None and observational.redundant(
+                    (originalFunction, argumentIndex, argRequest.apply(newContext)),
+                    environment,
+                    -argL,
+                    arg,
+                ):
+                    continue
 
                 newFunction = Application(function, arg)
                 for resultL, resultK, result in self.enumerateApplication(
@@ -1601,6 +1786,7 @@ class ContextualGrammar:
                     maximumDepth=maximumDepth,
                     originalFunction=originalFunction,
                     argumentIndex=argumentIndex + 1,
+                    observational=observational,
                 ):
                     yield resultL + argL, resultK, result
 
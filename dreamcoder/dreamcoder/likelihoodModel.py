@@ -10,11 +10,16 @@ gt_dict = {"Data column no. " + str(num): r_str for num, r_str in gt_dict.items(
 
 
 class AllOrNothingLikelihoodModel:
-    def __init__(self, timeout=None):
+    def __init__(self, timeout=None, fuel=None):
         self.timeout = timeout
+        self.fuel = fuel
 
     def score(self, program, task):
-        logLikelihood = task.logLikelihood(program, self.timeout)
+        # Only Task.logLikelihood knows about fuel, not its subclasses
+        if self.fuel is not None and type(task).logLikelihood is Task.logLikelihood:
+            logLikelihood = task.logLikelihood(program, self.timeout, fuel=self.fuel)
+        else:
+            logLikelihood = task.logLikelihood(program, self.timeout)
         return valid(logLikelihood), logLikelihood
 
 
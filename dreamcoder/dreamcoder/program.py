@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import math
+import threading
+import weakref
+from operator import itemgetter
 from time import time
 
 from dreamcoder.type import *
@@ -19,7 +22,24 @@ class RunFailure(Exception):
     pass
 
 
+class OutOfFuel(RunFailure):
+    pass
+
+
+class _Fuel(threading.local):
+    """How many more lambda applications metered closures may perform in
+    this thread (see Program.refuel)"""
+
+    steps = 0
+
+
+FUEL = _Fuel()
+
+
 class Program(object):
+    # Set on the nodes made by Program.intern
+    interned = False
+
     def __repr__(self):
         return str(self)
 
@@ -38,6 +58,11 @@ class Program(object):
         except UnificationFailure as e:
             return False
 
+    def intern(self):
+        """The one shared copy of this program, see InternVisitor. Programs
+        with holes or fragment variables are returned as they are."""
+        return InternVisitor.SHARED.execute(self)
+
     def wrap_in_abstractions(self, n):
         for _ in range(n):
             self = Abstraction(self)
@@ -97,11 +122,27 @@ class Program(object):
             return False
 
     def runWithArguments(self, xs):
-        f = self.evaluate([])
+        f = self.compile()
         for x in xs:
             f = f(x)
         return f
 
+    def compile(self, metered=False):
+        """Same value as self.evaluate([]), but the returned closures do not
+        walk the syntax tree or build environment lists when called.
+        Use it for programs that are run on many inputs.
+        metered: every lambda application consumes one step of the calling
+        thread's fuel and raises OutOfFuel once it is spent"""
+        if metered:
+            return CompileVisitor.metered.execute(self)
+        return CompileVisitor.shared.execute(self)
+
+    @staticmethod
+    def refuel(steps):
+        """Sets how many lambda applications metered programs may perform in
+        the calling thread before raising OutOfFuel"""
+        FUEL.steps = steps
+
     def applicationParses(self):
         yield self, []
 
@@ -110,6 +151,8 @@ class Program(object):
 
     @property
     def closed(self):
+        if self.interned:
+            return not self.cachedFreeVariables
         for surroundingAbstractions, child in self.walk():
             if isinstance(child, FragmentVariable):
                 return False
@@ -299,6 +342,8 @@ class Application(Program):
         )
 
     def freeVariables(self):
+        if self.interned:
+            return self.cachedFreeVariables
         return self.f.freeVariables() | self.x.freeVariables()
 
     def clone(self):
@@ -316,9 +361,11 @@ class Application(Program):
         return True
 
     def __eq__(self, other):
-        return (
-            isinstance(other, Application) and self.f == other.f and self.x == other.x
-        )
+        if self is other:
+            return True
+        if not isinstance(other, Application):
+            return False
+        return self.f == other.f and self.x == other.x
 
     def __hash__(self):
         if self.hashCode is None:
@@ -377,6 +424,8 @@ class Application(Program):
         return visitor.application(self, *arguments, **keywords)
 
     def show(self, isFunction):
+        if self.interned:
+            return self.cachedString[1:-1] if isFunction else self.cachedString
         if isFunction:
             return "%s %s" % (self.f.show(True), self.x.show(False))
         else:
@@ -428,6 +477,8 @@ class Application(Program):
         yield from self.x.walk(surroundingAbstractions)
 
     def size(self):
+        if self.interned:
+            return self.cachedSize
         return self.f.size() + self.x.size()
 
     @staticmethod
@@ -570,7 +621,11 @@ class Abstraction(Program):
         return True
 
     def __eq__(self, o):
-        return isinstance(o, Abstraction) and o.body == self.body
+        if self is o:
+            return True
+        if not isinstance(o, Abstraction):
+            return False
+        return o.body == self.body
 
     def __hash__(self):
         if self.hashCode is None:
@@ -589,6 +644,8 @@ class Abstraction(Program):
         return self.body.isBetaLong()
 
     def freeVariables(self):
+        if self.interned:
+            return self.cachedFreeVariables
         return {f - 1 for f in self.body.freeVariables() if f > 0}
 
     def visit(self, visitor, *arguments, **keywords):
@@ -603,6 +660,8 @@ class Abstraction(Program):
         self.annotatedType = arrow(v.applyMutable(context), self.body.annotatedType)
 
     def show(self, isFunction):
+        if self.interned:
+            return self.cachedString
         return "(lambda %s)" % (self.body.show(False))
 
     def evaluate(self, environment):
@@ -640,6 +699,8 @@ class Abstraction(Program):
         yield from self.body.walkUncurried(d + 1)
 
     def size(self):
+        if self.interned:
+            return self.cachedSize
         return self.body.size()
 
     @staticmethod
@@ -658,6 +719,12 @@ class Abstraction(Program):
 
 class Primitive(Program):
     GLOBALS = {}
+    # Map from id of a curried implementation to
+    # (implementation, arity, function taking all of its arguments at once)
+    UNCURRIED = {}
+    # Map from id of a curried implementation to (implementation, numpy
+    # operation), see CompileVisitor.vectorize
+    VECTORIZED = {}
 
     def __init__(self, name, ty, value):
         self.tp = ty
@@ -666,6 +733,22 @@ class Primitive(Program):
         if name not in Primitive.GLOBALS:
             Primitive.GLOBALS[name] = self
 
+    @staticmethod
+    def registerUncurried(value, arity, uncurried):
+        """Lets Program.compile call uncurried(x1, ..., x_arity) instead of
+        value(x1)...(x_arity) wherever a primitive with this value is
+        applied to exactly arity arguments"""
+        Primitive.UNCURRIED[id(value)] = (value, arity, uncurried)
+
+    @staticmethod
+    def registerVectorized(value, operation):
+        """Lets Program.compile evaluate a predicate over every object of a
+        scene at once (see CompileVisitor.vectorize). operation is a numpy
+        ufunc computing value elementwise, "index" if value(k)(o) is
+        attribute k of the object o, or one of "forall", "exists" and
+        "length" for the scene-level primitives handled by SceneBatch."""
+        Primitive.VECTORIZED[id(value)] = (value, operation)
+
     @property
     def isPrimitive(self):
         return True
@@ -760,13 +843,19 @@ class Invented(Program):
         return True
 
     def show(self, isFunction):
+        if self.interned:
+            return self.cachedString
         return "#%s" % (self.body.show(False))
 
     def visit(self, visitor, *arguments, **keywords):
         return visitor.invented(self, *arguments, **keywords)
 
     def __eq__(self, o):
-        return isinstance(o, Invented) and o.body == self.body
+        if self is o:
+            return True
+        if not isinstance(o, Invented):
+            return False
+        return o.body == self.body
 
     def __hash__(self):
         if self.hashCode is None:
@@ -798,6 +887,8 @@ class Invented(Program):
         return True
 
     def freeVariables(self):
+        if self.interned:
+            return self.cachedFreeVariables
         return set()
 
     def inferType(self, context, environment, freeVariables):
@@ -819,6 +910,8 @@ class Invented(Program):
         yield d, self
 
     def size(self):
+        if self.interned:
+            return self.cachedSize
         return 1
 
     @staticmethod
@@ -1042,6 +1135,334 @@ class ShareVisitor(object):
         return e.visit(self)
 
 
+class InternVisitor(object):
+    """Hash-consing of programs: interned programs that are equal are the
+    same object, so they share every subprogram, usually compare equal by
+    identity alone, and each of their nodes keeps its hash, size, free
+    variables and string. Equality itself stays structural, so interned and
+    ordinary programs compare as their ordinary versions would.
+
+    Unlike ShareVisitor, which shares subprograms within one batch, the
+    tables live as long as the programs in them, so programs interned at
+    different times (e.g. frontiers of successive iterations, or dreams) are
+    shared as well. Interning builds new nodes rather than marking those of
+    the program it is given, so no type annotations are carried over, and
+    primitives are the same only if their values are, as with CompileVisitor.
+    Interned programs are never modified in place, and pickling one gives an
+    ordinary program."""
+
+    def __init__(self):
+        self.table = weakref.WeakValueDictionary()
+
+    def execute(self, e):
+        if e.interned:
+            return e
+        try:
+            return e.visit(self)
+        except _NotInterned:
+            return e
+
+    def child(self, e):
+        if e.interned:
+            return e
+        if not isinstance(e, (Application, Abstraction, Index, Primitive, Invented)):
+            raise _NotInterned()
+        return e.visit(self)
+
+    def canonical(self, key, e):
+        known = self.table.get(key)
+        if known is None:
+            self.table[key] = e
+            known = e
+        return known
+
+    def index(self, e):
+        key = ("index", e.i)
+        known = self.table.get(key)
+        if known is not None:
+            return known
+        return self.canonical(key, Index(e.i))
+
+    def primitive(self, e):
+        # Primitives are shared by every program using them, so they are
+        # interned as they are
+        return self.canonical(("primitive", e.name, id(e.value)), e)
+
+    def fragmentVariable(self, e):
+        raise _NotInterned()
+
+    def application(self, e):
+        f = self.child(e.f)
+        x = self.child(e.x)
+        key = ("application", id(f), id(x))
+        known = self.table.get(key)
+        if known is not None:
+            return known
+        e = Application(f, x)
+        e.hashCode = hash((hash(f), hash(x)))
+        e.cachedSize = f.size() + x.size()
+        e.cachedFreeVariables = frozenset(f.freeVariables() | x.freeVariables())
+        e.cachedString = "(%s %s)" % (f.show(True), x.show(False))
+        e.interned = True
+        return self.canonical(key, e)
+
+    def abstraction(self, e):
+        body = self.child(e.body)
+        key = ("abstraction", id(body))
+        known = self.table.get(key)
+        if known is not None:
+            return known
+        e = Abstraction(body)
+        e.hashCode = hash((hash(body),))
+        e.cachedSize = body.size()
+        e.cachedFreeVariables = frozenset(
+            f - 1 for f in body.freeVariables() if f > 0
+        )
+        e.cachedString = "(lambda %s)" % body.show(False)
+        e.interned = True
+        return self.canonical(key, e)
+
+    def invented(self, e):
+        body = self.child(e.body)
+        key = ("invented", id(body))
+        known = self.table.get(key)
+        if known is not None:
+            return known
+        e = Invented(body)
+        e.hashCode = hash((0, hash(body)))
+        e.cachedSize = 1
+        e.cachedFreeVariables = frozenset()
+        e.cachedString = "#%s" % body.show(False)
+        e.interned = True
+        return self.canonical(key, e)
+
+
+class _NotInterned(Exception):
+    pass
+
+
+InternVisitor.SHARED = InternVisitor()
+
+
+class CompileVisitor(object):
+    """Compiles a program into a Python closure from an environment to the
+    program's value. The environment is a tuple holding the innermost bound
+    variable last, so a de Bruijn index is a constant slot in it; free
+    variables fall off its front and raise IndexError like evaluate does.
+    Primitives registered with Primitive.registerUncurried are called with all
+    of their arguments at once.
+
+    A closure only depends on the syntax of its subterm, so closures are
+    memoized across programs: programs coming out of the enumerator share
+    most of their subterms. Primitives are equal when their names are, but
+    the closures are keyed by the values of the primitives too, as e.g. the
+    text domain makes a STRING primitive for every constant it tries."""
+
+    # Forget every closure once the table gets this large
+    MAXIMUMCACHESIZE = 100000
+
+    def __init__(self, metered=False):
+        self.metered = metered
+        self.cache = {}
+
+    def compile(self, e):
+        key = _CompileKey(e)
+        c = self.cache.get(key)
+        if c is None:
+            if len(self.cache) >= CompileVisitor.MAXIMUMCACHESIZE:
+                self.cache = {}
+            c = e.visit(self)
+            self.cache[key] = c
+        return c
+
+    def primitive(self, e):
+        v = e.value
+        return lambda environment: v
+
+    def invented(self, e):
+        body = self.compile(e.body)
+        # The body is closed, so it does not see the enclosing lambdas
+        return lambda environment: body(())
+
+    def index(self, e):
+        return itemgetter(-1 - e.i)
+
+    def abstraction(self, e):
+        body = self.compile(e.body)
+        vectorized = self.vectorize(e.body)
+        if vectorized is not None:
+            # Only refers to its own variable, so one function serves every
+            # environment
+            f = (lambda x: body((x,))) if not self.metered else self._metered(body)
+            f.vectorized = vectorized
+            return lambda environment: f
+
+        if not self.metered:
+            return lambda environment: lambda x: body(environment + (x,))
+
+        return lambda environment: self._metered(body, environment)
+
+    @staticmethod
+    def _metered(body, environment=()):
+        fuel = FUEL
+
+        def f(x):
+            fuel.steps -= 1
+            if fuel.steps < 0:
+                raise OutOfFuel()
+            return body(environment + (x,))
+
+        return f
+
+    def vectorize(self, e):
+        """Lowers the body of a predicate (lambda e) over an object, built from
+        attribute lookups (index k $0), integer and boolean constants and
+        primitives registered with Primitive.registerVectorized, to a function
+        from an (objects x attributes) array to the vector of values of e on
+        every object. Returns None for any other body.
+
+        The compiled predicate carries this function as its vectorized
+        attribute, so primitives that apply a predicate to every object of a
+        scene can use array operations instead."""
+        if e.isPrimitive:
+            if isinstance(e.value, (bool, int)):
+                c = e.value
+                return lambda array: c
+            return None
+        if not e.isApplication:
+            return None
+        f, xs = e.applicationParse()
+        if not f.isPrimitive or id(f.value) not in Primitive.VECTORIZED:
+            return None
+        value, operation = Primitive.VECTORIZED[id(f.value)]
+        if value is not f.value:
+            return None
+
+        if operation == "index":
+            if len(xs) != 2:
+                return None
+            k, o = xs
+            if not (k.isPrimitive and isinstance(k.value, int) and o.isIndex):
+                return None
+            if o.i != 0:
+                return None
+            k = k.value
+            return lambda array: array[:, k]
+
+        if isinstance(operation, str) or len(xs) != operation.nin:
+            return None
+        arguments = [self.vectorize(x) for x in xs]
+        if any(a is None for a in arguments):
+            return None
+        if len(arguments) == 1:
+            a = arguments[0]
+            return lambda array: operation(a(array))
+        a, b = arguments
+        return lambda array: operation(a(array), b(array))
+
+    def application(self, e):
+        if e.isConditional:
+            branch = self.compile(e.branch)
+            trueBranch = self.compile(e.trueBranch)
+            falseBranch = self.compile(e.falseBranch)
+            return lambda environment: (
+                trueBranch(environment)
+                if branch(environment)
+                else falseBranch(environment)
+            )
+
+        f = e.f
+        while f.isApplication:
+            f = f.f
+        if f.isPrimitive and id(f.value) in Primitive.UNCURRIED:
+            value, arity, u = Primitive.UNCURRIED[id(f.value)]
+            f, xs = e.applicationParse()
+            if value is f.value and len(xs) == arity:
+                return self.saturated(u, xs)
+
+        if e.f.isPrimitive:
+            v = e.f.value
+            if e.x.isPrimitive:
+                # Not applied at compile time in case it raises
+                c = e.x.value
+                return lambda environment: v(c)
+            x = self.compile(e.x)
+            return lambda environment: v(x(environment))
+        f = self.compile(e.f)
+        if e.x.isPrimitive:
+            c = e.x.value
+            return lambda environment: f(environment)(c)
+        x = self.compile(e.x)
+        return lambda environment: f(environment)(x(environment))
+
+    def saturated(self, u, xs):
+        # Primitive arguments are passed as constants instead of through
+        # a closure call
+        if len(xs) == 2:
+            a, b = xs
+            if a.isPrimitive:
+                a = a.value
+                if b.isPrimitive:
+                    b = b.value
+                    return lambda environment: u(a, b)
+                b = self.compile(b)
+                return lambda environment: u(a, b(environment))
+            a = self.compile(a)
+            if b.isPrimitive:
+                b = b.value
+                return lambda environment: u(a(environment), b)
+            b = self.compile(b)
+            return lambda environment: u(a(environment), b(environment))
+        if len(xs) == 1:
+            a = self.compile(xs[0])
+            return lambda environment: u(a(environment))
+        arguments = [self.compile(x) for x in xs]
+        return lambda environment: u(*[a(environment) for a in arguments])
+
+    def execute(self, e):
+        return self.compile(e)(())
+
+
+class _CompileKey(object):
+    """A program as a key of the closures of CompileVisitor: equal to the
+    same program with the very same primitive values"""
+
+    __slots__ = ("program",)
+
+    def __init__(self, program):
+        self.program = program
+
+    def __hash__(self):
+        return hash(self.program)
+
+    def __eq__(self, o):
+        return _sameValues(self.program, o.program)
+
+
+def _sameValues(a, b):
+    while True:
+        if a is b:
+            return True
+        if type(a) is not type(b):
+            return False
+        if a.isPrimitive:
+            return a.name == b.name and a.value is b.value
+        if a.isIndex:
+            return a.i == b.i
+        if a.isApplication:
+            if not _sameValues(a.x, b.x):
+                return False
+            a, b = a.f, b.f
+        elif a.isAbstraction or a.isInvented:
+            a, b = a.body, b.body
+        else:
+            return a == b
+
+
+CompileVisitor.shared = CompileVisitor()
+CompileVisitor.metered = CompileVisitor(metered=True)
+
+
 class Mutator:
     """Perform local mutations to an expr, yielding the expr and the
     description length distance from the original program"""
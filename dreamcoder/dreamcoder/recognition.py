@@ -868,6 +868,12 @@ class RecognitionModel(nn.Module):
             )
 
     def auxiliaryLoss(self, frontier, features):
+        u = self.auxiliaryTarget(frontier)
+        al = self._auxiliaryLoss(self._auxiliaryPrediction(features), u)
+        return al
+
+    def auxiliaryTarget(self, frontier):
+        """Which primitives the best program of the frontier uses, as a vector"""
         # Compute a vector of uses
         ls = frontier.bestPosterior.program
 
@@ -890,8 +896,7 @@ class RecognitionModel(nn.Module):
         u[u > 1.0] = 1.0
         if self.use_cuda:
             u = u.cuda()
-        al = self._auxiliaryLoss(self._auxiliaryPrediction(features), u)
-        return al
+        return u
 
     def taskEmbeddings(self, tasks):
         return {
@@ -1078,6 +1083,55 @@ class RecognitionModel(nn.Module):
         ml = -lls.max()  # Beware that inputs to max change output type
         return ml, al
 
+    def featuresOfTasks(self, tasks):
+        """featuresOfTask for each of the tasks, with None for tasks whose
+        features could not be extracted"""
+        if hasattr(self.featureExtractor, "batchedFeaturesOfTasks"):
+            return self.featureExtractor.batchedFeaturesOfTasks(tasks)
+        return [self.featureExtractor.featuresOfTask(task) for task in tasks]
+
+    def batchedLoss(self, frontiers, biasOptimal, auxiliary=False):
+        """frontierBiasOptimal or frontierKL for a minibatch of frontiers, with
+        one pass of the feature extractor, the MLP and batchedLogLikelihoods.
+        Returns the vector of losses of the frontiers whose features could be
+        extracted, the auxiliary loss averaged over them, and their indices."""
+        features = self.featuresOfTasks([frontier.task for frontier in frontiers])
+        kept = [n for n, x in enumerate(features) if x is not None]
+        if not kept:
+            return None, None, kept
+        frontiers = [frontiers[n] for n in kept]
+        features = torch.stack([features[n] for n in kept])
+
+        targets = torch.stack([self.auxiliaryTarget(f) for f in frontiers])
+        al = self._auxiliaryLoss(
+            self._auxiliaryPrediction(features if auxiliary else features.detach()),
+            targets,
+        )
+
+        features = self._MLP(features)
+        if not biasOptimal:
+            # Monte Carlo estimate: draw a sample from each frontier
+            entries = [frontier.sample() for frontier in frontiers]
+            lls = self.grammarBuilder.batchedLogLikelihoods(
+                features, [entry.program for entry in entries]
+            ).view(-1)
+            return -lls, al, kept
+
+        owners = torch.tensor(
+            [n for n, frontier in enumerate(frontiers) for _ in frontier.entries]
+        )
+        if self.use_cuda:
+            owners = owners.cuda()
+        entries = [entry for frontier in frontiers for entry in frontier]
+        lls = self.grammarBuilder.batchedLogLikelihoods(
+            features.index_select(0, owners), [entry.program for entry in entries]
+        )
+        actual_ll = torch.Tensor([entry.logLikelihood for entry in entries])
+        lls = lls + (actual_ll.cuda() if self.use_cuda else actual_ll)
+        sizes = [len(frontier.entries) for frontier in frontiers]
+        best = torch.stack([l.max() for l in torch.split(lls, sizes)])
+        return -best, al, kept
+
     def replaceProgramsWithLikelihoodSummaries(self, frontier):
         return Frontier(
             [
@@ -1110,17 +1164,24 @@ class RecognitionModel(nn.Module):
         defaultRequest=None,
         auxLoss=False,
         vectorized=True,
+        batchSize=1,
+        helmholtzStream=None,
     ):
         """
         helmholtzRatio: What fraction of the training data should be forward samples from the generative model?
         helmholtzFrontiers: Frontiers from programs enumerated from generative model (optional)
         If helmholtzFrontiers is not provided then we will sample programs during training
+        batchSize: How many frontiers each gradient step is averaged over. Real and Helmholtz frontiers are mixed within a minibatch according to helmholtzRatio. Minibatches need vectorized.
+        helmholtzStream: Where to take random Helmholtz frontiers from instead of sampling them here (see HelmholtzProducer)
         """
         assert (steps is not None) or (
             timeout is not None
         ), "Cannot train recognition model without either a bound on the number of gradient steps or bound on the training time"
         if steps is None:
             steps = 9999999
+        assert (
+            batchSize == 1 or vectorized
+        ), "Minibatched training of the recognition model needs vectorized=True"
         if biasOptimal is None:
             biasOptimal = len(helmholtzFrontiers) > 0
 
@@ -1181,6 +1242,8 @@ class RecognitionModel(nn.Module):
         helmholtzIndex = [0]
 
         def getHelmholtz():
+            if randomHelmholtz and helmholtzStream is not None:
+                return helmholtzStream.next()
             if randomHelmholtz:
                 if helmholtzIndex[0] >= len(helmholtzFrontiers):
                     updateHelmholtzTasks()
@@ -1328,6 +1391,7 @@ class RecognitionModel(nn.Module):
         )
         eprint("(ID=%d): Contextual? %s" % (self.id, str(self.contextual)))
         eprint("(ID=%d): Bias optimal? %s" % (self.id, str(biasOptimal)))
+        eprint("(ID=%d): Minibatch size %d" % (self.id, batchSize))
         eprint(
             f"(ID={self.id}): Aux loss? {auxLoss} (n.b. we train a 'auxiliary' classifier anyway - this controls if gradients propagate back to the future extractor)"
         )
@@ -1360,26 +1424,39 @@ class RecognitionModel(nn.Module):
                 permutedFrontiers = list(frontiers)
                 random.shuffle(permutedFrontiers)
             else:
-                permutedFrontiers = [None]
+                permutedFrontiers = [None] * batchSize
 
             finishedSteps = False
-            for frontier in permutedFrontiers:
+            for b in range(0, len(permutedFrontiers), batchSize):
                 # Randomly decide whether to sample from the generative model
-                dreaming = random.random() < helmholtzRatio
-                if dreaming:
-                    frontier = getHelmholtz()
+                batch = []
+                for frontier in permutedFrontiers[b : b + batchSize]:
+                    dreaming = random.random() < helmholtzRatio
+                    if dreaming:
+                        frontier = getHelmholtz()
+                    batch.append((frontier, dreaming))
                 self.zero_grad()
-                loss, classificationLoss = (
-                    self.frontierBiasOptimal(
-                        frontier, auxiliary=auxLoss, vectorized=vectorized
+                if batchSize == 1:
+                    frontier, _ = batch[0]
+                    loss, classificationLoss = (
+                        self.frontierBiasOptimal(
+                            frontier, auxiliary=auxLoss, vectorized=vectorized
+                        )
+                        if biasOptimal
+                        else self.frontierKL(
+                            frontier, auxiliary=auxLoss, vectorized=vectorized
+                        )
                     )
-                    if biasOptimal
-                    else self.frontierKL(
-                        frontier, auxiliary=auxLoss, vectorized=vectorized
+                    frontierLosses = None if loss is None else loss.view(-1)
+                    kept = [] if loss is None else [0]
+                else:
+                    frontierLosses, classificationLoss, kept = self.batchedLoss(
+                        [frontier for frontier, _ in batch],
+                        biasOptimal,
+                        auxiliary=auxLoss,
                     )
-                )
-                if loss is None:
-                    if not dreaming:
+                for n, (frontier, dreaming) in enumerate(batch):
+                    if n not in kept and not dreaming:
                         eprint(
                             "ERROR: Could not extract features during experience replay."
                         )
@@ -1388,8 +1465,10 @@ class RecognitionModel(nn.Module):
                             "Aborting - we need to be able to extract features of every actual task."
                         )
                         assert False
-                    else:
-                        continue
+                if not kept:
+                    continue
+                batch = [batch[n] for n in kept]
+                loss = frontierLosses.mean()
                 if is_torch_invalid(loss):
                     eprint("Invalid real-data loss!")
                 else:
@@ -1397,14 +1476,17 @@ class RecognitionModel(nn.Module):
                     classificationLosses.append(classificationLoss.data.item())
                     optimizer.step()
                     totalGradientSteps += 1
-                    losses.append(loss.data.item())
-                    descriptionLengths.append(min(-e.logPrior for e in frontier))
-                    if dreaming:
-                        dreamLosses.append(losses[-1])
-                        dreamMDL.append(descriptionLengths[-1])
-                    else:
-                        realLosses.append(losses[-1])
-                        realMDL.append(descriptionLengths[-1])
+                    for l, (frontier, dreaming) in zip(
+                        frontierLosses.data.tolist(), batch
+                    ):
+                        losses.append(l)
+                        descriptionLengths.append(min(-e.logPrior for e in frontier))
+                        if dreaming:
+                            dreamLosses.append(losses[-1])
+                            dreamMDL.append(descriptionLengths[-1])
+                        else:
+                            realLosses.append(losses[-1])
+                            realMDL.append(descriptionLengths[-1])
                     if totalGradientSteps > steps:
                         break  # Stop iterating, then print epoch and loss, then break to finish.
 
@@ -1458,6 +1540,12 @@ class RecognitionModel(nn.Module):
             time.time() - start,
             "seconds",
         )
+        if randomHelmholtz and helmholtzStream is not None:
+            eprint(
+                "(ID=%d): " % self.id,
+                "Trained on %d background Helmholtz samples, reused %d times"
+                % (helmholtzStream.fresh, helmholtzStream.reused),
+            )
         self.trained = True
         return self
 
@@ -1528,6 +1616,7 @@ class RecognitionModel(nn.Module):
         frontierSize=None,
         maximumFrontier=None,
         evaluationTimeout=None,
+        evaluationFuel=None,
     ):
         with timing("Evaluated recognition model"):
             grammars = {task: self.grammarOfTask(task) for task in tasks}
@@ -1547,9 +1636,95 @@ class RecognitionModel(nn.Module):
             CPUs=CPUs,
             maximumFrontier=maximumFrontier,
             evaluationTimeout=evaluationTimeout,
+            evaluationFuel=evaluationFuel,
         )
 
 
+class HelmholtzProducer(object):
+    """Background processes sampling dream frontiers for recognition models.
+
+    Each process repeatedly samples a program from the generative model of
+    one recognition model, turns it into a task with the taskOfProgram of
+    that model's feature extractor, and puts the frontier, with its programs
+    already replaced by likelihood summaries, into a bounded queue for that
+    model. Every model of an ensemble has its own queue and its own
+    processes, so no two models train on the same dreams. The processes are
+    forked when the producer is created, so it has to be created outside of
+    the (daemonic) workers of parallelMap that do the training; those only
+    read from the queues through stream(n)."""
+
+    def __init__(
+        self, recognizers, requests, CPUs=1, queueSize=1000, bufferSize=500
+    ):
+        from multiprocessing import Process, Queue
+
+        self.queues = [Queue(queueSize) for _ in recognizers]
+        self.bufferSize = bufferSize
+        self.processes = []
+        seed = random.random()
+        for n in range(max(CPUs, len(recognizers))):
+            i = n % len(recognizers)
+            process = Process(
+                target=_produceHelmholtz,
+                args=(recognizers[i], requests, self.queues[i], seed + n),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    def stream(self, n):
+        """The dreams for the n-th recognition model"""
+        return HelmholtzStream(self.queues[n], self.bufferSize)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        for queue in self.queues:
+            queue.close()
+            queue.cancel_join_thread()
+        self.processes = []
+
+
+def _produceHelmholtz(recognizer, requests, queue, seed):
+    random.seed(seed)
+    while True:
+        frontier = recognizer.sampleHelmholtz(requests)
+        if frontier is None:
+            continue
+        queue.put(recognizer.replaceProgramsWithLikelihoodSummaries(frontier))
+
+
+class HelmholtzStream(object):
+    """Dream frontiers read from a HelmholtzProducer queue without waiting.
+
+    When no new dream is ready, one of the last bufferSize dreams is used
+    again, so training only ever waits for the very first dream."""
+
+    def __init__(self, queue, bufferSize):
+        self.queue = queue
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.fresh = 0
+        self.reused = 0
+
+    def next(self):
+        import queue
+
+        try:
+            frontier = self.queue.get(block=len(self.buffer) == 0)
+        except queue.Empty:
+            self.reused += 1
+            return random.choice(self.buffer)
+        self.fresh += 1
+        if len(self.buffer) < self.bufferSize:
+            self.buffer.append(frontier)
+        else:
+            self.buffer[random.randrange(self.bufferSize)] = frontier
+        return frontier
+
+
 class RecurrentFeatureExtractor(nn.Module):
     def __init__(
         self,
@@ -1654,8 +1829,9 @@ class RecurrentFeatureExtractor(nn.Module):
             if not (s in self.specialSymbols)
         }
 
-    def packExamples(self, examples):
-        """IMPORTANT! xs must be sorted in decreasing order of size because pytorch is stupid"""
+    def exampleIndices(self, examples):
+        """Token indices of each of the tokenized examples, padded into one
+        (examples x maximum length) tensor, and the length of each"""
         es = []
         sizes = []
         for xs, y in examples:
@@ -1668,10 +1844,6 @@ class RecurrentFeatureExtractor(nn.Module):
             for s in y:
                 e.append(self.symbolToIndex[s])
             e.append(self.endingIndex)
-            if es != []:
-                assert len(e) <= len(
-                    es[-1]
-                ), "Examples must be sorted in decreasing order of their tokenized size. This should be transparently handled in recognition.py, so if this assertion fails it isn't your fault as a user of EC but instead is a bug inside of EC."
             es.append(e)
             sizes.append(len(e))
 
@@ -1679,28 +1851,37 @@ class RecurrentFeatureExtractor(nn.Module):
         # padding
         for j, e in enumerate(es):
             es[j] += [self.endingIndex] * (m - len(e))
+        return torch.tensor(es, dtype=torch.long), sizes
 
-        x = variable(es, cuda=self.use_cuda)
-        x = self.encoder(x)
+    def packExamples(self, examples):
+        """IMPORTANT! xs must be sorted in decreasing order of size because pytorch is stupid"""
+        es, sizes = self.exampleIndices(examples)
+        assert all(
+            a >= b for a, b in zip(sizes, sizes[1:])
+        ), "Examples must be sorted in decreasing order of their tokenized size. This should be transparently handled in recognition.py, so if this assertion fails it isn't your fault as a user of EC but instead is a bug inside of EC."
+
+        x = self.encoder(maybe_cuda(es, self.use_cuda))
         # x: (batch size, maximum length, E)
         x = x.permute(1, 0, 2)
         # x: TxBxE
         x = pack_padded_sequence(x, sizes)
         return x, sizes
 
-    def examplesEncoding(self, examples):
-        examples = sorted(
-            examples,
-            key=lambda xs_y: sum(len(z) + 1 for z in xs_y[0]) + len(xs_y[1]),
-            reverse=True,
-        )
-        x, sizes = self.packExamples(examples)
+    def encodeExampleIndices(self, es, sizes):
+        """Encodings of examples given by exampleIndices, in the same order"""
+        x = self.encoder(maybe_cuda(es, self.use_cuda))
+        # x: TxBxE, packed in whatever order pytorch wants
+        x = pack_padded_sequence(x.permute(1, 0, 2), sizes, enforce_sorted=False)
         outputs, hidden = self.model(x)
         # outputs, sizes = pad_packed_sequence(outputs)
         # I don't know whether to return the final output or the final hidden
         # activations...
         return hidden[0, :, :] + hidden[1, :, :]
 
+    def examplesEncoding(self, examples):
+        """Encodings of the examples, in the order given"""
+        return self.encodeExampleIndices(*self.exampleIndices(examples))
+
     def forward(self, examples):
         tokenized = self.tokenize(examples)
         if not tokenized:
@@ -1720,7 +1901,48 @@ class RecurrentFeatureExtractor(nn.Module):
         e = e.mean(dim=0)
         return e
 
+    def cacheTasks(self, tasks):
+        """Tokenizes and pads the examples of each of the tasks once, so that
+        featuresOfTask only runs the recurrent network on them. Tasks with more
+        than MAXINPUTS examples are left out, because they are subsampled
+        anew every time."""
+        self.exampleCache = {}
+        for t in tasks:
+            tokenized = self.tokenize(
+                t.features if hasattr(self, "useFeatures") else t.examples
+            )
+            if not tokenized:
+                self.exampleCache[t] = None
+            elif not (hasattr(self, "MAXINPUTS") and len(tokenized) > self.MAXINPUTS):
+                self.exampleCache[t] = self.exampleIndices(list(tokenized))
+
+    def clearCache(self):
+        self.exampleCache = {}
+
+    def cachedExampleIndices(self, t):
+        """exampleIndices of the examples of the task t (None if it has none),
+        from the cache or tokenized now"""
+        cache = getattr(self, "exampleCache", {})
+        if t in cache:
+            return cache[t]
+        tokenized = self.tokenize(
+            t.features if hasattr(self, "useFeatures") else t.examples
+        )
+        if not tokenized:
+            return None
+        if hasattr(self, "MAXINPUTS") and len(tokenized) > self.MAXINPUTS:
+            tokenized = list(tokenized)
+            random.shuffle(tokenized)
+            tokenized = tokenized[: self.MAXINPUTS]
+        return self.exampleIndices(list(tokenized))
+
     def featuresOfTask(self, t):
+        if t in getattr(self, "exampleCache", {}):
+            indices = self.exampleCache[t]
+            if indices is None:
+                return None
+            # take the average activations across all of the examples
+            return self.encodeExampleIndices(*indices).mean(dim=0)
         if hasattr(self, "useFeatures"):
             f = self(t.features)
         else:
@@ -1728,6 +1950,35 @@ class RecurrentFeatureExtractor(nn.Module):
             f = self(t.examples)
         return f
 
+    def batchedFeaturesOfTasks(self, ts):
+        """featuresOfTask for each of the tasks, or None where it would be
+        None, encoding the examples of all of the tasks in one pass of the
+        recurrent network"""
+        indices = [self.cachedExampleIndices(t) for t in ts]
+        present = [i for i in indices if i is not None]
+        if not present:
+            return [None] * len(ts)
+
+        m = max(es.size(1) for es, _ in present)
+        es = torch.cat(
+            [
+                F.pad(es, (0, m - es.size(1)), value=self.endingIndex)
+                for es, _ in present
+            ]
+        )
+        e = self.encodeExampleIndices(es, [n for _, sizes in present for n in sizes])
+        # take the average activations across the examples of each task
+        features = []
+        start = 0
+        for i in indices:
+            if i is None:
+                features.append(None)
+                continue
+            n = len(i[1])
+            features.append(e[start : start + n].mean(dim=0))
+            start += n
+        return features
+
     def taskOfProgram(self, p, tp):
         # half of the time we randomly mix together inputs
         # this gives better generalization on held out tasks
@@ -0,0 +1,241 @@
+import numpy as np
+
+
+class Scene(object):
+    """A list of objects, each a list of int attributes, stored as one
+    (objects x attributes) int64 array.
+
+    Programs see a Scene as a value of type tlist(tlist(tint)): indexing gives
+    an object as a list of Python ints, slicing gives a Scene that shares the
+    array, and iteration, equality, count, index and concatenation behave as
+    they do for the list of lists. Primitives can test isinstance(x, Scene)
+    and work on x.array directly.
+
+    Looking at single objects needs them as lists, which are built the first
+    time and kept, so only scenes that are actually evaluated object by object
+    pay for them."""
+
+    __slots__ = ("array", "_objects")
+
+    # Below this many objects a python loop, which can stop early, beats the
+    # fixed cost of a few numpy calls
+    VECTORIZE = 64
+
+    def __init__(self, array):
+        assert array.ndim == 2
+        # A plain view, also of a numpy.memmap
+        self.array = np.asarray(array)
+        self._objects = None
+
+    @property
+    def objects(self):
+        if self._objects is None:
+            self._objects = self.array.tolist()
+        return self._objects
+
+    @staticmethod
+    def compact(objects):
+        """A Scene holding objects if every object is a list of the same
+        number of ints, otherwise objects itself"""
+        if isinstance(objects, Scene):
+            return objects
+        if not isinstance(objects, list) or not all(
+            isinstance(o, list)
+            and all(isinstance(v, int) and not isinstance(v, bool) for v in o)
+            for o in objects
+        ):
+            return objects
+        if len({len(o) for o in objects}) > 1:
+            return objects
+        width = len(objects[0]) if objects else 0
+        return Scene(np.array(objects, dtype=np.int64).reshape(len(objects), width))
+
+    def tolist(self):
+        return list(self.objects)
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, n):
+        if type(n) is slice:
+            return Scene(self.array[n])
+        objects = self._objects
+        if objects is None:
+            objects = self.objects
+        return objects[n]
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __reversed__(self):
+        return reversed(self.objects)
+
+    def __contains__(self, o):
+        return self.count(o) > 0
+
+    def __eq__(self, o):
+        if isinstance(o, Scene):
+            return self.array.shape == o.array.shape and bool(
+                (self.array == o.array).all()
+            )
+        if isinstance(o, list):
+            return len(o) == len(self) and self.objects == o
+        return False
+
+    def __ne__(self, o):
+        return not (self == o)
+
+    __hash__ = None
+
+    def __add__(self, o):
+        if isinstance(o, Scene):
+            o = o.objects
+        if not isinstance(o, list):
+            return NotImplemented
+        return self.objects + o
+
+    def __radd__(self, o):
+        if not isinstance(o, list):
+            return NotImplemented
+        return o + self.objects
+
+    def matches(self, o):
+        """Boolean vector saying which objects are equal to o"""
+        if not isinstance(o, list) or len(o) != self.array.shape[1]:
+            return np.zeros(len(self), dtype=bool)
+        return (self.array == np.array(o, dtype=np.int64)).all(axis=1)
+
+    def count(self, o):
+        if len(self) < Scene.VECTORIZE:
+            return self.objects.count(o)
+        return int(self.matches(o).sum())
+
+    def index(self, o):
+        if len(self) < Scene.VECTORIZE:
+            return self.objects.index(o)
+        found = np.flatnonzero(self.matches(o))
+        if len(found) == 0:
+            raise ValueError("%s is not in scene" % (o,))
+        return int(found[0])
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def __reduce__(self):
+        return (Scene, (self.array,))
+
+
+class SceneBatch(object):
+    """The inputs of a batch of examples, each a single Scene, with all of
+    their objects stacked into one array.
+
+    Programs (lambda body) whose body combines (forall pred $0),
+    (exists pred $0) and (length $0) for vectorizable predicates (see
+    CompileVisitor.vectorize) with constants and vectorized primitives are
+    evaluated on every example at once by a handful of array operations."""
+
+    def __init__(self, scenes):
+        self.array = np.concatenate([s.array for s in scenes])
+        self.lengths = np.array([len(s) for s in scenes], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @staticmethod
+    def of(inputs):
+        """A SceneBatch of inputs if each one is a single Scene and they all
+        have the same number of attributes per object, otherwise None"""
+        if not inputs or not all(
+            len(xs) == 1 and isinstance(xs[0], Scene) for xs in inputs
+        ):
+            return None
+        widths = {xs[0].array.shape[1] for xs in inputs if len(xs[0]) > 0}
+        if len(widths) != 1:
+            return None
+        width = widths.pop()
+        return SceneBatch(
+            [
+                xs[0] if len(xs[0]) > 0 else Scene(np.zeros((0, width), np.int64))
+                for xs in inputs
+            ]
+        )
+
+    @staticmethod
+    def reduceat(operation, values, lengths, empty):
+        """operation.reduce over each of the consecutive segments of values
+        with the given lengths, or empty for segments of length 0"""
+        result = np.full(len(lengths), empty)
+        nonempty = lengths > 0
+        if nonempty.any():
+            starts = np.cumsum(lengths) - lengths
+            result[nonempty] = operation.reduceat(values, starts[nonempty])
+        return result
+
+    def reduce(self, operation, satisfied, empty):
+        """operation.reduce over the objects of each scene"""
+        satisfied = np.broadcast_to(satisfied, (len(self.array),))
+        return SceneBatch.reduceat(operation, satisfied, self.lengths, empty)
+
+    def evaluate(self, program):
+        """A vector of the outputs of program on every example, or None if it
+        cannot be evaluated as a batch"""
+        if not program.isAbstraction:
+            return None
+        f = self.lower(program.body)
+        if f is None:
+            return None
+        try:
+            return np.broadcast_to(f(), (len(self),))
+        except IndexError:
+            # A missing attribute that the python semantics might never look at
+            return None
+
+    def lower(self, e):
+        from dreamcoder.program import CompileVisitor, Primitive
+
+        if e.isPrimitive:
+            if isinstance(e.value, (bool, int)):
+                c = e.value
+                return lambda: c
+            return None
+        if not e.isApplication:
+            return None
+        f, xs = e.applicationParse()
+        if not f.isPrimitive or id(f.value) not in Primitive.VECTORIZED:
+            return None
+        value, operation = Primitive.VECTORIZED[id(f.value)]
+        if value is not f.value:
+            return None
+
+        if operation == "length":
+            if len(xs) != 1 or not (xs[0].isIndex and xs[0].i == 0):
+                return None
+            return lambda: self.lengths
+        if operation in {"forall", "exists"}:
+            if len(xs) != 2 or not (xs[1].isIndex and xs[1].i == 0):
+                return None
+            predicate = xs[0]
+            if not predicate.isAbstraction:
+                return None
+            satisfied = CompileVisitor.shared.vectorize(predicate.body)
+            if satisfied is None:
+                return None
+            if operation == "forall":
+                return lambda: self.reduce(
+                    np.logical_and, satisfied(self.array), True
+                )
+            return lambda: self.reduce(np.logical_or, satisfied(self.array), False)
+        if isinstance(operation, str) or len(xs) != operation.nin:
+            return None
+
+        arguments = [self.lower(x) for x in xs]
+        if any(a is None for a in arguments):
+            return None
+        if len(arguments) == 1:
+            a = arguments[0]
+            return lambda: operation(a())
+        a, b = arguments
+        return lambda: operation(a(), b())
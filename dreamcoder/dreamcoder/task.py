@@ -1,4 +1,5 @@
 import signal
+import threading
 
 from dreamcoder.differentiation import *
 from dreamcoder.program import *
@@ -11,6 +12,126 @@ class EvaluationTimeout(Exception):
 EVALUATIONTABLE = {}
 
 
+class EvaluationWatchdog(object):
+    """Backstop timeout for fuel-metered evaluation.
+
+    Fuel bounds the number of lambda applications, but not the time spent
+    inside a primitive. Instead of arming a timer for every evaluation, the
+    watchdog keeps one periodic virtual-time timer and raises
+    EvaluationTimeout from its handler when the same evaluation is still
+    running one full period later, i.e. after between one and two timeouts.
+
+    A caller about to run many evaluations, like enumerateForTasks, arms the
+    watchdog once and disarms it at the end, and start and stop then only
+    mark an evaluation as running or not. Otherwise starts nest: the timer is
+    armed by the outermost start, and the matching stop disarms it. Disarming
+    puts back the handler SIGVTALRM had before. Code that takes SIGVTALRM
+    over while the watchdog is armed has to call reclaim afterwards. Signals
+    are only delivered to the main thread, so other threads rely on fuel
+    alone."""
+
+    def __init__(self):
+        self.timeout = None
+        self.evaluating = False
+        # Counts evaluations, and the count seen by the last tick of the timer
+        self.serial = 0
+        self.lastSerial = None
+        self.callBack = self.tick
+        # Whether the timer was armed by arm rather than by a start
+        self.armed = False
+        # Whether each start that has not been stopped yet is watched, how
+        # many are, and the handler to put back when the timer is disarmed
+        self.started = []
+        self.depth = 0
+        self.previousHandler = None
+
+    def tick(self, _1, _2):
+        if self.evaluating and self.serial == self.lastSerial:
+            self.evaluating = False
+            raise EvaluationTimeout()
+        self.lastSerial = self.serial
+
+    def install(self, timeout):
+        self.previousHandler = signal.getsignal(signal.SIGVTALRM)
+        signal.signal(signal.SIGVTALRM, self.callBack)
+        signal.setitimer(signal.ITIMER_VIRTUAL, timeout, timeout)
+        self.timeout = timeout
+
+    def uninstall(self):
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+        # Handlers not installed from Python are reported as None
+        previous = self.previousHandler
+        signal.signal(
+            signal.SIGVTALRM, signal.SIG_DFL if previous is None else previous
+        )
+        self.previousHandler = None
+
+    def arm(self, timeout):
+        """Keeps the timer running until disarm, for every start in between.
+        Returns whether this call armed it, and so has to disarm it"""
+        if (
+            self.armed
+            or timeout is None
+            or threading.current_thread() is not threading.main_thread()
+        ):
+            return False
+        if self.depth == 0:
+            self.install(timeout)
+        self.armed = True
+        return True
+
+    def disarm(self):
+        if not self.armed:
+            return
+        self.armed = False
+        if self.depth == 0:
+            self.uninstall()
+
+    def reclaim(self):
+        """Takes the timer back from whoever used SIGVTALRM since it was armed"""
+        if (self.armed or self.depth > 0) and signal.getsignal(
+            signal.SIGVTALRM
+        ) is not self.callBack:
+            signal.signal(signal.SIGVTALRM, self.callBack)
+            signal.setitimer(signal.ITIMER_VIRTUAL, self.timeout, self.timeout)
+
+    def restart(self):
+        """Gives the running evaluation a fresh timeout, e.g. for its next
+        input"""
+        if self.depth > 0:
+            self.serial += 1
+            self.evaluating = True
+
+    def start(self, timeout):
+        watched = (
+            self.armed or timeout is not None
+        ) and threading.current_thread() is threading.main_thread()
+        self.started.append(watched)
+        if not watched:
+            return
+        if not self.armed:
+            # Nested starts also notice when someone cancelled the timer
+            if self.depth == 0:
+                self.install(timeout)
+            else:
+                self.reclaim()
+        self.depth += 1
+        self.serial += 1
+        self.evaluating = True
+
+    def stop(self):
+        if not self.started.pop():
+            return
+        self.depth -= 1
+        if self.depth == 0:
+            self.evaluating = False
+            if not self.armed:
+                self.uninstall()
+
+
+WATCHDOG = EvaluationWatchdog()
+
+
 class Task(object):
     def __init__(self, name, request, examples, features=None, cache=False):
         """request: the type of this task
@@ -67,7 +188,13 @@ class Task(object):
             return None
         return self.supervisedSolution
 
-    def check(self, e, timeout=None):
+    def check(self, e, timeout=None, fuel=None):
+        """fuel: if given, each example may perform at most this many lambda
+        applications and timeout is only enforced as a backstop (see
+        EvaluationWatchdog), so no timer is armed per program"""
+        if fuel is not None:
+            return self.checkWithFuel(e, fuel, timeout)
+
         if timeout is not None:
 
             def timeoutCallBack(_1, _2):
@@ -78,7 +205,7 @@ class Task(object):
             signal.setitimer(signal.ITIMER_VIRTUAL, timeout)
 
             try:
-                f = e.evaluate([])
+                f = e.compile()
             except IndexError:
                 # free variable
                 return False
@@ -114,8 +241,41 @@ class Task(object):
                 signal.signal(signal.SIGVTALRM, lambda *_: None)
                 signal.setitimer(signal.ITIMER_VIRTUAL, 0)
 
-    def logLikelihood(self, e, timeout=None):
-        if self.check(e, timeout):
+    def checkWithFuel(self, e, fuel, timeout=None):
+        WATCHDOG.start(timeout)
+        try:
+            try:
+                f = e.compile(metered=True)
+            except Exception as exception:
+                eprint("Exception during evaluation:", exception)
+                return False
+
+            for x, y in self.examples:
+                if self.cache and (x, e) in EVALUATIONTABLE:
+                    p = EVALUATIONTABLE[(x, e)]
+                else:
+                    Program.refuel(fuel)
+                    try:
+                        p = self.predict(f, x)
+                    except EvaluationTimeout:
+                        eprint("Timed out while evaluating", e)
+                        return False
+                    except Exception:
+                        p = None
+                    if self.cache:
+                        EVALUATIONTABLE[(x, e)] = p
+                if p != y:
+                    return False
+
+            return True
+        except EvaluationTimeout:
+            eprint("Timed out while evaluating", e)
+            return False
+        finally:
+            WATCHDOG.stop()
+
+    def logLikelihood(self, e, timeout=None, fuel=None):
+        if self.check(e, timeout, fuel=fuel):
             return 0.0
         else:
             return NEGATIVEINFINITY
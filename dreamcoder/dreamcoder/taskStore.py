@@ -0,0 +1,226 @@
+import atexit
+import os
+import tempfile
+
+import numpy as np
+
+from dreamcoder.scene import Scene
+from dreamcoder.utilities import eprint
+
+
+class SharedTaskStore(object):
+    """Task examples packed into one columnar int64 buffer backed by a file in
+    shared memory.
+
+    Every worker started by parallelMap, launchParallelProcess or the
+    enumeration worker pool used to get its own pickled copy of the examples.
+    Tasks whose examples are a single scene, i.e. a list of objects which are
+    lists of ints, with an int or bool output, can instead hold a
+    SharedExamples view into the store. Sent to a worker (see
+    picklingByReference), a view pickles to the path of the store and the
+    index of its task, and every process maps the store read-only, so the
+    examples exist only once in memory. Scenes whose objects
+    all have the same number of attributes are decoded as a Scene viewing the
+    buffer, and the others as lists.
+
+    Layout of the buffer, all int64:
+        number of tasks T, examples E, objects R, attribute values V
+        taskStart (T + 1): first example of each task
+        exampleStart (E + 1): first object of each example
+        output (E): output of each example
+        outputIsBool (E)
+        objectStart (R + 1): first attribute value of each object
+        values (V)"""
+
+    HEADER = 4
+
+    # Stores mapped by this process, by path
+    ATTACHED = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.int64, mode="r")
+        T, E, R, V = (int(n) for n in self.buffer[: self.HEADER])
+        offset = self.HEADER
+        columns = {}
+        for name, size in [
+            ("taskStart", T + 1),
+            ("exampleStart", E + 1),
+            ("output", E),
+            ("outputIsBool", E),
+            ("objectStart", R + 1),
+            ("values", V),
+        ]:
+            columns[name] = self.buffer[offset : offset + size]
+            offset += size
+        self.__dict__.update(columns)
+        self.numberOfTasks = T
+
+    @staticmethod
+    def attach(path):
+        if path not in SharedTaskStore.ATTACHED:
+            SharedTaskStore.ATTACHED[path] = SharedTaskStore(path)
+        return SharedTaskStore.ATTACHED[path]
+
+    @staticmethod
+    def packable(task):
+        def isInteger(v):
+            return isinstance(v, int) and not isinstance(v, bool)
+
+        return len(task.examples) > 0 and all(
+            len(xs) == 1
+            and isinstance(xs[0], (Scene, list))
+            and all(
+                isinstance(o, list) and all(isInteger(v) for v in o) for o in xs[0]
+            )
+            and isinstance(y, int)
+            for xs, y in task.examples
+        )
+
+    @staticmethod
+    def create(tasks, directory=None):
+        """Packs the examples of tasks, which must all be packable, into a new
+        store. The file is deleted when the creating process exits."""
+        taskStart = [0]
+        exampleStart = [0]
+        output = []
+        outputIsBool = []
+        objectStart = [0]
+        values = []
+        for task in tasks:
+            for (scene,), y in task.examples:
+                for o in scene:
+                    values.extend(o)
+                    objectStart.append(len(values))
+                exampleStart.append(len(objectStart) - 1)
+                output.append(int(y))
+                outputIsBool.append(isinstance(y, bool))
+            taskStart.append(len(exampleStart) - 1)
+
+        header = [len(tasks), len(output), len(objectStart) - 1, len(values)]
+        data = np.concatenate(
+            [
+                np.array(column, dtype=np.int64)
+                for column in [
+                    header,
+                    taskStart,
+                    exampleStart,
+                    output,
+                    outputIsBool,
+                    objectStart,
+                    values,
+                ]
+            ]
+        )
+
+        if directory is None and os.path.isdir("/dev/shm"):
+            directory = "/dev/shm"
+        handle, path = tempfile.mkstemp(
+            prefix="dreamcoder_tasks_", suffix=".bin", dir=directory
+        )
+        os.close(handle)
+        buffer = np.memmap(path, dtype=np.int64, mode="w+", shape=data.shape)
+        buffer[:] = data
+        buffer.flush()
+        del buffer
+
+        creator = os.getpid()
+
+        def remove():
+            if os.getpid() == creator and os.path.exists(path):
+                os.remove(path)
+
+        atexit.register(remove)
+        return SharedTaskStore.attach(path)
+
+    def numberOfExamples(self, task):
+        return int(self.taskStart[task + 1] - self.taskStart[task])
+
+    def example(self, task, n):
+        e = int(self.taskStart[task]) + n
+        starts = self.objectStart[self.exampleStart[e] : self.exampleStart[e + 1] + 1]
+        widths = np.diff(starts)
+        if len(widths) == 0:
+            scene = Scene(np.zeros((0, 0), dtype=np.int64))
+        elif (widths == widths[0]).all():
+            scene = Scene(
+                self.values[starts[0] : starts[-1]].reshape(len(widths), widths[0])
+            )
+        else:
+            scene = [
+                self.values[a:b].tolist() for a, b in zip(starts[:-1], starts[1:])
+            ]
+        y = int(self.output[e])
+        if self.outputIsBool[e]:
+            y = bool(y)
+        return (scene,), y
+
+
+class SharedExamples(object):
+    """The examples of one task, decoded from a SharedTaskStore on access.
+    Nothing is cached, so code that iterates over the examples of a task many
+    times (e.g. BatchedTaskScorer) should keep its own copy."""
+
+    def __init__(self, store, task):
+        self.store = store
+        self.task = task
+
+    def __reduce__(self):
+        if picklingByReference.depth > 0:
+            return (_attachExamples, (self.store.path, self.task))
+        return (list, (list(self),))
+
+    def __len__(self):
+        return self.store.numberOfExamples(self.task)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        if n < 0:
+            n += len(self)
+        if not (0 <= n < len(self)):
+            raise IndexError(n)
+        return self.store.example(self.task, n)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self.store.example(self.task, n)
+
+    def __repr__(self):
+        return "SharedExamples(%s, %d)" % (self.store.path, self.task)
+
+
+def _attachExamples(path, task):
+    return SharedExamples(SharedTaskStore.attach(path), task)
+
+
+class picklingByReference(object):
+    """Within this, SharedExamples pickle to the path of their store, for
+    processes that run while the store exists. Otherwise they pickle to a
+    list of their examples, as e.g. checkpoints outlive the store."""
+
+    depth = 0
+
+    def __enter__(self):
+        picklingByReference.depth += 1
+        return self
+
+    def __exit__(self, type, value, traceback):
+        picklingByReference.depth -= 1
+
+
+def shareTasks(tasks):
+    """Moves the examples of every packable task into one SharedTaskStore and
+    gives those tasks views into it. Returns the store, or None if no task
+    could be packed."""
+    packable = [t for t in tasks if SharedTaskStore.packable(t)]
+    if not packable:
+        return None
+    store = SharedTaskStore.create(packable)
+    for n, task in enumerate(packable):
+        task.examples = SharedExamples(store, n)
+    eprint(
+        "Moved the examples of %d/%d tasks into shared memory (%d bytes)"
+        % (len(packable), len(tasks), store.buffer.nbytes)
+    )
+    return store
@@ -28,7 +28,11 @@ class TypeConstructor(Type):
     def __init__(self, name, arguments):
         self.name = name
         self.arguments = arguments
-        self.isPolymorphic = any(a.isPolymorphic for a in arguments)
+        self.isPolymorphic = False
+        for a in arguments:
+            if a.isPolymorphic:
+                self.isPolymorphic = True
+                break
 
     def free_type_variables(self):
         return {fv for t in self.arguments for fv in t.free_type_variables()}
@@ -96,9 +100,17 @@ class TypeConstructor(Type):
             return self
 
     def apply(self, context):
-        if not self.isPolymorphic:
+        if not self.isPolymorphic or not context.bindings:
+            return self
+        arguments = []
+        changed = False
+        for x in self.arguments:
+            y = x.apply(context)
+            arguments.append(y)
+            changed = changed or y is not x
+        if not changed:
             return self
-        return TypeConstructor(self.name, [x.apply(context) for x in self.arguments])
+        return TypeConstructor(self.name, arguments)
 
     def applyMutable(self, context):
         if not self.isPolymorphic:
@@ -186,10 +198,14 @@ class TypeVariable(Type):
         return []
 
     def apply(self, context):
-        for v, t in context.substitution:
-            if v == self.v:
-                return t.apply(context)
-        return self
+        t = context.bindings.get(self.v)
+        if t is None:
+            return self
+        if t.isPolymorphic:
+            t = t.apply(context)
+            # Every context sharing these bindings binds the variable to it
+            context.bindings[self.v] = t
+        return t
 
     def applyMutable(self, context):
         s = context.substitution[self.v]
@@ -209,7 +225,7 @@ class TypeVariable(Type):
             return (context, bindings[self.v])
         new = TypeVariable(context.nextVariable)
         bindings[self.v] = new
-        context = Context(context.nextVariable + 1, context.substitution)
+        context = Context(context.nextVariable + 1, bindings=context.bindings)
         return (context, new)
 
     def instantiateMutable(self, context, bindings=None):
@@ -235,16 +251,33 @@ class TypeVariable(Type):
 
 
 class Context(object):
-    def __init__(self, nextVariable=0, substitution=[]):
+    """An immutable type substitution, and the next type variable to hand out.
+
+    The substitution is a dictionary from type variables to types. Contexts
+    that only differ in their next variable share it, extending a context
+    copies it, and applying a context replaces the types it holds with what
+    they resolve to, which does not change what any context sharing it means.
+    The substitution attribute lists the bindings latest first."""
+
+    def __init__(self, nextVariable=0, substitution=[], bindings=None):
         self.nextVariable = nextVariable
-        self.substitution = substitution
+        if bindings is None:
+            bindings = {j: t for j, t in reversed(substitution)}
+        self.bindings = bindings
+
+    @property
+    def substitution(self):
+        return list(reversed(self.bindings.items()))
 
     def extend(self, j, t):
-        return Context(self.nextVariable, [(j, t)] + self.substitution)
+        bindings = self.bindings.copy()
+        bindings.pop(j, None)
+        bindings[j] = t
+        return Context(self.nextVariable, bindings=bindings)
 
     def makeVariable(self):
         return (
-            Context(self.nextVariable + 1, self.substitution),
+            Context(self.nextVariable + 1, bindings=self.bindings),
             TypeVariable(self.nextVariable),
         )
 
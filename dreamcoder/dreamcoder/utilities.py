@@ -908,6 +908,9 @@ def howManyGigabytesOfMemory():
 
 
 def tuplify(x):
+    if hasattr(x, "tolist"):
+        # numpy values and Scenes
+        x = x.tolist()
     if isinstance(x, (list, tuple)):
         return tuple(tuplify(z) for z in x)
     return x
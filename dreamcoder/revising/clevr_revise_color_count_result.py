@@ -50,6 +50,7 @@ def revise_color_count():
         grammar.productions.append((likelihood, function_type, p))
 
     grammar.expression2likelihood = e2l
+    grammar.clearCandidateCache()
 
     if False:
         # reset recognition task metrics
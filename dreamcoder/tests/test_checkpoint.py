@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import dill
+
+
+class TestCheckpointStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "run.checkpoint")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_incremental_checkpoints(self):
+        from dreamcoder.checkpoint import CheckpointStore
+        from dreamcoder.dreamcoder import ECResult
+        from dreamcoder.frontier import Frontier, FrontierEntry
+        from dreamcoder.grammar import Grammar
+        from dreamcoder.program import Primitive, Program
+        from dreamcoder.task import Task
+        from dreamcoder.type import arrow, tint
+
+        grammar = Grammar.uniform(
+            [
+                Primitive("0", tint, 0),
+                Primitive("incr", arrow(tint, tint), lambda x: x + 1),
+            ]
+        )
+        request = arrow(tint, tint)
+        tasks = [Task("t%d" % n, request, [((0,), n)]) for n in range(3)]
+
+        def frontier(task, *sources):
+            return Frontier(
+                [
+                    FrontierEntry(Program.parse(s), logPrior=-1.0, logLikelihood=0.0)
+                    for s in sources
+                ],
+                task,
+            )
+
+        result = ECResult(
+            parameters={"topK": 1},
+            grammars=[grammar],
+            taskSolutions={t: Frontier([], task=t) for t in tasks},
+            allFrontiers={t: Frontier([], task=t) for t in tasks},
+        )
+        store = CheckpointStore(self.path, create=True)
+        snapshots = []
+        for j, solved in enumerate([["(lambda 0)"], [], ["(lambda (incr 0))"]]):
+            if solved:
+                result.allFrontiers[tasks[j]] = frontier(tasks[j], *solved)
+            # Equal, but new, frontiers do not need to be saved again
+            result.taskSolutions = {
+                t: Frontier(list(f.entries), t) for t, f in result.allFrontiers.items()
+            }
+            for f in result.allFrontiers.values():
+                result.recordFrontier(f)
+            result.learningCurve.append(j)
+            result.recognitionTaskMetrics[tasks[j]] = {"iteration": j}
+            result.grammars.append(grammar)
+            store.save(result, j + 1)
+            snapshots.append(dill.dumps(result.__dict__))
+
+        sizes = {}
+        for _, field, _, length in store.records:
+            sizes.setdefault(field, []).append(length)
+        self.assertEqual(len(sizes["_tasks"]), 1)
+        self.assertEqual(len(sizes["parameters"]), 1)
+        # Nothing was solved in the second iteration
+        self.assertEqual(len(sizes["allFrontiers"]), 2)
+        self.assertEqual(len(sizes["taskSolutions"]), 2)
+        self.assertLess(sizes["frontiersOverTime"][1], sizes["frontiersOverTime"][0])
+        self.assertLess(sizes["grammars"][1], sizes["grammars"][0])
+
+        def same(a, b):
+            # Grammars only show what they hold as strings
+            def show(v):
+                if isinstance(v, list):
+                    return [show(x) for x in v]
+                return str(v) if isinstance(v, Grammar) else repr(v)
+
+            self.assertEqual(show(a), show(b))
+
+        reopened = CheckpointStore(self.path)
+        self.assertEqual(reopened.iterations, [1, 2, 3])
+        for j, expected in enumerate(snapshots):
+            expected = dill.loads(expected)
+            for field, value in expected.items():
+                same(reopened.field(field, j + 1), value)
+        same(reopened.last("grammars"), grammar)
+
+        resumed = reopened.load()
+        self.assertNotIn("frontiersOverTime", resumed.__dict__)
+        same(resumed.allFrontiers, result.allFrontiers)
+        same(resumed.frontiersOverTime, result.frontiersOverTime)
+        self.assertEqual(resumed.learningCurve, [0, 1, 2])
+        copied = dill.loads(dill.dumps(resumed)).__dict__
+        self.assertEqual(set(copied), set(result.__dict__))
+        for field, value in result.__dict__.items():
+            same(copied[field], value)
+
+        # Resuming from an earlier iteration drops the ones after it
+        earlier = CheckpointStore(self.path)
+        resumed = earlier.load(1)
+        self.assertEqual(resumed.learningCurve, [0])
+        resumed.learningCurve.append(7)
+        earlier.save(resumed, 2)
+        reopened = CheckpointStore(self.path)
+        self.assertEqual(reopened.iterations, [1, 2])
+        self.assertEqual(reopened.field("learningCurve"), [0, 7])
+        same(reopened.field("allFrontiers"), dill.loads(snapshots[0])["allFrontiers"])
+
+        # An iteration that was not completely saved is ignored
+        with open(reopened.indexPath, "a") as handle:
+            handle.write('{"iteration": 3, "field": "learningCurve", "off')
+        self.assertEqual(CheckpointStore(self.path).iterations, [1, 2])
+
+    def test_converted_pickles_are_read_lazily(self):
+        from dreamcoder.checkpoint import convertCheckpoint, loadCheckpoint
+        from dreamcoder.dreamcoder import ECResult
+        from dreamcoder.frontier import Frontier
+        from dreamcoder.task import Task
+        from dreamcoder.type import arrow, tint
+
+        tasks = [Task("t%d" % n, arrow(tint, tint), [((0,), n)]) for n in range(2)]
+        result = ECResult(
+            parameters={"topK": 1},
+            learningCurve=[0, 1],
+            taskSolutions={t: Frontier([], task=t) for t in tasks},
+        )
+        path = os.path.join(self.directory, "run_it=1.pickle")
+        with open(path, "wb") as handle:
+            dill.dump(result, handle)
+        self.assertEqual(loadCheckpoint(path).learningCurve, [0, 1])
+
+        store = convertCheckpoint(path)
+        self.assertEqual(os.path.basename(store.path), "run_it=1.checkpoint")
+        loaded = loadCheckpoint(path)
+        self.assertEqual(list(loaded.__dict__), ["_checkpoint"])
+        self.assertEqual(loaded.learningCurve, [0, 1])
+        self.assertEqual(list(loaded.__dict__), ["_checkpoint", "learningCurve"])
+        self.assertEqual(list(loaded.taskSolutions), tasks)
+        self.assertFalse(hasattr(loaded, "missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
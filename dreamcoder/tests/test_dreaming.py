@@ -10,5 +10,117 @@ class TestDreaming(unittest.TestCase):
             self.fail("Unable to import from dreaming module")
 
 
+class TestDreamCorpus(unittest.TestCase):
+    def test_merges_behaviours_and_rescores(self):
+        from dreamcoder.domains.arithmetic.arithmeticPrimitives import (
+            addition, k1, multiplication)
+        from dreamcoder.dreaming import DreamCorpus
+        from dreamcoder.frontier import Frontier, FrontierEntry
+        from dreamcoder.grammar import Grammar
+        from dreamcoder.program import Program
+        from dreamcoder.task import Task
+        from dreamcoder.type import arrow, tint
+
+        request = arrow(tint, tint)
+        tasks = [Task("id", request, [((x,), x) for x in range(5)])]
+        g = Grammar.uniform([addition, multiplication, k1])
+
+        def frontier(*sources):
+            return Frontier(
+                [
+                    FrontierEntry(
+                        program=Program.parse(s),
+                        logPrior=g.logLikelihood(request, Program.parse(s)),
+                        logLikelihood=0.0,
+                    )
+                    for s in sources
+                ],
+                task=Task("dream", request, []),
+            )
+
+        corpus = DreamCorpus(tasks)
+        # Behaviours are measured on the inputs the Helmholtz enumerator gets
+        self.assertEqual(corpus.inputs, {request: [(x,) for x in range(5)]})
+        dreams = corpus.update(
+            g,
+            [
+                frontier("(lambda (+ $0 1))"),
+                frontier("(lambda (+ 1 $0))"),
+                frontier("(lambda (* $0 $0))"),
+            ],
+        )
+        self.assertEqual(len(dreams), 2)
+        self.assertEqual(sorted(len(f) for f in dreams), [1, 2])
+
+        # Seen programs are not run again
+        corpus.behaviour = None
+        smaller = Grammar.uniform([addition, k1])
+        dreams = corpus.update(smaller, [frontier("(lambda (+ 1 $0))")])
+        self.assertEqual(len(dreams), 1)
+        self.assertEqual(
+            sorted(str(e.program) for e in dreams[0]),
+            ["(lambda (+ $0 1))", "(lambda (+ 1 $0))"],
+        )
+        for e in dreams[0]:
+            self.assertAlmostEqual(
+                e.logPrior, smaller.logLikelihood(request, e.program)
+            )
+        # Only the behaviours of programs still in the corpus are remembered
+        self.assertEqual(
+            sorted(p for p, _ in corpus.behaviours),
+            ["(lambda (+ $0 1))", "(lambda (+ 1 $0))"],
+        )
+
+    def test_names_and_size_limit(self):
+        from dreamcoder.domains.arithmetic.arithmeticPrimitives import (
+            addition, k1, multiplication)
+        from dreamcoder.dreaming import DreamCorpus
+        from dreamcoder.frontier import Frontier, FrontierEntry
+        from dreamcoder.grammar import Grammar
+        from dreamcoder.program import Program
+        from dreamcoder.task import Task
+        from dreamcoder.type import arrow, tint
+
+        request = arrow(tint, tint)
+        tasks = [Task("id", request, [((x,), x) for x in range(5)])]
+        g = Grammar.uniform([addition, multiplication, k1])
+
+        def frontier(source):
+            program = Program.parse(source)
+            return Frontier(
+                [
+                    FrontierEntry(
+                        program=program,
+                        logPrior=g.logLikelihood(request, program),
+                        logLikelihood=0.0,
+                    )
+                ],
+                task=Task("dream", request, []),
+            )
+
+        corpus = DreamCorpus(tasks, maximumSize=2)
+        dreams = corpus.update(
+            g,
+            [
+                frontier("(lambda (* $0 $0))"),
+                frontier("(lambda (+ (* $0 $0) 1))"),
+                frontier("(lambda (+ $0 1))"),
+            ],
+        )
+        # The least likely behaviour does not fit
+        self.assertEqual(
+            sorted(str(f.entries[0].program) for f in dreams),
+            ["(lambda (* $0 $0))", "(lambda (+ $0 1))"],
+        )
+        self.assertEqual(len(corpus.behaviours), 2)
+
+        # Tasks of dropped frontiers are not named again
+        dreams = corpus.update(
+            Grammar.uniform([addition, k1]), [frontier("(lambda (+ $0 (+ $0 1)))")]
+        )
+        self.assertEqual(len(dreams), 2)
+        self.assertEqual(sorted(f.task.name for f in dreams), ["dream_2", "dream_3"])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,12 +1,44 @@
+import json
 import random
+import signal
+import time
 import unittest
 from unittest import mock
 
-from dreamcoder.enumeration import multicoreEnumeration
+from dreamcoder.enumeration import (
+    BatchedTaskScorer,
+    EnumerationWorkerPool,
+    IncrementalEnumerator,
+    ObservationalEquivalence,
+    enumerateForTasks,
+    enumerateSubrange,
+    multicoreEnumeration,
+    taskMessage,
+)
 from dreamcoder.frontier import Frontier
 from dreamcoder.grammar import Grammar
+from dreamcoder.likelihoodModel import AllOrNothingLikelihoodModel
+from dreamcoder.program import Abstraction, Application, Index, Primitive
+from dreamcoder.scene import Scene
 from dreamcoder.task import Task
-from dreamcoder.type import arrow, tint
+from dreamcoder.type import (
+    Context,
+    TypeVariable,
+    arrow,
+    t0,
+    t1,
+    tbool,
+    tint,
+    tlist,
+)
+from dreamcoder.utilities import NEGATIVEINFINITY
+
+
+def _spin(x, seconds=2.0):
+    start = time.process_time()
+    while time.process_time() - start < seconds:
+        pass
+    return x
 
 
 def add1():
@@ -118,5 +150,369 @@ class TestEnumerationMain(unittest.TestCase):
             )
 
 
+def get_arithmetic_grammar():
+    return Grammar.uniform(
+        [
+            Primitive("0", tint, 0),
+            Primitive("1", tint, 1),
+            Primitive("+", arrow(tint, tint, tint), lambda x: lambda y: x + y),
+            Primitive("*", arrow(tint, tint, tint), lambda x: lambda y: x * y),
+        ]
+    )
+
+
+class TestIncrementalEnumeration(unittest.TestCase):
+    def test_bands_match_grammar_enumeration(self):
+        grammar = get_arithmetic_grammar()
+        request = arrow(tint, tint)
+        enumerator = IncrementalEnumerator(grammar, request)
+        for band in range(6):
+            lowerBound, upperBound = 1.5 * band, 1.5 * (band + 1)
+            expected = sorted(
+                (str(p), round(l, 6))
+                for l, _, p in grammar.enumeration(
+                    Context.EMPTY,
+                    [],
+                    request,
+                    maximumDepth=99,
+                    upperBound=upperBound,
+                    lowerBound=lowerBound,
+                )
+            )
+            actual = sorted(
+                (str(p), round(l, 6))
+                for l, _, p in enumerator.enumeration(lowerBound, upperBound)
+            )
+            self.assertEqual(actual, expected)
+
+    def test_first_band_above_zero(self):
+        grammar = get_arithmetic_grammar()
+        request = arrow(tint, tint)
+        enumerator = IncrementalEnumerator(grammar, request)
+        expected = {
+            str(p)
+            for _, _, p in grammar.enumeration(
+                Context.EMPTY, [], request, upperBound=9.0, lowerBound=4.5
+            )
+        }
+        actual = {str(p) for _, _, p in enumerator.enumeration(4.5, 9.0)}
+        self.assertEqual(actual, expected)
+
+
+class TestCandidateCache(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar.uniform(
+            [
+                Primitive("0", tint, 0),
+                Primitive("+", arrow(tint, tint, tint), None),
+                Primitive("empty", tlist(t0), []),
+                Primitive("cons", arrow(t0, tlist(t0), tlist(t0)), None),
+                Primitive("map", arrow(arrow(t0, t1), tlist(t0), tlist(t1)), None),
+                Primitive("fold", arrow(tlist(t0), t1, arrow(t0, t1, t1), t1), None),
+            ]
+        )
+
+    def enumerate(self, request):
+        return [
+            (str(p), round(l, 6), str(k))
+            for l, k, p in self.grammar.enumeration(
+                Context.EMPTY, [], request, upperBound=9.0, maximumDepth=4
+            )
+        ] + [
+            (str(p), round(self.grammar.logLikelihood(request, p), 6))
+            for _, _, p in self.grammar.enumeration(
+                Context.EMPTY, [], request, upperBound=7.0, maximumDepth=4
+            )
+        ]
+
+    def test_matches_uncached_candidates(self):
+        for request in [arrow(tlist(tint), tint), arrow(tlist(t0), tlist(t0))]:
+            cached = self.enumerate(request)
+            self.assertGreater(len(self.grammar.candidateCache), 0)
+            with mock.patch.object(
+                Grammar, "_cachedCandidates", Grammar._buildCandidates
+            ):
+                self.assertEqual(cached, self.enumerate(request))
+
+    def test_contexts_are_renamed(self):
+        context, request = Context(3, []).makeVariable()
+        context = context.unify(request, tlist(TypeVariable(1)))
+        environment = [TypeVariable(2), arrow(TypeVariable(1), tint)]
+        for _ in range(2):
+            expected = self.grammar._buildCandidates(
+                request, context, environment, True, False, False, False
+            )
+            actual = self.grammar.buildCandidates(request, context, environment)
+            self.assertEqual(
+                [(l, str(t), str(p), str(k)) for l, t, p, k in actual],
+                [(l, str(t), str(p), str(k)) for l, t, p, k in expected],
+            )
+
+    def test_productions_changed_in_place(self):
+        def leaves():
+            candidates = self.grammar.buildCandidates(tint, Context.EMPTY, [])
+            return [str(p) for _, _, p, _ in candidates]
+
+        self.assertIn("0", leaves())
+        l, t, _ = self.grammar.productions[0]
+        self.grammar.productions[0] = (l, t, Primitive("1", tint, 1))
+        self.grammar.clearCandidateCache()
+        self.assertIn("1", leaves())
+
+
+class TestObservationalEquivalence(unittest.TestCase):
+    def test_pruning_keeps_every_behaviour(self):
+        grammar = Grammar.uniform(
+            [
+                Primitive("true", tbool, True),
+                Primitive("not", arrow(tbool, tbool), lambda x: not x),
+                Primitive(
+                    "and", arrow(tbool, tbool, tbool), lambda x: lambda y: x and y
+                ),
+                Primitive(
+                    "or", arrow(tbool, tbool, tbool), lambda x: lambda y: x or y
+                ),
+            ]
+        )
+        request = arrow(tbool, tbool, tbool)
+        task = Task(
+            "xor",
+            request,
+            [((x, y), x != y) for x in (False, True) for y in (False, True)],
+        )
+
+        def behaviours(observational):
+            programs = {}
+            for l, _, p in grammar.enumeration(
+                Context.EMPTY,
+                [],
+                request,
+                upperBound=11.0,
+                maximumDepth=99,
+                observational=observational,
+            ):
+                outputs = tuple(p.runWithArguments(xs) for xs, _ in task.examples)
+                programs[outputs] = min(programs.get(outputs, float("inf")), -l)
+            return programs
+
+        observational = ObservationalEquivalence([task], request)
+        self.assertEqual(behaviours(observational), behaviours(None))
+        self.assertGreater(observational.pruned, 0)
+
+    def test_signatures(self):
+        request = arrow(tint, tint)
+        task = Task("t", request, [((x,), x) for x in range(3)])
+        observational = ObservationalEquivalence([task], request, timeout=0.1)
+        spin = Primitive("spin", arrow(tint, tint), _spin)
+        increment = Primitive("incr", arrow(tint, tint), lambda x: x + 1)
+        environment = [tint]
+        # Functions are not evaluated
+        position = (spin, 0, arrow(tint, tint))
+        self.assertFalse(observational.redundant(position, environment, 1.0, spin))
+        self.assertEqual(observational.signatures, {})
+        # Nor are arguments that do not terminate
+        spinning = Application(spin, Index(0))
+        self.assertIsNone(observational.signature(spinning))
+        # Signatures are forgotten once there are too many of them
+        with mock.patch.object(ObservationalEquivalence, "SIGNATURECACHESIZE", 2):
+            for p in [Index(0), Application(increment, Index(0))]:
+                self.assertIsNotNone(observational.signature(p))
+            self.assertEqual(len(observational.signatures), 1)
+
+    def test_representatives(self):
+        request = arrow(tint, tint)
+        task = Task("t", request, [((x,), x) for x in range(3)])
+        observational = ObservationalEquivalence([task], request)
+        increment = Primitive("incr", arrow(tint, tint), lambda x: x + 1)
+        successor = Primitive("succ", arrow(tint, tint), lambda x: x + 1)
+        position = (increment, 0, tint)
+        environment = [tint]
+        once = Application(increment, Index(0))
+        self.assertFalse(observational.redundant(position, environment, 1.0, once))
+        later = Application(successor, Index(0))
+        self.assertTrue(observational.redundant(position, environment, 2.0, later))
+        # Subterms under a lambda of the program are not evaluated
+        self.assertFalse(observational.redundant(position, [tint, tint], 2.0, later))
+        # Representatives are forgotten once there are too many of them
+        with mock.patch.object(ObservationalEquivalence, "REPRESENTATIVECACHESIZE", 2):
+            for p in [Index(0), Application(increment, once)]:
+                self.assertFalse(
+                    observational.redundant(position, environment, 1.0, p)
+                )
+            self.assertEqual(len(observational.representatives), 1)
+
+
+class TestBatchedTaskScorer(unittest.TestCase):
+    def test_matches_per_task_scoring(self):
+        grammar = get_arithmetic_grammar()
+        request = arrow(tint, tint)
+        tasks = [
+            Task("add1", request, [((x,), x + 1) for x in range(5)]),
+            Task("add2", request, [((x,), x + 2) for x in range(5)]),
+            Task("double", request, [((x,), x * 2) for x in range(3, 8)]),
+        ]
+        likelihoodModel = AllOrNothingLikelihoodModel(timeout=1.0)
+        scorer = BatchedTaskScorer(tasks, likelihoodModel)
+        self.assertEqual(len(scorer.inputs), 8)
+        for _, _, p in grammar.enumeration(
+            Context.EMPTY, [], request, upperBound=8.0, maximumDepth=99
+        ):
+            self.assertEqual(
+                scorer.score(p), [likelihoodModel.score(p, t) for t in tasks]
+            )
+
+    def test_timeout_applies_to_each_input(self):
+        spin = Primitive("spin", arrow(tint, tint), _spin)
+        slow = Primitive("slow", arrow(tint, tint), lambda x: _spin(x, 0.06))
+        request = arrow(tint, tint)
+        tasks = [Task("t%d" % x, request, [((x,), x)]) for x in range(3)]
+        scorer = BatchedTaskScorer(tasks, AllOrNothingLikelihoodModel(timeout=0.1))
+        handler = lambda *_: None
+        previous = signal.signal(signal.SIGVTALRM, handler)
+        try:
+            with mock.patch.object(
+                signal, "setitimer", wraps=signal.setitimer
+            ) as setitimer:
+                scores = scorer.score(Abstraction(Application(spin, Index(0))))
+            self.assertEqual(scores, [(False, NEGATIVEINFINITY)] * len(tasks))
+            self.assertEqual(
+                [c for c in setitimer.call_args_list if c.args[1] != 0],
+                [mock.call(signal.ITIMER_VIRTUAL, 0.1)] * len(tasks),
+            )
+            self.assertIs(signal.getsignal(signal.SIGVTALRM), handler)
+            self.assertEqual(signal.getitimer(signal.ITIMER_VIRTUAL), (0.0, 0.0))
+            # Slower than the timeout on all inputs together, but not on any
+            scores = scorer.score(Abstraction(Application(slow, Index(0))))
+            self.assertEqual(scores, [(True, 0.0)] * len(tasks))
+        finally:
+            signal.signal(signal.SIGVTALRM, previous)
+
+    def test_fuel_timeout_applies_to_each_input(self):
+        slow = Primitive("slow", arrow(tint, tint), lambda x: _spin(x, 0.1))
+        request = arrow(tint, tint)
+        tasks = [Task("t%d" % x, request, [((x,), x)]) for x in range(6)]
+        scorer = BatchedTaskScorer(
+            tasks, AllOrNothingLikelihoodModel(timeout=0.15, fuel=100)
+        )
+        scores = scorer.score(Abstraction(Application(slow, Index(0))))
+        self.assertEqual(scores, [(True, 0.0)] * len(tasks))
+
+    def test_watchdog_is_armed_once_per_job(self):
+        grammar = get_arithmetic_grammar()
+        request = arrow(tint, tint)
+        tasks = [Task("add1", request, [((x,), x + 1) for x in range(5)])]
+        likelihoodModel = AllOrNothingLikelihoodModel(timeout=1.0, fuel=100)
+        handler = signal.getsignal(signal.SIGVTALRM)
+        with mock.patch.object(
+            signal, "setitimer", wraps=signal.setitimer
+        ) as setitimer:
+            _, _, numberOfPrograms = enumerateForTasks(
+                grammar,
+                tasks,
+                likelihoodModel,
+                timeout=10,
+                upperBound=8.0,
+                maximumFrontiers={tasks[0]: 1000},
+            )
+        self.assertGreater(numberOfPrograms, 1)
+        self.assertEqual(
+            setitimer.call_args_list,
+            [
+                mock.call(signal.ITIMER_VIRTUAL, 1.0, 1.0),
+                mock.call(signal.ITIMER_VIRTUAL, 0),
+            ],
+        )
+        self.assertIs(signal.getsignal(signal.SIGVTALRM), handler)
+
+
+class TestTaskMessage(unittest.TestCase):
+    def test_scene_inputs_are_sent_as_lists(self):
+        request = arrow(tlist(tlist(tint)), tint)
+        objects = [[1, 2], [3, 4], [5, 6]]
+        task = Task("count", request, [((Scene.compact(objects),), 3)])
+        self.assertIsInstance(task.examples[0][0][0], Scene)
+        message = json.loads(json.dumps(taskMessage(task, 5)))
+        self.assertEqual(message["examples"], [{"inputs": [objects], "output": 3}])
+        self.assertEqual(message["maximumFrontier"], 5)
+
+
+class TestEnumerationWorkerPool(unittest.TestCase):
+    def tearDown(self):
+        EnumerationWorkerPool.shutdown()
+
+    def test_pool_is_reused_across_calls(self):
+        grammar = get_arithmetic_grammar()
+        request = arrow(tint, tint)
+        tasks = [
+            Task("add1", request, [((x,), x + 1) for x in range(5)]),
+            Task("double", request, [((x,), x * 2) for x in range(3, 8)]),
+        ]
+        pids = None
+        for _ in range(2):
+            # testing gives every task its own job, so the pool is used
+            frontiers, _ = multicoreEnumeration(
+                grammar,
+                tasks,
+                solver="python",
+                enumerationTimeout=10,
+                CPUs=2,
+                maximumFrontier=1,
+                evaluationTimeout=1.0,
+                testing=True,
+            )
+            self.assertEqual([f.task for f in frontiers], tasks)
+            self.assertTrue(all(len(f) >= 1 for f in frontiers))
+            processes = EnumerationWorkerPool.SHARED.processes
+            if pids is not None:
+                self.assertEqual([p.pid for p in processes], pids)
+            pids = [p.pid for p in processes]
+        self.assertEqual(EnumerationWorkerPool.SHARED.resident, [set(), set()])
+
+    def test_single_job_is_split_across_workers(self):
+        grammar = get_arithmetic_grammar()
+        request = arrow(tint, tint)
+        tasks = [
+            Task("add1", request, [((x,), x + 1) for x in range(5)]),
+            Task("square", request, [((x,), x * x) for x in range(5)]),
+        ]
+        frontiers, _ = multicoreEnumeration(
+            grammar,
+            tasks,
+            solver="python",
+            enumerationTimeout=10,
+            CPUs=3,
+            maximumFrontier=2,
+            evaluationTimeout=1.0,
+        )
+        self.assertEqual(len(EnumerationWorkerPool.SHARED), 3)
+        self.assertTrue(all(len(f) >= 2 for f in frontiers))
+
+
+class TestEnumerateSubrange(unittest.TestCase):
+    def test_subranges_partition_band(self):
+        grammar = get_arithmetic_grammar()
+        request = arrow(tint, tint, tint)
+        for lowerBound, upperBound in [(0.0, 4.5), (4.5, 6.0), (6.0, 7.5)]:
+            expected = sorted(
+                (str(p), round(l, 6))
+                for l, _, p in grammar.enumeration(
+                    Context.EMPTY,
+                    [],
+                    request,
+                    maximumDepth=99,
+                    upperBound=upperBound,
+                    lowerBound=lowerBound,
+                )
+            )
+            actual = sorted(
+                (str(p), round(l, 6))
+                for k in range(5)
+                for l, _, p in enumerateSubrange(
+                    grammar, request, lowerBound, upperBound, (k, 5)
+                )
+            )
+            self.assertEqual(actual, expected)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,83 @@
+import random
+import unittest
+
+from dreamcoder.frontier import Frontier, FrontierEntry, FrontierUnion
+from dreamcoder.program import Abstraction, Primitive
+from dreamcoder.task import Task
+from dreamcoder.type import arrow, tint
+
+
+class TestFrontierUnion(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.task = Task("t", arrow(tint, tint), [])
+        self.programs = [
+            Abstraction(Primitive("c%d" % n, tint, n)) for n in range(30)
+        ]
+        # Likelihoods are deterministic, so a program always gets the same entry
+        self.scores = {
+            p: (-random.randrange(5), -random.random()) for p in self.programs
+        }
+
+    def frontier(self, programs):
+        return Frontier(
+            [
+                FrontierEntry(
+                    p, logPrior=self.scores[p][0], logLikelihood=self.scores[p][1]
+                )
+                for p in programs
+            ],
+            self.task,
+        )
+
+    def test_matches_combine_and_topK(self):
+        frontiers = [
+            self.frontier(random.sample(self.programs, random.randrange(12)))
+            for _ in range(8)
+        ]
+        union = {p for f in frontiers for p in (e.program for e in f)}
+        expected = sorted(union, key=lambda p: (-sum(self.scores[p]), str(p)))
+        for k in [None, -1, 0, 1, 5, 100]:
+            merged = Frontier.combineMany(frontiers, k)
+            if k is None or k < 0:
+                self.assertEqual({e.program for e in merged}, union)
+            else:
+                self.assertEqual([e.program for e in merged], expected[:k])
+                self.assertEqual(
+                    [e.program for e in merged],
+                    [e.program for e in self.frontier(union).topK(k)],
+                )
+
+        combined = frontiers[0].combine(frontiers[1])
+        self.assertEqual(
+            sorted(str(e.program) for e in combined),
+            sorted({str(e.program) for f in frontiers[:2] for e in f}),
+        )
+
+    def test_incremental(self):
+        union = FrontierUnion(self.task, 3)
+        self.assertTrue(union.empty)
+        seen = set()
+        for _ in range(10):
+            programs = random.sample(self.programs, 4)
+            seen.update(programs)
+            union.add(self.frontier(programs))
+            best = self.frontier(seen).topK(3)
+            self.assertEqual(len(union), min(3, len(seen)))
+            self.assertEqual(union.bestPosterior.program, best.entries[0].program)
+            self.assertEqual(
+                [e.program for e in union.frontier()], [e.program for e in best]
+            )
+
+    def test_differing_likelihoods_are_averaged(self):
+        p = self.programs[0]
+        a = Frontier([FrontierEntry(p, logPrior=-1.0, logLikelihood=-2.0)], self.task)
+        b = Frontier([FrontierEntry(p, logPrior=-1.0, logLikelihood=-4.0)], self.task)
+        for k in [None, 2]:
+            (e,) = FrontierUnion(self.task, k).add(a).add(b).frontier()
+            self.assertEqual(e.logLikelihood, -3.0)
+            self.assertEqual(e.logPosterior, -4.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
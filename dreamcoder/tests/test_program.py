@@ -0,0 +1,158 @@
+import pickle
+import unittest
+
+from dreamcoder.program import (
+    Abstraction,
+    Application,
+    Index,
+    OutOfFuel,
+    Primitive,
+    Program,
+)
+from dreamcoder.type import MutableContext, arrow, tbool, tint, tlist, t0
+
+
+def _eq(x):
+    return lambda y: x == y
+
+
+def _forall(pred):
+    return lambda l: all(pred(i) for i in l)
+
+
+def _if(c):
+    return lambda t: lambda f: t if c else f
+
+
+Primitive("test-eq?", arrow(tint, tint, tbool), _eq)
+Primitive("test-forall", arrow(arrow(t0, tbool), tlist(t0), tbool), _forall)
+Primitive("if", arrow(tbool, t0, t0, t0), _if)
+Primitive("test-1", tint, 1)
+Primitive("test-2", tint, 2)
+
+
+class TestCompile(unittest.TestCase):
+    def test_indices(self):
+        p = Program.parse("(lambda (lambda (test-eq? $1 $0)))")
+        for x, y in [(1, 2), (2, 2)]:
+            self.assertEqual(p.compile()(x)(y), p.evaluate([])(x)(y))
+        p = Program.parse("(lambda (lambda $1))")
+        self.assertEqual(p.compile()(1)(2), 1)
+
+    def test_nested_lambda(self):
+        p = Program.parse("(lambda (test-forall (lambda (test-eq? $0 test-1)) $0))")
+        for xs in ([1, 1], [1, 2], []):
+            self.assertEqual(p.compile()(xs), p.evaluate([])(xs))
+
+    def test_uncurried_primitive(self):
+        Primitive.registerUncurried(_eq, 2, lambda x, y: x == y)
+        try:
+            p = Program.parse("(lambda (test-eq? $0 test-2))")
+            self.assertEqual([p.compile()(x) for x in (1, 2)], [False, True])
+        finally:
+            del Primitive.UNCURRIED[id(_eq)]
+
+    def test_conditional_is_lazy(self):
+        p = Program.parse("(lambda (if (test-eq? $0 test-1) test-2 $1))")
+        self.assertEqual(p.compile()(1), 2)
+        with self.assertRaises(IndexError):
+            p.compile()(2)
+
+    def test_constants_with_the_same_name(self):
+        # As the text domain instantiates STRING for every word it tries
+        condition = Application(
+            Application(Primitive.GLOBALS["test-eq?"], Index(0)),
+            Primitive.GLOBALS["test-1"],
+        )
+        for word in ["foo", "bar"]:
+            string = Primitive("STRING", tint, word)
+            p = Application(Application(Primitive.GLOBALS["if"], condition), string)
+            p = Abstraction(Application(p, Primitive.GLOBALS["test-2"]))
+            self.assertEqual(p.compile()(1), word)
+            self.assertEqual(p.runWithArguments([1]), p.evaluate([])(1))
+            self.assertEqual(Abstraction(string).compile()(None), word)
+
+
+class TestFuel(unittest.TestCase):
+    def test_metered_program_runs_out_of_fuel(self):
+        p = Program.parse("(lambda (test-forall (lambda (test-eq? $0 test-1)) $0))")
+        f = p.compile(metered=True)
+        # One application for the outer lambda, one per list element
+        Program.refuel(4)
+        self.assertTrue(f([1, 1, 1]))
+        Program.refuel(3)
+        with self.assertRaises(OutOfFuel):
+            f([1, 1, 1])
+
+    def test_unmetered_program_ignores_fuel(self):
+        p = Program.parse("(lambda (test-forall (lambda (test-eq? $0 test-1)) $0))")
+        Program.refuel(0)
+        self.assertTrue(p.compile()([1, 1, 1]))
+
+
+class TestIntern(unittest.TestCase):
+    def test_interned_programs_are_shared(self):
+        sources = [
+            "(lambda (test-forall (lambda (test-eq? $0 test-1)) $0))",
+            "(lambda (lambda (test-eq? $1 $2)))",
+            "(lambda (if (test-eq? $0 test-1) test-2 $1))",
+            "(lambda (#(lambda (test-eq? $0 test-1)) $0))",
+        ]
+        for source in sources:
+            a, b = Program.parse(source), Program.parse(source)
+            interned = a.intern()
+            self.assertTrue(interned.interned)
+            self.assertIs(b.intern(), interned)
+            self.assertIs(interned.intern(), interned)
+            self.assertEqual(interned, b)
+            self.assertEqual(hash(interned), hash(b))
+            self.assertEqual(str(interned), source)
+            self.assertEqual(interned.size(), b.size())
+            self.assertEqual(set(interned.freeVariables()), set(b.freeVariables()))
+            self.assertEqual(interned.closed, b.closed)
+            self.assertEqual(str(pickle.loads(pickle.dumps(interned))), source)
+            self.assertFalse(pickle.loads(pickle.dumps(interned)).interned)
+
+        a, b = (Program.parse(s).intern() for s in sources[:2])
+        self.assertNotEqual(a, b)
+        # Subprograms are shared between programs
+        self.assertIs(a.body.x, Program.parse("(lambda $0)").intern().body)
+
+    def test_interning_builds_new_nodes(self):
+        p = Program.parse("(lambda (test-eq? $0 test-1))")
+        p.annotateTypes(MutableContext(), [])
+        interned = p.intern()
+        self.assertFalse(p.interned or p.body.interned)
+        self.assertIsNot(interned.body, p.body)
+        self.assertFalse(hasattr(interned, "annotatedType"))
+        self.assertFalse(hasattr(interned.body.f.x, "annotatedType"))
+
+    def test_constants_with_the_same_name(self):
+        programs = [
+            Abstraction(Primitive("STRING", tint, word)).intern()
+            for word in ["foo", "bar"]
+        ]
+        self.assertIsNot(programs[0], programs[1])
+        self.assertEqual([p.body.value for p in programs], ["foo", "bar"])
+        # Equality is structural, whether or not programs are interned
+        ordinary = Abstraction(Primitive("STRING", tint, "baz"))
+        self.assertEqual(programs[0], ordinary)
+        self.assertEqual(programs[1], ordinary)
+        self.assertEqual(programs[0], programs[1])
+
+    def test_invented(self):
+        p = Program.parse("#(lambda (test-eq? $0 test-1))").intern()
+        self.assertTrue(p.closed)
+        self.assertEqual(p.size(), 1)
+        self.assertEqual(set(p.freeVariables()), set())
+
+    def test_holes_are_not_interned(self):
+        from dreamcoder.program import Application, Hole
+
+        p = Application(Program.parse("test-forall"), Hole())
+        self.assertIs(p.intern(), p)
+        self.assertFalse(p.interned)
+
+
+if __name__ == "__main__":
+    unittest.main()
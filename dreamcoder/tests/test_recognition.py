@@ -9,5 +9,86 @@ class TestRecognition(unittest.TestCase):
             self.fail("Unable to import from recognition module")
 
 
+class TestMinibatchedTraining(unittest.TestCase):
+    def test_batched_loss_matches_per_frontier_loss(self):
+        import torch
+
+        from dreamcoder.frontier import Frontier, FrontierEntry
+        from dreamcoder.grammar import Grammar
+        from dreamcoder.program import Primitive, Program
+        from dreamcoder.recognition import DummyFeatureExtractor, RecognitionModel
+        from dreamcoder.task import Task
+        from dreamcoder.type import arrow, tint
+
+        grammar = Grammar.uniform(
+            [
+                Primitive("0", tint, 0),
+                Primitive("1", tint, 1),
+                Primitive("+", arrow(tint, tint, tint), lambda x: lambda y: x + y),
+            ]
+        )
+        request = arrow(tint, tint)
+        model = RecognitionModel(DummyFeatureExtractor([]), grammar, hidden=[4])
+        frontiers = []
+        for n, sources in enumerate(
+            [
+                ["(lambda (+ $0 1))", "(lambda (+ 1 $0))"],
+                ["(lambda 0)"],
+                ["(lambda (+ $0 (+ 1 1)))", "(lambda (+ (+ $0 1) 1))", "(lambda $0)"],
+            ]
+        ):
+            task = Task("t%d" % n, request, [((0,), 0)])
+            entries = [
+                FrontierEntry(
+                    Program.parse(source),
+                    logPrior=grammar.logLikelihood(request, Program.parse(source)),
+                    logLikelihood=-float(k),
+                )
+                for k, source in enumerate(sources)
+            ]
+            frontiers.append(
+                model.replaceProgramsWithLikelihoodSummaries(Frontier(entries, task))
+            )
+
+        losses, al, kept = model.batchedLoss(frontiers, True)
+        self.assertEqual(kept, [0, 1, 2])
+        expected = [model.frontierBiasOptimal(f) for f in frontiers]
+        for loss, (l, _) in zip(losses.tolist(), expected):
+            self.assertAlmostEqual(loss, l.item(), places=4)
+        self.assertAlmostEqual(
+            al.item(), torch.stack([a for _, a in expected]).mean().item(), places=4
+        )
+
+
+class TestFeatureCache(unittest.TestCase):
+    def test_cached_features_match(self):
+        import torch
+
+        from dreamcoder.recognition import RecurrentFeatureExtractor
+        from dreamcoder.task import Task
+        from dreamcoder.type import arrow, tint, tlist
+
+        request = arrow(tlist(tint), tlist(tint))
+        tasks = [
+            Task("t%d" % n, request, [(([n, 1, 2][:k],), [k, n]) for k in range(1, 4)])
+            for n in range(4)
+        ]
+        extractor = RecurrentFeatureExtractor(
+            tasks=tasks, lexicon=list(range(4)), H=8, bidirectional=True
+        )
+        expected = [extractor.featuresOfTask(t) for t in tasks]
+        extractor.cacheTasks(tasks)
+        for features in [
+            [extractor.featuresOfTask(t) for t in tasks],
+            extractor.batchedFeaturesOfTasks(tasks),
+        ]:
+            for f, e in zip(features, expected):
+                self.assertTrue(torch.allclose(f, e, atol=1e-6))
+        extractor.clearCache()
+        batched = extractor.batchedFeaturesOfTasks(tasks)
+        for f, e in zip(batched, expected):
+            self.assertTrue(torch.allclose(f, e, atol=1e-6))
+
+
 if __name__ == "__main__":
     unittest.main()
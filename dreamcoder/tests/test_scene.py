@@ -0,0 +1,237 @@
+import random
+import signal
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from dreamcoder.enumeration import BatchedTaskScorer
+from dreamcoder.grammar import Grammar
+from dreamcoder.likelihoodModel import AllOrNothingLikelihoodModel
+from dreamcoder.program import Abstraction, Application, Index, Primitive
+from dreamcoder.scene import Scene, SceneBatch
+from dreamcoder.task import EvaluationTimeout, Task
+from dreamcoder.type import Context, arrow, t0, tbool, tint, tlist
+from dreamcoder.utilities import NEGATIVEINFINITY
+
+
+def _index(n):
+    return lambda x: x[n]
+
+
+def _eq(x):
+    return lambda y: x == y
+
+
+def _gt(x):
+    return lambda y: x > y
+
+
+def _and(x):
+    return lambda y: x and y
+
+
+def _forall(pred):
+    return lambda l: all(pred(o) for o in l)
+
+
+def _exists(pred):
+    return lambda l: any(pred(o) for o in l)
+
+
+def _length(l):
+    return len(l)
+
+
+def get_primitives():
+    predicate = arrow(t0, tbool)
+    primitives = {
+        "index": Primitive("index", arrow(tint, tlist(t0), t0), _index),
+        "eq?": Primitive("eq?", arrow(tint, tint, tbool), _eq),
+        "gt?": Primitive("gt?", arrow(tint, tint, tbool), _gt),
+        "and": Primitive("and", arrow(tbool, tbool, tbool), _and),
+        "forall": Primitive("forall", arrow(predicate, tlist(t0), tbool), _forall),
+        "exists": Primitive("exists", arrow(predicate, tlist(t0), tbool), _exists),
+        "length": Primitive("length", arrow(tlist(t0), tint), _length),
+    }
+    for j in range(4):
+        primitives[str(j)] = Primitive(str(j), tint, j)
+    Primitive.registerVectorized(_index, "index")
+    Primitive.registerVectorized(_eq, np.equal)
+    Primitive.registerVectorized(_gt, np.greater)
+    Primitive.registerVectorized(_and, np.logical_and)
+    Primitive.registerVectorized(_forall, "forall")
+    Primitive.registerVectorized(_exists, "exists")
+    Primitive.registerVectorized(_length, "length")
+    return primitives
+
+
+def build(primitives, e):
+    """Program from nested tuples of primitive names, with ints for de Bruijn
+    indices and ("lambda", body) for abstractions"""
+    if isinstance(e, int):
+        return Index(e)
+    if isinstance(e, str):
+        return primitives[e]
+    if e[0] == "lambda":
+        return Abstraction(build(primitives, e[1]))
+    f = build(primitives, e[0])
+    for x in e[1:]:
+        f = Application(f, build(primitives, x))
+    return f
+
+
+class TestScene(unittest.TestCase):
+    def setUp(self):
+        self.objects = [[0, 1, 2], [3, 1, 0], [0, 1, 2], [2, 2, 2]]
+        self.scene = Scene.compact(self.objects)
+
+    def test_behaves_like_list(self):
+        scene, objects = self.scene, self.objects
+        self.assertIsInstance(scene, Scene)
+        self.assertEqual(len(scene), len(objects))
+        self.assertEqual(list(scene), objects)
+        self.assertEqual(scene[1], objects[1])
+        self.assertEqual(scene[-1], objects[-1])
+        self.assertIs(type(scene[0][0]), int)
+        self.assertEqual(scene[1:3], objects[1:3])
+        self.assertEqual(scene[::-1], objects[::-1])
+        self.assertEqual(scene.count([0, 1, 2]), 2)
+        self.assertEqual(scene.index([2, 2, 2]), 3)
+        self.assertRaises(ValueError, scene.index, [9, 9, 9])
+        self.assertEqual([[5]] + scene, [[5]] + objects)
+        self.assertEqual(scene + [[5]], objects + [[5]])
+        self.assertTrue(scene[:0] == [])
+        self.assertRaises(IndexError, lambda: scene[4])
+
+    def test_compact_keeps_ragged_lists(self):
+        ragged = [[0, 1], [2]]
+        self.assertIs(Scene.compact(ragged), ragged)
+        self.assertEqual(Scene.compact([]), [])
+
+    def test_vectorized_predicates(self):
+        primitives = get_primitives()
+        for e in [
+            ("lambda", ("eq?", ("index", "1", 0), "1")),
+            ("lambda", ("gt?", "2", ("index", "1", 0))),
+            (
+                "lambda",
+                (
+                    "and",
+                    ("eq?", ("index", "2", 0), "2"),
+                    ("gt?", ("index", "1", 0), "1"),
+                ),
+            ),
+        ]:
+            f = build(primitives, e).compile()
+            self.assertTrue(hasattr(f, "vectorized"), e)
+            self.assertEqual(
+                f.vectorized(self.scene.array).tolist(),
+                [f(o) for o in self.objects],
+            )
+        # Refers to a variable bound outside of the predicate
+        e = ("lambda", ("lambda", ("eq?", ("index", "1", 0), 1)))
+        f = build(primitives, e).compile()
+        self.assertFalse(hasattr(f, "vectorized"))
+        self.assertFalse(hasattr(f(0), "vectorized"))
+
+    def test_batch_matches_python_semantics(self):
+        primitives = get_primitives()
+        scenes = [
+            self.scene,
+            Scene.compact([[1, 1, 1]]),
+            Scene(np.zeros((0, 0), dtype=np.int64)),
+            Scene.compact([[2, 0, 2], [3, 3, 3]]),
+        ]
+        batch = SceneBatch.of([(s,) for s in scenes])
+        self.assertEqual(len(batch), len(scenes))
+        for e in [
+            ("lambda", ("forall", ("lambda", ("eq?", ("index", "1", 0), "1")), 0)),
+            ("lambda", ("exists", ("lambda", ("gt?", ("index", "0", 0), "2")), 0)),
+            ("lambda", ("exists", ("lambda", ("eq?", "1", "1")), 0)),
+            (
+                "lambda",
+                (
+                    "and",
+                    ("gt?", ("length", 0), "1"),
+                    ("forall", ("lambda", ("gt?", "3", ("index", "2", 0))), 0),
+                ),
+            ),
+            ("lambda", ("eq?", "2", "2")),
+        ]:
+            program = build(primitives, e)
+            f = program.compile()
+            self.assertEqual(
+                batch.evaluate(program).tolist(), [f(s) for s in scenes], e
+            )
+
+        # Not lowered: the scene is not $0, or the predicate is not closed
+        for e in [
+            ("lambda", ("lambda", ("forall", ("lambda", ("eq?", 0, "1")), 1))),
+            ("lambda", ("forall", ("lambda", ("eq?", ("index", "1", 0), 1)), 0)),
+        ]:
+            self.assertIsNone(batch.evaluate(build(primitives, e)), e)
+        # An attribute that only some scenes have
+        e = ("lambda", ("exists", ("lambda", ("eq?", ("index", "3", 0), "1")), 0))
+        self.assertIsNone(batch.evaluate(build(primitives, e)))
+
+    def test_batch_needs_scenes(self):
+        self.assertIsNone(SceneBatch.of([([[0, 1], [2]],)]))
+        self.assertIsNone(SceneBatch.of([(self.scene, 1)]))
+        self.assertIsNone(SceneBatch.of([(self.scene,), (Scene.compact([[0, 1]]),)]))
+
+    def sceneTasks(self):
+        random.seed(0)
+        request = arrow(tlist(tlist(tint)), tbool)
+
+        def scene():
+            objects = [[random.randrange(4) for _ in range(3)] for _ in range(3)]
+            return Scene.compact(objects[: random.randrange(4)])
+
+        return [
+            Task(
+                "t%d" % n,
+                request,
+                [((scene(),), random.random() < 0.5) for _ in range(3)],
+            )
+            for n in range(BatchedTaskScorer.SCENEBATCH)
+        ]
+
+    def test_scorer_matches_per_task_scoring(self):
+        primitives = get_primitives()
+        request = arrow(tlist(tlist(tint)), tbool)
+        tasks = self.sceneTasks()
+        likelihoodModel = AllOrNothingLikelihoodModel(timeout=1.0)
+        scorer = BatchedTaskScorer(tasks, likelihoodModel)
+        self.assertIsNotNone(scorer.scenes)
+        grammar = Grammar.uniform(list(primitives.values()))
+        programs = [
+            p
+            for _, _, p in grammar.enumeration(
+                Context.EMPTY, [], request, upperBound=9.0, maximumDepth=99
+            )
+        ]
+        self.assertTrue(any(scorer.scenes.evaluate(p) is not None for p in programs))
+        for p in programs:
+            self.assertEqual(
+                scorer.score(p), [likelihoodModel.score(p, t) for t in tasks], p
+            )
+
+    def test_scorer_batch_times_out(self):
+        tasks = self.sceneTasks()
+        scorer = BatchedTaskScorer(
+            tasks, AllOrNothingLikelihoodModel(timeout=1.0, fuel=100)
+        )
+        program = Abstraction(Application(get_primitives()["length"], Index(0)))
+        handler = signal.getsignal(signal.SIGVTALRM)
+        with mock.patch.object(SceneBatch, "evaluate", side_effect=EvaluationTimeout):
+            self.assertEqual(
+                scorer.score(program), [(False, NEGATIVEINFINITY)] * len(tasks)
+            )
+        # The watchdog is disarmed once the program is scored
+        self.assertIs(signal.getsignal(signal.SIGVTALRM), handler)
+        self.assertEqual(signal.getitimer(signal.ITIMER_VIRTUAL), (0.0, 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import signal
+import time
+import unittest
+from unittest import mock
+
+from dreamcoder.program import Abstraction, Application, Index, Primitive
+from dreamcoder.task import EvaluationWatchdog, Task
+from dreamcoder.type import arrow, tint
+
+
+def _spin(x):
+    start = time.process_time()
+    while time.process_time() - start < 2.0:
+        pass
+    return x
+
+
+class TestEvaluationWatchdog(unittest.TestCase):
+    def test_nested_starts(self):
+        handler = signal.getsignal(signal.SIGVTALRM)
+        watchdog = EvaluationWatchdog()
+        watchdog.start(1.0)
+        watchdog.start(None)
+        watchdog.start(1.0)
+        watchdog.stop()
+        watchdog.stop()
+        self.assertIs(signal.getsignal(signal.SIGVTALRM), watchdog.callBack)
+        self.assertEqual(signal.getitimer(signal.ITIMER_VIRTUAL)[1], 1.0)
+        self.assertTrue(watchdog.evaluating)
+        watchdog.stop()
+        self.assertIs(signal.getsignal(signal.SIGVTALRM), handler)
+        self.assertEqual(signal.getitimer(signal.ITIMER_VIRTUAL), (0.0, 0.0))
+        self.assertFalse(watchdog.evaluating)
+
+    def test_check_times_out_inside_primitive(self):
+        spin = Primitive("spin", arrow(tint, tint), _spin)
+        task = Task("spin", arrow(tint, tint), [((1,), 1)])
+        program = Abstraction(Application(spin, Index(0)))
+        handler = signal.getsignal(signal.SIGVTALRM)
+        self.assertFalse(task.check(program, timeout=0.1, fuel=100))
+        self.assertIs(signal.getsignal(signal.SIGVTALRM), handler)
+        self.assertEqual(signal.getitimer(signal.ITIMER_VIRTUAL), (0.0, 0.0))
+
+    def test_armed_once_for_many_evaluations(self):
+        spin = Primitive("spin", arrow(tint, tint), _spin)
+        task = Task("spin", arrow(tint, tint), [((1,), 1)])
+        identity = Abstraction(Index(0))
+        handler = signal.getsignal(signal.SIGVTALRM)
+        watchdog = EvaluationWatchdog()
+        with mock.patch("dreamcoder.task.WATCHDOG", watchdog):
+            self.assertTrue(watchdog.arm(0.1))
+            self.assertFalse(watchdog.arm(0.1))
+            try:
+                with mock.patch.object(
+                    signal, "setitimer", wraps=signal.setitimer
+                ) as setitimer, mock.patch.object(
+                    signal, "signal", wraps=signal.signal
+                ) as setsignal:
+                    for _ in range(100):
+                        self.assertTrue(task.check(identity, timeout=0.1, fuel=100))
+                    self.assertFalse(
+                        task.check(
+                            Abstraction(Application(spin, Index(0))),
+                            timeout=0.1,
+                            fuel=100,
+                        )
+                    )
+                self.assertEqual(setitimer.call_count, 0)
+                self.assertEqual(setsignal.call_count, 0)
+                self.assertIs(signal.getsignal(signal.SIGVTALRM), watchdog.callBack)
+            finally:
+                watchdog.disarm()
+        self.assertIs(signal.getsignal(signal.SIGVTALRM), handler)
+        self.assertEqual(signal.getitimer(signal.ITIMER_VIRTUAL), (0.0, 0.0))
+
+    def test_reclaim(self):
+        watchdog = EvaluationWatchdog()
+        previous = signal.getsignal(signal.SIGVTALRM)
+        watchdog.arm(1.0)
+        try:
+            signal.signal(signal.SIGVTALRM, lambda *_: None)
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+            watchdog.reclaim()
+            self.assertIs(signal.getsignal(signal.SIGVTALRM), watchdog.callBack)
+            self.assertEqual(signal.getitimer(signal.ITIMER_VIRTUAL)[1], 1.0)
+        finally:
+            watchdog.disarm()
+        self.assertIs(signal.getsignal(signal.SIGVTALRM), previous)
+
+
+if __name__ == "__main__":
+    unittest.main()
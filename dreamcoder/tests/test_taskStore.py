@@ -0,0 +1,51 @@
+import pickle
+import unittest
+
+from dreamcoder.task import Task
+from dreamcoder.taskStore import SharedExamples, picklingByReference, shareTasks
+from dreamcoder.type import arrow, tbool, tint, tlist
+
+
+def get_scene_task(name, n):
+    examples = [
+        (([[i, j, i + j] for j in range(i % 4)],), i % 2 == 0) for i in range(n)
+    ]
+    return Task(name, arrow(tlist(tlist(tint)), tbool), examples)
+
+
+class TestSharedTaskStore(unittest.TestCase):
+    def test_views_match_examples(self):
+        tasks = [get_scene_task("a", 5), get_scene_task("b", 7)]
+        expected = [list(t.examples) for t in tasks]
+        other = Task("add1", arrow(tint, tint), [((x,), x + 1) for x in range(3)])
+
+        store = shareTasks(tasks + [other])
+        self.assertIsNotNone(store)
+        self.assertIsInstance(other.examples, list)
+        for t, examples in zip(tasks, expected):
+            self.assertIsInstance(t.examples, SharedExamples)
+            self.assertEqual(list(t.examples), examples)
+            self.assertEqual(t.examples[-1], examples[-1])
+            self.assertEqual(t.examples[1:3], examples[1:3])
+            self.assertIs(type(t.examples[0][1]), bool)
+
+    def test_pickles_by_reference(self):
+        task = get_scene_task("a", 200)
+        copied = pickle.dumps(task)
+        shareTasks([task])
+        with picklingByReference():
+            shared = pickle.dumps(task)
+        self.assertLess(len(shared), len(copied) / 10)
+        self.assertEqual(list(pickle.loads(shared).examples), list(task.examples))
+
+    def test_pickles_as_list(self):
+        task = get_scene_task("a", 20)
+        expected = list(task.examples)
+        shareTasks([task])
+        examples = pickle.loads(pickle.dumps(task)).examples
+        self.assertIsInstance(examples, list)
+        self.assertEqual(examples, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from dreamcoder.type import (
+    Context,
+    TypeVariable,
+    UnificationFailure,
+    arrow,
+    t0,
+    t1,
+    tint,
+    tlist,
+)
+
+
+class TestContext(unittest.TestCase):
+    def test_unify(self):
+        context, a = Context.EMPTY.makeVariable()
+        context, b = context.makeVariable()
+        extended = context.unify(arrow(a, tlist(b)), arrow(tlist(b), tlist(tint)))
+        self.assertEqual(a.apply(extended), tlist(tint))
+        self.assertEqual(extended.nextVariable, 2)
+        self.assertEqual([v for v, _ in extended.substitution], [1, 0])
+        # Contexts are not changed by unifying them
+        self.assertEqual(a.apply(context), a)
+        self.assertEqual(context.substitution, [])
+        with self.assertRaises(UnificationFailure):
+            extended.unify(b, tlist(tint))
+
+    def test_substitution_round_trip(self):
+        context = Context(3, [(2, tlist(t0)), (0, TypeVariable(1)), (1, tint)])
+        self.assertEqual(str(TypeVariable(2).apply(context)), "list(int)")
+        self.assertEqual(
+            [v for v, _ in Context(3, context.substitution).substitution], [2, 0, 1]
+        )
+
+    def test_apply_keeps_unchanged_types(self):
+        context = Context(2, [(0, tint)])
+        for t in [tlist(tint), arrow(t1, tlist(t1))]:
+            self.assertIs(t.apply(context), t)
+        self.assertEqual(arrow(t0, t1).apply(context), arrow(tint, t1))
+
+
+if __name__ == "__main__":
+    unittest.main()
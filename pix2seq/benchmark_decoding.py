@@ -0,0 +1,76 @@
+"""
+Times autoregressive decoding of the Pix2Seq transformer decoder.
+
+Decodes sequences of 5 tokens per object (4 box coordinates and a class) with
+a randomly initialized transformer of the size given by the usual model
+arguments, feeding random tokens so every run takes the same number of steps.
+Each sequence is decoded twice: with self-attention keys and values kept in a
+preallocated buffer, as Transformer.forward does, and by concatenating them
+every step. Reports tokens/second for both and checks that the decoder
+outputs are the same.
+
+    python benchmark_decoding.py --device cpu --objects 100 --batch_size 4
+"""
+import argparse
+import time
+
+import torch
+from main import get_args_parser
+from playground.pix2seq.transformer import build_transformer
+
+
+def decode(transformer, memory, mask, pos, tokens, preallocate):
+    decoder = transformer.decoder
+    bs = memory.shape[1]
+    memory_kv = decoder.memory_kv(memory, pos)
+    if preallocate:
+        kv_cache = memory.new_zeros(
+            transformer.num_decoder_layers, 2, bs, transformer.nhead, tokens.shape[0] + 1,
+            transformer.d_model // transformer.nhead)
+        pre_kv = list(kv_cache)
+    else:
+        pre_kv = [torch.as_tensor([[], []], device=memory.device) for _ in range(transformer.num_decoder_layers)]
+    input_embed = transformer.det_embed.weight.unsqueeze(0).repeat(bs, 1, 1).transpose(0, 1)
+    outputs = []
+    for seq_i in range(tokens.shape[0]):
+        hs, pre_kv = decoder(
+            input_embed, memory, memory_key_padding_mask=mask, pos=pos, pre_kv_list=pre_kv,
+            memory_kv_list=memory_kv, kv_len=seq_i if preallocate else None)
+        outputs.append(hs)
+        input_embed = transformer.vocal_embed(tokens[seq_i:seq_i + 1])
+    return torch.cat(outputs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Pix2Seq decoding benchmark", parents=[get_args_parser()])
+    parser.add_argument("--objects", default=100, type=int, help="Objects per decoded sequence")
+    parser.add_argument("--feature_size", default=20, type=int, help="Height and width of the backbone features")
+    parser.add_argument("--repeats", default=3, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    num_vocal = 2094
+    transformer = build_transformer(args, num_vocal).to(device).eval()
+
+    bs, hw = args.batch_size, args.feature_size ** 2
+    memory = torch.randn(hw, bs, args.hidden_dim, device=device)
+    pos = torch.randn(hw, bs, args.hidden_dim, device=device)
+    mask = torch.zeros(bs, hw, dtype=torch.bool, device=device)
+    tokens = torch.randint(num_vocal - 2, (5 * args.objects, bs), device=device)
+
+    results = {}
+    with torch.no_grad():
+        for preallocate in [False, True]:
+            best = None
+            for _ in range(args.repeats):
+                start = time.time()
+                results[preallocate] = decode(transformer, memory, mask, pos, tokens, preallocate)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            name = "preallocated buffer" if preallocate else "concatenation"
+            print(f"{name}: {tokens.numel() / best:.0f} tokens/s ({best:.2f}s per batch)")
+
+    difference = (results[True] - results[False]).abs().max().item()
+    print("identical outputs" if torch.equal(results[True], results[False])
+          else f"outputs differ by up to {difference}")
@@ -58,6 +58,12 @@ def get_args_parser():
         action="store_true",
         help="use eos token instead of predicting 100 objects",
     )
+    parser.add_argument(
+        "--constrained_decoding",
+        action="store_true",
+        help="at inference, decode 4 coordinate and 1 class token per object and return the tokens "
+        "instead of the logits, which the loss needs",
+    )
 
     # * Backbone
     parser.add_argument(
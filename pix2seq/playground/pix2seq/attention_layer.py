@@ -13,12 +13,24 @@ class Attention(nn.Module):
         self.attn_drop = nn.Dropout(dropout)
         self.proj = nn.Linear(dim, dim)
 
-    def forward(self, x, pre_kv=None, attn_mask=None):
+    def forward(self, x, pre_kv=None, attn_mask=None, kv_len=None):
+        """
+        At inference pre_kv holds the keys and values of the tokens before x, shape[2, B, nhead, L, C // nhead].
+        Without kv_len, L is the number of these tokens and pre_kv is returned with x's keys and values appended.
+        With kv_len, pre_kv is a preallocated buffer of which the first kv_len tokens are filled: x's keys and values
+        are written after them in place, attention only looks at the filled prefix, and the same buffer is returned.
+        """
         N, B, C = x.shape
         qkv = self.qkv(x).reshape(N, B, 3, self.num_heads, C // self.num_heads).permute(2, 1, 3, 0, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
 
-        if not self.training:
+        if not self.training and kv_len is not None:
+            end = kv_len + N
+            pre_kv[0, :, :, kv_len:end] = k
+            pre_kv[1, :, :, kv_len:end] = v
+            k = pre_kv[0, :, :, :end]
+            v = pre_kv[1, :, :, :end]
+        elif not self.training:
             k = torch.cat([pre_kv[0], k], dim=2)
             v = torch.cat([pre_kv[1], v], dim=2)
             pre_kv = torch.stack([k, v], dim=0)
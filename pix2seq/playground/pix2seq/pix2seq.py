@@ -23,19 +23,22 @@ from util.box_ops import box_cxcywh_to_xyxy
 class Pix2Seq(nn.Module):
     """This is the Pix2Seq module that performs object detection"""
 
-    def __init__(self, backbone, transformer, num_classes, num_bins=2000):
+    def __init__(self, backbone, transformer, num_classes, num_bins=2000, constrained_decoding=False):
         """Initializes the model.
         Parameters:
             backbone: torch module of the backbone to be used. See backbone.py
             transformer: torch module of the transformer architecture. See transformer.py
             num_classes: number of object classes
             num_bins: number of bins for each side of the input image
+            constrained_decoding: at inference, only decode coordinate and class tokens where they belong in an
+                object and return the tokens instead of the logits, see Transformer.forward
         """
         super().__init__()
         self.transformer = transformer
         hidden_dim = transformer.d_model
         self.num_classes = num_classes
         self.num_bins = num_bins
+        self.constrained_decoding = constrained_decoding
         self.input_proj = nn.Sequential(
             nn.Conv2d(backbone.num_channels, hidden_dim, kernel_size=(1, 1)),
             nn.GroupNorm(32, hidden_dim),
@@ -53,6 +56,10 @@ class Pix2Seq(nn.Module):
         It returns a dict with the following elements:
            - "pred_logits": the classification logits (including no-object) for all vocabulary.
                             Shape= [batch_size, num_sequence, num_vocal]
+        or, at inference with constrained_decoding:
+           - "pred_seq": for each image the tokens of its objects, 4 coordinates and a class each.
+                         Shape= [num_objects, 5]
+           - "pred_scores": for each image the probabilities of its objects' class tokens. Shape= [num_objects]
         """
         image_tensor, targets = samples[0], samples[1]
         if isinstance(image_tensor, (list, torch.Tensor)):
@@ -66,6 +73,9 @@ class Pix2Seq(nn.Module):
         src = self.input_proj(src)
         if self.training:
             out = self.forward_train(src, targets, mask, pos[-1])
+        elif self.constrained_decoding:
+            pred_seq, pred_scores = self.transformer(src, -1, mask, pos[-1], num_bins=self.num_bins)
+            return {"pred_seq": pred_seq, "pred_scores": pred_scores}
         else:
             out = self.forward_inference(src, mask, pos[-1])
 
@@ -268,6 +278,36 @@ class PostProcess(nn.Module):
         self.num_bins = num_bins
         self.num_classes = num_classes
 
+    @torch.no_grad()
+    def decode_tokens(self, outputs, origin_img_sizes, input_img_sizes):
+        """Boxes, labels and scores of the objects a model with constrained_decoding returns as tokens"""
+        assert len(outputs["pred_seq"]) == len(origin_img_sizes)
+        ori_img_h, ori_img_w = origin_img_sizes.unbind(1)
+        inp_img_h, inp_img_w = input_img_sizes.unbind(1)
+        scale_fct = torch.stack(
+            [
+                ori_img_w / inp_img_w,
+                ori_img_h / inp_img_h,
+                ori_img_w / inp_img_w,
+                ori_img_h / inp_img_h,
+            ],
+            dim=1,
+        ).unsqueeze(1)
+
+        results = []
+        for b_i, (pred_seq, pred_scores) in enumerate(
+            zip(outputs["pred_seq"], outputs["pred_scores"])
+        ):
+            if len(pred_seq) == 0:
+                results.append(dict())
+                continue
+            result = dict()
+            result["scores"] = pred_scores
+            result["labels"] = pred_seq[:, 4] - self.num_bins - 1
+            result["boxes"] = pred_seq[:, :4] * 1333 / self.num_bins * scale_fct[b_i]
+            results.append(result)
+        return results
+
     @torch.no_grad()
     def forward(self, outputs, targets):
         """Perform the computation
@@ -280,6 +320,8 @@ class PostProcess(nn.Module):
         """
         origin_img_sizes = torch.stack([t["orig_size"] for t in targets], dim=0)
         input_img_sizes = torch.stack([t["size"] for t in targets], dim=0)
+        if "pred_seq" in outputs:
+            return self.decode_tokens(outputs, origin_img_sizes, input_img_sizes)
         out_seq_logits = outputs["pred_seq_logits"]
 
         assert len(out_seq_logits) == len(origin_img_sizes)
@@ -323,13 +365,21 @@ class PostProcess(nn.Module):
 
         return results
 
+    # Tokens get_output_seq ends a sequence at: the end token and, if there is none, the noise token
+    EOS_TOKENS = (2092, 2093)
+
     @torch.no_grad()
     def get_output_seq(self, outputs, targets):
+        """
+        Boxes, labels and scores of the objects in every image, as lists, for writing as JSON. A sequence of logits
+        ends at the first step whose most likely token is the end token, or else the noise token, and each 5 steps
+        before that are the 4 coordinates and the class of an object.
+
+        The whole batch is decoded at once: the most likely tokens of all steps are found with one argmax, and only
+        the steps of class tokens are normalized, by the log-sum-exp over the vocabulary a score is the softmax of.
+        """
         origin_img_sizes = torch.stack([t["orig_size"] for t in targets], dim=0)
         input_img_sizes = torch.stack([t["size"] for t in targets], dim=0)
-        out_seq_logits = outputs["pred_seq_logits"]
-
-        assert len(out_seq_logits) == len(origin_img_sizes)
 
         # and from relative [0, 1] to absolute [0, height] coordinates
         ori_img_h, ori_img_w = origin_img_sizes.unbind(1)
@@ -342,55 +392,86 @@ class PostProcess(nn.Module):
                 ori_img_h / inp_img_h,
             ],
             dim=1,
-        ).unsqueeze(1)
-
-        results = []
-        for b_i, pred_seq_logits in enumerate(out_seq_logits):
-            pred_seq_logits = pred_seq_logits.softmax(dim=-1)
-            test_seq = pred_seq_logits.argmax(dim=1).tolist()
-            try:
-                eos = test_seq.index(2092)
-            except ValueError:
-                try:
-                    eos = test_seq.index(2093)
-                except ValueError:
-                    eos = len(test_seq)
-                    # raise ValueError("No end token found in the sequence")
-
-            pred_seq_logits = pred_seq_logits[:eos]
-
-            seq_len = pred_seq_logits.shape[0]
-            if seq_len < 5:
-                results.append(dict())
-                continue
-            num_objects = seq_len // 5
-        
-
-            # scaling needed for boxes to meet instances.json. Not needed for classes 2002 etc.
-            # test_seq = test_seq * scale_fct[b_i]
+        )
 
-            pred_seq_logits = pred_seq_logits[: int(num_objects * 5)].reshape(
-                num_objects, 5, -1
+        if "pred_seq" in outputs:
+            assert len(outputs["pred_seq"]) == len(origin_img_sizes)
+            num_objects = torch.tensor(
+                [len(s) for s in outputs["pred_seq"]], device=scale_fct.device
             )
+            pred_seq = torch.cat(outputs["pred_seq"])
+            scores = torch.cat(outputs["pred_scores"])
+            boxes, labels = pred_seq[:, :4], pred_seq[:, 4] - self.num_bins - 1
+        else:
+            out_seq_logits = outputs["pred_seq_logits"]
+            assert len(out_seq_logits) == len(origin_img_sizes)
+            num_objects, boxes, labels, scores = self.decode_logits(out_seq_logits)
 
-            # separate boxes and classes
-            pred_boxes_logits = pred_seq_logits[:, :4, : self.num_bins + 1]
-            pred_class_logits = pred_seq_logits[
-                :, 4, self.num_bins + 1 : self.num_bins + 1 + self.num_classes
-            ]
-
-            scores_per_image, labels_per_image = torch.max(pred_class_logits, dim=1)
-            boxes_per_image = pred_boxes_logits.argmax(dim=2) * 1333 / self.num_bins
-            boxes_per_image = boxes_per_image * scale_fct[b_i]
+        # scaling needed for boxes to meet instances.json. Not needed for classes 2002 etc.
+        image = torch.repeat_interleave(
+            torch.arange(len(num_objects), device=num_objects.device), num_objects
+        )
+        boxes = boxes * 1333 / self.num_bins * scale_fct[image]
 
+        # One copy to the host for the whole batch
+        counts = num_objects.tolist()
+        boxes, labels, scores = boxes.tolist(), labels.tolist(), scores.tolist()
+        results = []
+        start = 0
+        for n in counts:
+            if n == 0:
+                results.append(dict())
+                continue
             result = dict()
-            result["scores"] = scores_per_image.cpu().numpy().tolist()
-            result["labels"] = labels_per_image.cpu().numpy().tolist()
-            result["boxes"] = boxes_per_image.cpu().numpy().tolist()
+            result["scores"] = scores[start : start + n]
+            result["labels"] = labels[start : start + n]
+            result["boxes"] = boxes[start : start + n]
             results.append(result)
+            start += n
 
         return results
 
+    def decode_logits(self, out_seq_logits):
+        """
+        Objects in sequences of logits, see get_output_seq. Returns the number of objects of each sequence, shape[B],
+        and, for the objects of all sequences one after the other, their coordinate tokens, shape[N, 4], labels,
+        shape[N], and scores, shape[N].
+        """
+        lengths = torch.tensor(
+            [len(l) for l in out_seq_logits], device=out_seq_logits[0].device
+        )
+        steps = torch.cat(list(out_seq_logits))
+        if int(lengths.max()) == 0:
+            # Every sequence ended at its first step
+            no_tokens = lengths.new_zeros(0)
+            return lengths, no_tokens.reshape(0, 4), no_tokens, steps.new_zeros(0)
+        # Most likely tokens, in a [B, max length] tensor padded with -1
+        tokens = steps.new_full((len(lengths), int(lengths.max())), -1, dtype=torch.long)
+        in_sequence = torch.arange(tokens.shape[1], device=lengths.device) < lengths[:, None]
+        tokens[in_sequence] = steps.argmax(dim=-1)
+
+        eos = lengths
+        for token in reversed(self.EOS_TOKENS):
+            is_token = tokens == token
+            # argmax gives the first of the maximal values
+            eos = torch.where(is_token.any(dim=1), is_token.int().argmax(dim=1), eos)
+        num_objects = eos // 5
+
+        # Index in steps of the first token of every object
+        first_steps = torch.cumsum(lengths, 0) - lengths
+        first_objects = torch.cumsum(num_objects, 0) - num_objects
+        object_steps = torch.repeat_interleave(first_steps - 5 * first_objects, num_objects)
+        object_steps = object_steps + 5 * torch.arange(len(object_steps), device=lengths.device)
+
+        box_steps = object_steps[:, None] + torch.arange(4, device=lengths.device)
+        boxes = steps[box_steps, : self.num_bins + 1].argmax(dim=-1)
+        class_logits = steps[object_steps + 4]
+        best, labels = class_logits[
+            :, self.num_bins + 1 : self.num_bins + 1 + self.num_classes
+        ].max(dim=1)
+        scores = torch.exp(best - torch.logsumexp(class_logits, dim=-1))
+        return num_objects, boxes, labels, scores
+
 
 def build(args):
     # the `num_classes` naming here is somewhat misleading.
@@ -419,7 +500,13 @@ def build(args):
 
     transformer = build_transformer(args, num_vocal)
 
-    model = Pix2Seq(backbone, transformer, num_classes=num_classes, num_bins=num_bins)
+    model = Pix2Seq(
+        backbone,
+        transformer,
+        num_classes=num_classes,
+        num_bins=num_bins,
+        constrained_decoding=args.constrained_decoding,
+    )
 
     weight_dict = {"loss_seq": 1}
     criterion = SetCriterion(
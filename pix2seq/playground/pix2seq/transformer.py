@@ -50,13 +50,18 @@ class Transformer(nn.Module):
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
 
-    def forward(self, src, input_seq, mask, pos_embed):
+    def forward(self, src, input_seq, mask, pos_embed, num_bins=None):
         """
         Args:
             src: shape[B, C, H, W]
             input_seq: shape[B, 501, C] for training and shape[B, 1, C] for inference
             mask: shape[B, H, W]
             pos_embed: shape[B, C, H, W]
+            num_bins: at inference, decode objects as 4 coordinate tokens in [0, num_bins] followed by a class token
+                and return for each image its tokens, shape[N, 5], and the probabilities of the class tokens, shape[N],
+                instead of the logits of every step. A sequence ends, whether or not pred_eos is set, where
+                PostProcess.get_output_seq ends the logits of the same steps: at the first step whose most likely
+                token is the end token or, if there is none, the noise token. Only the objects before it are kept
         """
         # flatten NxCxHxW to HWxNxC
         bs = src.shape[0]
@@ -86,35 +91,85 @@ class Transformer(nn.Module):
             pred_seq_logits = self.vocal_classifier(hs.transpose(0, 1))
             return pred_seq_logits
         else:
-            end = torch.zeros(bs).bool().to(memory.device)
             end_lens = torch.zeros(bs).long().to(memory.device)
             input_embed = self.det_embed.weight.unsqueeze(0).repeat(bs, 1, 1).transpose(0, 1)
+            # memory is the same at every step, so its keys and values are projected once
+            memory_kv = self.decoder.memory_kv(memory, pos_embed)
+            # Self-attention keys and values of every layer, filled in place one token per step. There is room for
+            # as many tokens as a training sequence has, more than the steps below
+            kv_cache = memory.new_zeros(
+                self.num_decoder_layers, 2, bs, self.nhead, 501, self.d_model // self.nhead)
+            pre_kv = list(kv_cache)
+            # Sequences still being decoded, by their index in the batch. Once a sequence has ended nothing it
+            # predicts is returned, so it is dropped from memory, mask and caches, and later steps only decode the
+            # others. The logits of every step are kept with the indices of the sequences they belong to
+            active = torch.arange(bs, device=memory.device)
             pred_seq_logits = []
+            constrained = num_bins is not None
+            if constrained:
+                class_tokens = (num_bins + 1, self.num_vocal - 2)
+                pred_seq = torch.zeros(bs, 500, dtype=torch.long, device=memory.device)
+                pred_scores = memory.new_zeros(bs, 100)
+                # Sequences that do not end keep every object
+                end_lens.fill_(500)
+                noise_lens = torch.full_like(end_lens, 500)
             for seq_i in range(500):
                 hs, pre_kv = self.decoder(
                     input_embed,
                     memory,
                     memory_key_padding_mask=mask,
                     pos=pos_embed,
-                    pre_kv_list=pre_kv)
+                    pre_kv_list=pre_kv,
+                    memory_kv_list=memory_kv,
+                    kv_len=seq_i)
                 similarity = self.vocal_classifier(hs)
-                pred_seq_logits.append(similarity.transpose(0, 1))
-
-                if self.pred_eos:
-                    is_eos = similarity[:, :, :self.num_vocal - 1].argmax(dim=-1)
-                    stop_state = is_eos.squeeze(0).eq(self.num_vocal - 2)
-                    end_lens += seq_i * (~end * stop_state)
-                    end = (stop_state + end).bool()
-                    if end.all() and seq_i > 4:
+                stop_state = None
+                if constrained:
+                    low, high = (0, num_bins + 1) if seq_i % 5 < 4 else class_tokens
+                    pred_token = similarity[:, :, low:high].argmax(dim=-1) + low
+                    pred_seq[active, seq_i] = pred_token[0]
+                    if seq_i % 5 == 4:
+                        probabilities = similarity[0].softmax(dim=-1)[:, low:high]
+                        pred_scores[active, seq_i // 5] = probabilities.max(dim=-1)[0]
+                    # The first noise token only ends a sequence with no end token, so decoding goes on after it
+                    most_likely = similarity[0].argmax(dim=-1)
+                    is_noise = most_likely.eq(self.num_vocal - 1) & noise_lens[active].eq(500)
+                    noise_lens[active[is_noise]] = seq_i
+                    stop_state = most_likely.eq(self.num_vocal - 2)
+                else:
+                    pred_seq_logits.append((active, similarity[0]))
+                    pred_token = similarity[:, :, :self.num_vocal - 2].argmax(dim=-1)
+                    if self.pred_eos:
+                        is_eos = similarity[:, :, :self.num_vocal - 1].argmax(dim=-1)
+                        stop_state = is_eos.squeeze(0).eq(self.num_vocal - 2)
+
+                if stop_state is not None and stop_state.any():
+                    end_lens[active[stop_state]] = seq_i
+                    keep = ~stop_state
+                    if not keep.any():
                         break
+                    active = active[keep]
+                    memory = memory[:, keep]
+                    pos_embed = pos_embed[:, keep]
+                    mask = mask[keep]
+                    memory_kv = [kv[:, keep] for kv in memory_kv]
+                    pre_kv = [kv[:, keep] for kv in pre_kv]
+                    pred_token = pred_token[:, keep]
 
-                pred_token = similarity[:, :, :self.num_vocal - 2].argmax(dim=-1)
                 input_embed = self.vocal_embed(pred_token)
 
+            if constrained:
+                end_lens = torch.where(end_lens < 500, end_lens, noise_lens)
+                num_objects = (end_lens // 5).tolist()
+                return ([seq[:5 * n].reshape(n, 5) for n, seq in zip(num_objects, pred_seq)],
+                        [scores[:n] for n, scores in zip(num_objects, pred_scores)])
             if not self.pred_eos:
                 end_lens = end_lens.fill_(500)
-            pred_seq_logits = torch.cat(pred_seq_logits, dim=1)
-            pred_seq_logits = [psl[:end_idx] for end_idx, psl in zip(end_lens, pred_seq_logits)]
+            logits = pred_seq_logits[0][1]
+            out = logits.new_zeros(bs, len(pred_seq_logits), logits.shape[-1])
+            for step, (index, logits) in enumerate(pred_seq_logits):
+                out[index, step] = logits
+            pred_seq_logits = [psl[:end_idx] for end_idx, psl in zip(end_lens, out)]
             return pred_seq_logits
 
 
@@ -148,17 +203,26 @@ class TransformerDecoder(nn.Module):
         self.num_layers = num_layers
         self.norm = norm
 
-    def forward(self, tgt, memory, memory_key_padding_mask, pos, pre_kv_list=None, self_attn_mask=None):
+    def memory_kv(self, memory, pos):
+        """Cross-attention keys and values of memory for each layer, see TransformerDecoderLayer.memory_kv"""
+        return [layer.memory_kv(memory, pos) for layer in self.layers]
+
+    def forward(self, tgt, memory, memory_key_padding_mask, pos, pre_kv_list=None, self_attn_mask=None,
+                memory_kv_list=None, kv_len=None):
         output = tgt
         cur_kv_list = []
-        for layer, pre_kv in zip(self.layers, pre_kv_list):
+        if memory_kv_list is None:
+            memory_kv_list = [None] * self.num_layers
+        for layer, pre_kv, memory_kv in zip(self.layers, pre_kv_list, memory_kv_list):
             output, cur_kv = layer(
                 output,
                 memory,
                 memory_key_padding_mask=memory_key_padding_mask,
                 pos=pos,
                 self_attn_mask=self_attn_mask,
-                pre_kv=pre_kv)
+                pre_kv=pre_kv,
+                memory_kv=memory_kv,
+                kv_len=kv_len)
             cur_kv_list.append(cur_kv)
 
         if self.norm is not None:
@@ -247,6 +311,47 @@ class TransformerDecoderLayer(nn.Module):
     def with_pos_embed(self, tensor, pos: Optional[Tensor]):
         return tensor if pos is None else tensor + pos
 
+    def _in_projection(self, x, i):
+        """Projects x like multihead_attn projects its query (i = 0), key (1) or value (2)"""
+        attn = self.multihead_attn
+        E = attn.embed_dim
+        weight = attn.in_proj_weight[i * E:(i + 1) * E]
+        bias = None if attn.in_proj_bias is None else attn.in_proj_bias[i * E:(i + 1) * E]
+        x = F.linear(x, weight, bias)
+        # [L, B, C] -> [B, nhead, L, C // nhead]
+        L, B, _ = x.shape
+        return x.reshape(L, B, attn.num_heads, attn.head_dim).permute(1, 2, 0, 3)
+
+    def memory_kv(self, memory, pos: Optional[Tensor] = None):
+        """
+        Keys and values multihead_attn computes from memory, shape[2, B, nhead, HW, C // nhead]. They do not depend on
+        the decoded tokens, so autoregressive decoding computes them once and passes them to every step as memory_kv.
+        """
+        return torch.stack([self._in_projection(self.with_pos_embed(memory, pos), 1),
+                            self._in_projection(memory, 2)], dim=0)
+
+    def cross_attn(self, tgt, memory, memory_key_padding_mask: Optional[Tensor] = None,
+                   pos: Optional[Tensor] = None, memory_kv=None):
+        """multihead_attn over memory, reusing its keys and values from memory_kv when given"""
+        if memory_kv is None:
+            return self.multihead_attn(
+                query=tgt,
+                key=self.with_pos_embed(memory, pos),
+                value=memory,
+                key_padding_mask=memory_key_padding_mask,
+            )[0]
+        attn = self.multihead_attn
+        N, B, C = tgt.shape
+        q = self._in_projection(tgt, 0) * attn.head_dim ** -0.5
+        k, v = memory_kv[0], memory_kv[1]
+        weights = q @ k.transpose(-2, -1)
+        if memory_key_padding_mask is not None:
+            weights = weights.masked_fill(memory_key_padding_mask[:, None, None, :], float('-inf'))
+        weights = weights.softmax(dim=-1)
+        weights = F.dropout(weights, p=attn.dropout, training=self.training)
+        x = (weights @ v).permute(2, 0, 1, 3).reshape(N, B, C)
+        return attn.out_proj(x)
+
     def forward_post(
             self,
             tgt,
@@ -255,16 +360,13 @@ class TransformerDecoderLayer(nn.Module):
             pos: Optional[Tensor] = None,
             self_attn_mask: Optional[Tensor] = None,
             pre_kv=None,
+            memory_kv=None,
+            kv_len=None,
     ):
-        tgt2, pre_kv = self.self_attn(tgt, pre_kv=pre_kv, attn_mask=self_attn_mask)
+        tgt2, pre_kv = self.self_attn(tgt, pre_kv=pre_kv, attn_mask=self_attn_mask, kv_len=kv_len)
         tgt = tgt + self.dropout1(tgt2)
         tgt = self.norm1(tgt)
-        tgt2 = self.multihead_attn(
-            query=tgt,
-            key=self.with_pos_embed(memory, pos),
-            value=memory,
-            key_padding_mask=memory_key_padding_mask,
-        )[0]
+        tgt2 = self.cross_attn(tgt, memory, memory_key_padding_mask, pos, memory_kv)
         tgt = tgt + self.dropout2(tgt2)
         tgt = self.norm2(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt))))
@@ -280,17 +382,14 @@ class TransformerDecoderLayer(nn.Module):
             pos: Optional[Tensor] = None,
             self_attn_mask: Optional[Tensor] = None,
             pre_kv=None,
+            memory_kv=None,
+            kv_len=None,
     ):
         tgt2 = self.norm1(tgt)
-        tgt2, pre_kv = self.self_attn(tgt2, pre_kv=pre_kv, attn_mask=self_attn_mask)
+        tgt2, pre_kv = self.self_attn(tgt2, pre_kv=pre_kv, attn_mask=self_attn_mask, kv_len=kv_len)
         tgt = tgt + self.dropout1(tgt2)
         tgt2 = self.norm2(tgt)
-        tgt2 = self.multihead_attn(
-            query=tgt2,
-            key=self.with_pos_embed(memory, pos),
-            value=memory,
-            key_padding_mask=memory_key_padding_mask,
-        )[0]
+        tgt2 = self.cross_attn(tgt2, memory, memory_key_padding_mask, pos, memory_kv)
         tgt = tgt + self.dropout2(tgt2)
         tgt2 = self.norm3(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
@@ -305,10 +404,14 @@ class TransformerDecoderLayer(nn.Module):
             pos: Optional[Tensor] = None,
             self_attn_mask: Optional[Tensor] = None,
             pre_kv=None,
+            memory_kv=None,
+            kv_len=None,
     ):
         if self.normalize_before:
-            return self.forward_pre(tgt, memory, memory_key_padding_mask, pos, self_attn_mask, pre_kv)
-        return self.forward_post(tgt, memory, memory_key_padding_mask, pos, self_attn_mask, pre_kv)
+            return self.forward_pre(
+                tgt, memory, memory_key_padding_mask, pos, self_attn_mask, pre_kv, memory_kv, kv_len)
+        return self.forward_post(
+            tgt, memory, memory_key_padding_mask, pos, self_attn_mask, pre_kv, memory_kv, kv_len)
 
 
 class MLP(nn.Module):
@@ -0,0 +1,36 @@
+import unittest
+
+import torch
+
+from playground.pix2seq.pix2seq import PostProcess
+
+NUM_BINS = 2000
+NUM_CLASSES = 91
+NUM_VOCAL = NUM_BINS + 1 + NUM_CLASSES + 2
+
+
+def targets(batch_size):
+    return [{"orig_size": torch.tensor([480, 640]), "size": torch.tensor([800, 1066])} for _ in range(batch_size)]
+
+
+class TestGetOutputSeq(unittest.TestCase):
+    def setUp(self):
+        self.postprocess = PostProcess(NUM_BINS, NUM_CLASSES)
+
+    def test_empty_sequences(self):
+        outputs = {"pred_seq_logits": [torch.zeros(0, NUM_VOCAL), torch.zeros(0, NUM_VOCAL)]}
+        self.assertEqual(self.postprocess.get_output_seq(outputs, targets(2)), [dict(), dict()])
+
+    def test_some_empty_sequences(self):
+        logits = torch.zeros(7, NUM_VOCAL)
+        logits[:4, 10] = 1.0
+        logits[4, NUM_BINS + 3] = 1.0
+        outputs = {"pred_seq_logits": [torch.zeros(0, NUM_VOCAL), logits]}
+        results = self.postprocess.get_output_seq(outputs, targets(2))
+        self.assertEqual(results[0], dict())
+        self.assertEqual(results[1]["labels"], [2])
+        self.assertEqual(len(results[1]["boxes"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
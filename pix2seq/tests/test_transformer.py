@@ -0,0 +1,134 @@
+import unittest
+
+import torch
+from torch import nn
+
+from playground.pix2seq.pix2seq import PostProcess
+from playground.pix2seq.transformer import Transformer
+
+NUM_BINS = 2000
+NUM_CLASSES = 91
+NUM_VOCAL = NUM_BINS + 1 + NUM_CLASSES + 2
+END, NOISE = NUM_VOCAL - 2, NUM_VOCAL - 1
+
+
+class ScriptedClassifier(nn.Module):
+    """Stands in for vocal_classifier: the most likely token of every step is a coordinate or a class token where
+    one belongs in an object, or the token the script gives for that step"""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = script
+        self.step = 0
+
+    def forward(self, hs):
+        logits = hs.new_zeros(hs.shape[0], hs.shape[1], NUM_VOCAL)
+        logits[..., 7 if self.step % 5 < 4 else NUM_BINS + 4] = 1.0
+        if self.step in self.script:
+            logits[..., self.script[self.step]] = 2.0
+        self.step += 1
+        return logits
+
+
+class TestConstrainedDecoding(unittest.TestCase):
+    def decode(self, script, constrained):
+        torch.manual_seed(0)
+        transformer = Transformer(
+            d_model=32, nhead=4, num_encoder_layers=1, num_decoder_layers=1, dim_feedforward=64,
+            num_vocal=NUM_VOCAL).eval()
+        transformer.vocal_classifier = ScriptedClassifier(script)
+        src, pos = torch.randn(1, 32, 2, 2), torch.randn(1, 32, 2, 2)
+        mask = torch.zeros(1, 2, 2, dtype=torch.bool)
+        with torch.no_grad():
+            return transformer(src, -1, mask, pos, num_bins=NUM_BINS if constrained else None)
+
+    def test_object_counts_match_unconstrained_decoding(self):
+        scripts = [{}, {37: END}, {40: END}, {12: NOISE, 300: END}, {12: NOISE, 8: END}, {12: NOISE, 31: NOISE}]
+        for script in scripts:
+            pred_seq, pred_scores = self.decode(script, constrained=True)
+            num_objects, _, labels, _ = PostProcess(NUM_BINS, NUM_CLASSES).decode_logits(
+                self.decode(script, constrained=False))
+            self.assertEqual(len(pred_seq[0]), num_objects.item(), script)
+            self.assertEqual(len(pred_scores[0]), num_objects.item(), script)
+            self.assertEqual((pred_seq[0][:, 4] - NUM_BINS - 1).tolist(), labels.tolist(), script)
+
+
+class EndingClassifier(nn.Module):
+    """Wraps vocal_classifier so that sequence b of the batch predicts the end token at step ends[b] and never
+    before. Decoding that drops ended sequences from the batch is followed by dropping them here too"""
+
+    def __init__(self, classifier, ends):
+        super().__init__()
+        self.classifier = classifier
+        self.ends = ends
+        self.active = list(range(len(ends)))
+        self.step = 0
+
+    def forward(self, hs):
+        if hs.shape[1] < len(self.active):
+            self.active = [b for b in self.active if self.ends[b] >= self.step]
+        logits = self.classifier(hs)
+        logits[..., END] = -1e4
+        for row, b in enumerate(self.active):
+            if self.ends[b] == self.step:
+                logits[:, row, END] = 1e4
+        self.step += 1
+        return logits
+
+
+def baseline_logits(transformer, src, mask, pos):
+    """The logits decoding gave before the memory keys and values were projected once, the self-attention keys
+    and values were kept in a buffer and ended sequences were dropped: cross-attention by nn.MultiheadAttention,
+    self-attention keys and values concatenated at every step and every sequence decoded to the last step"""
+    bs = src.shape[0]
+    src = src.flatten(2).permute(2, 0, 1)
+    mask = mask.flatten(1)
+    pos = pos.flatten(2).permute(2, 0, 1)
+    memory = transformer.encoder(src, src_key_padding_mask=mask, pos=pos)
+    pre_kv = [torch.as_tensor([[], []]) for _ in range(transformer.num_decoder_layers)]
+    end = torch.zeros(bs).bool()
+    end_lens = torch.zeros(bs).long()
+    input_embed = transformer.det_embed.weight.unsqueeze(0).repeat(bs, 1, 1).transpose(0, 1)
+    pred_seq_logits = []
+    for seq_i in range(500):
+        hs, pre_kv = transformer.decoder(input_embed, memory, memory_key_padding_mask=mask, pos=pos,
+                                         pre_kv_list=pre_kv)
+        similarity = transformer.vocal_classifier(hs)
+        pred_seq_logits.append(similarity.transpose(0, 1))
+        stop_state = similarity[:, :, :NUM_VOCAL - 1].argmax(dim=-1).squeeze(0).eq(END)
+        end_lens += seq_i * (~end * stop_state)
+        end = end | stop_state
+        if end.all():
+            break
+        pred_token = similarity[:, :, :NUM_VOCAL - 2].argmax(dim=-1)
+        input_embed = transformer.vocal_embed(pred_token)
+    pred_seq_logits = torch.cat(pred_seq_logits, dim=1)
+    return [psl[:end_idx] for end_idx, psl in zip(end_lens, pred_seq_logits)]
+
+
+class TestIncrementalDecoding(unittest.TestCase):
+    def test_logits_match_baseline_decoding(self):
+        ends = [7, 23, 12]
+        torch.manual_seed(0)
+        transformer = Transformer(
+            d_model=32, nhead=4, num_encoder_layers=1, num_decoder_layers=2, dim_feedforward=64,
+            num_vocal=NUM_VOCAL, pred_eos=True).eval()
+        classifier = transformer.vocal_classifier
+        src, pos = torch.randn(len(ends), 32, 3, 3), torch.randn(len(ends), 32, 3, 3)
+        # Images of different sizes, padded to the largest
+        mask = torch.zeros(len(ends), 3, 3, dtype=torch.bool)
+        mask[1, 2:] = True
+        mask[2, :, 1:] = True
+        with torch.no_grad():
+            transformer.vocal_classifier = EndingClassifier(classifier, ends)
+            expected = baseline_logits(transformer, src, mask, pos)
+            transformer.vocal_classifier = EndingClassifier(classifier, ends)
+            actual = transformer(src, -1, mask, pos)
+        self.assertEqual([len(logits) for logits in expected], ends)
+        self.assertEqual([len(logits) for logits in actual], ends)
+        for a, e in zip(actual, expected):
+            self.assertTrue(torch.allclose(a, e, atol=1e-5), (a - e).abs().max())
+
+
+if __name__ == "__main__":
+    unittest.main()